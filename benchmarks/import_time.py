@@ -0,0 +1,62 @@
+"""
+Guard against regressions in server startup time.
+
+Imports `fossil_mastodon.server` in fresh interpreters and reports the median wall time,
+along with the slowest individual imports (via `python -X importtime`). Exits non-zero
+if the median exceeds the budget.
+
+    python benchmarks/import_time.py --budget 1.0
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+MODULE = "fossil_mastodon.server"
+
+
+def time_import(module: str) -> float:
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module: str, top: int) -> list[tuple[int, str]]:
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         check=True, capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.strip() != module:
+            rows.append((int(cumulative), name.rstrip()))
+    # Nested imports are indented, and also counted in their parent's cumulative time
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=1.0, help="Max median import time, in seconds")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Number of slow imports to list")
+    args = parser.parse_args()
+
+    # The first run warms the bytecode & asset caches, don't count it
+    time_import(MODULE)
+    times = [time_import(MODULE) for _ in range(args.runs)]
+    median = statistics.median(times)
+
+    print(f"import {MODULE}: median {median:.3f}s over {args.runs} runs (budget {args.budget:.3f}s)")
+    for us, name in slowest_imports(MODULE, args.top):
+        print(f"  {us / 1e6:7.3f}s {name}")
+
+    if median > args.budget:
+        print("FAIL: import time is over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
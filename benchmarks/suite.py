@@ -0,0 +1,240 @@
+"""
+Reproducible, offline benchmarks for ingest, train and render.
+
+Generates a synthetic home timeline, serves it from a fake Mastodon server, and uses fake
+(deterministic) embedding & summarizing models, all against a temporary SQLite database.
+Nothing touches the network or your real fossil.db.
+
+    python benchmarks/suite.py --toots 5000 --out results.json
+    python benchmarks/suite.py --toots 5000 --compare results.json
+
+Results are written as JSON so that runs can be compared across commits.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic  # noqa: E402
+
+
+MASTO_BASE = "https://fossil-benchmark.invalid"
+
+
+def peak_rss_mb() -> float:
+    """
+    The process's peak memory use so far. The stages share a process, so this only ever goes
+    up: a stage's number is the peak of that stage and everything before it.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def timed(fn, repeat: int = 1) -> dict:
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return {
+        "result": result,
+        "median_seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "runs": repeat,
+    }
+
+
+@contextlib.contextmanager
+def fake_models():
+    import llm
+    import tiktoken
+    from fossil_mastodon import tokens
+
+    embedding_model = synthetic.FakeEmbeddingModel()
+    summarize_model = synthetic.FakeSummarizeModel()
+    encoding = synthetic.FakeEncoding()
+    with mock.patch.object(llm, "get_embedding_model", lambda *a, **kw: embedding_model), \
+         mock.patch.object(llm, "get_model", lambda *a, **kw: summarize_model), \
+         mock.patch.object(tiktoken, "encoding_for_model", lambda *a, **kw: encoding), \
+         mock.patch.object(tiktoken, "get_encoding", lambda *a, **kw: encoding):
+        # Encoders are cached per model, don't keep the fake one around
+        tokens.get_encoding.cache_clear()
+        try:
+            yield
+        finally:
+            tokens.get_encoding.cache_clear()
+
+
+def fake_request(app):
+    from starlette.requests import Request
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/toots/train",
+        "headers": [],
+        "query_string": b"",
+        "app": app,
+        "router": app.router,
+    })
+
+
+def run(args) -> dict:
+    from fossil_mastodon import algorithm, client, config, core, plugins, server, ui
+    from fossil_mastodon.plugin_impl import topic_cluster
+
+    if config.ConfigHandler.DATABASE_PATH != os.environ["DATABASE_PATH"]:
+        sys.exit("A .env file is overriding DATABASE_PATH; run the benchmarks from a directory without one")
+
+    results = {}
+    session = core.Session.get_or_create()
+    now = datetime.datetime.utcnow()
+    window = datetime.timedelta(hours=args.hours)
+
+    # Ingest
+    statuses = synthetic.generate_statuses(args.toots, hours=args.hours, seed=args.seed)
+    adapter = synthetic.FakeMastodonAdapter(MASTO_BASE, statuses)
+    client.get_client().session.mount(MASTO_BASE, adapter)
+    stats = timed(lambda: core.download_timeline(now - window - datetime.timedelta(hours=1), session.id))
+    del stats["result"]
+    results["download_timeline"] = {
+        **stats,
+        "toots": args.toots,
+        "toots_per_second": args.toots / stats["median_seconds"],
+        "api_requests": adapter.requests,
+        "peak_rss_mb_so_far": peak_rss_mb(),
+    }
+
+    # Query
+    for label, hours in [("6h", 6), ("24h", 24), ("1w", 24 * 7)]:
+        stats = timed(lambda: len(core.Toot.get_toots_since(datetime.datetime.utcnow() - datetime.timedelta(hours=hours))), args.repeat)
+        count = stats.pop("result")
+        results[f"get_toots_since_{label}"] = {**stats, "toots": count, "peak_rss_mb_so_far": peak_rss_mb()}
+
+    # Train
+    context = algorithm.TrainContext(end_time=datetime.datetime.utcnow(), timedelta=window, session_id=session.id)
+    stats = timed(lambda: topic_cluster.TopicCluster.train(context, {"num_clusters": str(args.clusters)}))
+    model = stats.pop("result")
+    results["topic_cluster_train"] = {**stats, "clusters": args.clusters, "peak_rss_mb_so_far": peak_rss_mb()}
+
+    # Render. The first render assigns & caches clusters, later ones read the cache.
+    toots = core.Toot.get_toots_since(datetime.datetime.utcnow() - window)
+    link_style = ui.LinkStyle("desktop")
+    render_context = plugins.RenderContext(
+        templates=server.templates,
+        request=fake_request(server.app),
+        link_style=link_style,
+        session=session,
+    )
+    stats = timed(lambda: len(model.prerender(toots, render_context)), args.repeat)
+    collapsed_to = stats.pop("result")
+    results["dedup"] = {**stats, "toots": len(toots), "collapsed_to": collapsed_to, "peak_rss_mb_so_far": peak_rss_mb()}
+
+    stats = timed(lambda: model.render(model.prerender(toots, render_context), render_context))
+    del stats["result"]
+    results["topic_cluster_render_cold"] = {**stats, "toots": len(toots), "peak_rss_mb_so_far": peak_rss_mb()}
+
+    stats = timed(lambda: model.render(model.prerender(toots, render_context), render_context), args.repeat)
+    renderable = stats.pop("result")
+    results["topic_cluster_render_warm"] = {**stats, "toots": len(toots), "peak_rss_mb_so_far": peak_rss_mb()}
+
+    def render_html() -> tuple[int, float]:
+        start = time.perf_counter()
+        response = renderable.render()
+        if hasattr(response, "body"):
+            return len(response.body), time.perf_counter() - start
+
+        # Streaming responses: drain the body, noting when the first chunk was ready
+        async def drain() -> tuple[int, float]:
+            size, first_byte = 0, None
+            async for chunk in response.body_iterator:
+                first_byte = first_byte or time.perf_counter() - start
+                size += len(chunk)
+            return size, first_byte
+        return asyncio.run(drain())
+    stats = timed(render_html, args.repeat)
+    size, first_byte = stats.pop("result")
+    results["template_render"] = {**stats, "bytes": size, "first_byte_s": round(first_byte, 4), "peak_rss_mb_so_far": peak_rss_mb()}
+
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current: dict, baseline: dict):
+    print(f"{'benchmark':32} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["median_seconds"]
+        after = result["median_seconds"]
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"{name:32} {before:9.4f}s {after:9.4f}s {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--toots", type=int, default=2000, help="Number of synthetic toots to ingest")
+    parser.add_argument("--hours", type=float, default=24 * 7, help="Time span the toots are spread over")
+    parser.add_argument("--clusters", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs for the repeatable (read-only) benchmarks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--local", action="store_true", help="Use the real local models (see local_models.py) instead of fakes")
+    parser.add_argument("--out", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Compare against a previous results file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="fossil-benchmark-") as tmp:
+        os.environ.update({
+            "DATABASE_PATH": os.path.join(tmp, "fossil.db"),
+            "ARCHIVE_PATH": os.path.join(tmp, "fossil-archive.db"),
+            "RETENTION_DAYS": "0",
+            "MASTO_BASE": MASTO_BASE,
+            "ACCESS_TOKEN": "benchmark",
+        })
+        if args.local:
+            os.environ["EMBEDDING_MODEL"] = "fossil-local"
+            os.environ["SUMMARIZE_MODEL"] = "fossil-extractive"
+        with fake_models():
+            results = run(args)
+
+    output = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    print(json.dumps(output, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(output, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(output, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
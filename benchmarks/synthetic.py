@@ -0,0 +1,236 @@
+"""
+Deterministic, offline stand-ins for everything fossil normally talks to over the network:
+the Mastodon API, the embedding model, the summarizing model and the tokenizer.
+
+Statuses are generated from a handful of made-up topics, and fake embeddings are built from
+per-word vectors, so toots about the same topic really do end up close together and the
+clustering code has some structure to find.
+"""
+import datetime
+import json
+import random
+import urllib.parse
+import zlib
+
+import numpy as np
+import requests
+from requests.adapters import BaseAdapter
+
+
+TOPICS = {
+    "python": "python pip wheel typing asyncio pydantic fastapi numpy pandas packaging",
+    "rust": "rust cargo borrow lifetime crate trait tokio unsafe compiler macro",
+    "birds": "birds heron warbler feeder migration binoculars owl hawk nest spring",
+    "coffee": "coffee espresso grinder roast beans pourover crema barista latte kettle",
+    "climate": "climate carbon solar wind heatwave emissions policy grid battery flood",
+    "llm": "llm embeddings prompt tokens transformer finetune inference gpu context model",
+    "cycling": "cycling bike commute helmet gravel tyre saddle ride climb lane",
+    "music": "music album guitar synth vinyl concert playlist drummer chord band",
+}
+FILLER = "the a and of to in is it that for on with this was just really today about".split()
+
+EMBEDDING_DIMS = 1536
+
+
+def generate_statuses(n: int, hours: float = 24 * 7, seed: int = 0, n_accounts: int = 200) -> list[dict]:
+    """
+    Generate `n` Mastodon statuses, newest first (like the home timeline API), spread evenly
+    over the last `hours`.
+    """
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    accounts = [
+        {
+            "id": str(100000 + i),
+            "username": f"user{i}",
+            "acct": f"user{i}@example{i % 7}.social",
+            "display_name": f"User {i}",
+            "url": f"https://example{i % 7}.social/@user{i}",
+            "avatar": f"https://files.example{i % 7}.social/accounts/avatars/{i}/original/avatar.png",
+            "avatar_static": f"https://files.example{i % 7}.social/accounts/avatars/{i}/original/avatar.png",
+            "header": f"https://files.example{i % 7}.social/accounts/headers/{i}/original/header.png",
+            "note": f"<p>I post about {rng.choice(list(TOPICS))}</p>",
+            "followers_count": rng.randint(0, 5000),
+            "following_count": rng.randint(0, 1000),
+            "statuses_count": rng.randint(0, 20000),
+            "fields": [{"name": "Website", "value": f"https://example.com/{i}", "verified_at": None}],
+            "emojis": [],
+        }
+        for i in range(n_accounts)
+    ]
+    topic_names = list(TOPICS)
+
+    statuses = []
+    for i in range(n):
+        status_id = str(110000000000000000 + n - i)
+        topic = rng.choice(topic_names)
+        words = TOPICS[topic].split()
+        text = " ".join(rng.choice(words) if rng.random() < 0.6 else rng.choice(FILLER) for _ in range(rng.randint(8, 60)))
+        account = rng.choice(accounts)
+        created_at = now - datetime.timedelta(hours=hours * i / max(n, 1))
+        has_card = rng.random() < 0.3
+        has_media = not has_card and rng.random() < 0.2
+        statuses.append({
+            "id": status_id,
+            "created_at": created_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "in_reply_to_id": str(int(status_id) - rng.randint(1, 50)) if rng.random() < 0.15 else None,
+            "in_reply_to_account_id": None,
+            "sensitive": False,
+            "spoiler_text": "",
+            "visibility": "public",
+            "language": "en",
+            "uri": f"{account['url']}/statuses/{status_id}",
+            "url": f"{account['url']}/{status_id}",
+            "replies_count": rng.randint(0, 10),
+            "reblogs_count": rng.randint(0, 10),
+            "favourites_count": rng.randint(0, 50),
+            "favourited": rng.random() < 0.05,
+            "reblogged": rng.random() < 0.02,
+            "content": f"<p>{text} <a href=\"https://example.com/tags/{topic}\" class=\"mention hashtag\" rel=\"tag\">#<span>{topic}</span></a></p>",
+            "reblog": None,
+            "account": account,
+            "media_attachments": [{
+                "id": status_id, "type": "image",
+                "url": f"https://files.example.social/media/{status_id}.png",
+                "preview_url": f"https://files.example.social/media/small/{status_id}.png",
+            }] if has_media else [],
+            "mentions": [],
+            "tags": [{"name": topic, "url": f"https://example.com/tags/{topic}"}],
+            "emojis": [],
+            "card": {
+                "url": f"https://news.example.com/{topic}/{i % 50}",
+                "title": f"News about {topic}",
+                "image": f"https://news.example.com/{topic}/{i % 50}.jpg",
+            } if has_card else None,
+            "poll": None,
+        })
+    return statuses
+
+
+class FakeMastodonAdapter(BaseAdapter):
+    """
+    A `requests` transport adapter that serves the home timeline from a list of statuses,
+    40 at a time, with `Link: rel="next"` pagination and rate limit headers. Also serves
+    `/statuses/:id/context` from the same list.
+    """
+    def __init__(self, base_url: str, statuses: list[dict]):
+        super().__init__()
+        self.base_url = base_url
+        self.statuses = statuses
+        self.requests = 0
+
+    def send(self, request, **kwargs):
+        self.requests += 1
+        url = urllib.parse.urlparse(request.url)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        limit = int(query.get("limit", 40))
+
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.headers["X-RateLimit-Limit"] = "300"
+        response.headers["X-RateLimit-Remaining"] = "299"
+        response.headers["X-RateLimit-Reset"] = (datetime.datetime.utcnow() + datetime.timedelta(minutes=5)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+        if url.path == "/api/v1/timelines/home":
+            start = 0
+            if "max_id" in query:
+                start = next((i + 1 for i, s in enumerate(self.statuses) if s["id"] == query["max_id"]), len(self.statuses))
+            page = self.statuses[start:start + limit]
+            if page:
+                response.headers["Link"] = f'<{self.base_url}/api/v1/timelines/home?limit={limit}&max_id={page[-1]["id"]}>; rel="next"'
+            body = page
+        elif url.path.startswith("/api/v1/statuses/") and url.path.endswith("/context"):
+            body = self._context(url.path.split("/")[-2])
+        else:
+            body = {"id": url.path.split("/")[-2] if url.path.count("/") > 4 else None}
+
+        response.status_code = 200
+        response._content = json.dumps(body).encode("utf-8")
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+    def _context(self, status_id: str) -> dict:
+        by_id = {s["id"]: s for s in self.statuses}
+        ancestors = []
+        parent_id = by_id[status_id]["in_reply_to_id"] if status_id in by_id else None
+        while parent_id in by_id:
+            ancestors.insert(0, by_id[parent_id])
+            parent_id = by_id[parent_id]["in_reply_to_id"]
+        descendants = []
+        frontier = {status_id}
+        for status in reversed(self.statuses):  # oldest first
+            if status["in_reply_to_id"] in frontier:
+                descendants.append(status)
+                frontier.add(status["id"])
+        return {"ancestors": ancestors, "descendants": descendants}
+
+    def close(self):
+        pass
+
+
+class FakeEmbeddingModel:
+    """
+    Embeds text as the normalized sum of a fixed random vector per word.
+    """
+    model_id = "fake-embeddings"
+
+    def __init__(self, dims: int = EMBEDDING_DIMS):
+        self.dims = dims
+        self._words: dict[str, np.ndarray] = {}
+
+    def _word(self, word: str) -> np.ndarray:
+        if word not in self._words:
+            rng = np.random.default_rng(zlib.crc32(word.encode("utf-8")))
+            self._words[word] = rng.standard_normal(self.dims)
+        return self._words[word]
+
+    def embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.dims)
+        for word in text.lower().split():
+            vector += self._word(word.strip(".,#!?*_[]()"))
+        norm = np.linalg.norm(vector)
+        return list(vector / norm if norm else vector)
+
+    def embed_batch(self, texts):
+        return [self.embed(text) for text in texts]
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self._text = text
+
+    def text(self) -> str:
+        return self._text
+
+
+class FakeSummarizeModel:
+    """
+    "Summarizes" a prompt by naming its most common topic word.
+    """
+    model_id = "fake-summarizer"
+
+    def prompt(self, prompt: str) -> _FakeResponse:
+        topic_words = {w: topic for topic, words in TOPICS.items() for w in words.split()}
+        counts: dict[str, int] = {}
+        for word in prompt.lower().split():
+            if word in topic_words:
+                counts[topic_words[word]] = counts.get(topic_words[word], 0) + 1
+        best = max(counts, key=counts.get) if counts else "misc"
+        return _FakeResponse(f"Toots about {best}")
+
+
+class FakeEncoding:
+    """
+    Whitespace "tokenizer", standing in for tiktoken (which downloads its vocabularies).
+    """
+    name = "fake"
+
+    def encode(self, text: str) -> list[str]:
+        return text.split()
+
+    def encode_batch(self, texts: list[str], **kwargs) -> list[list[str]]:
+        return [self.encode(text) for text in texts]
+
+    def decode(self, tokens: list[str]) -> str:
+        return " ".join(tokens)
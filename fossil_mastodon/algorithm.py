@@ -1,13 +1,15 @@
 import abc
 import datetime
+import inspect
 import pickle
 import sqlite3
 import typing
 
 import pydantic
 from fastapi import Response, responses
+from starlette.concurrency import run_in_threadpool
 
-from fossil_mastodon import config, core
+from fossil_mastodon import config, core, dedup
 if typing.TYPE_CHECKING:
     from fossil_mastodon import plugins
 
@@ -37,6 +39,12 @@ class TrainContext(pydantic.BaseModel):
     def get_toots(self) -> list[core.Toot]:
         return core.Toot.get_toots_since(self.end_time - self.timedelta)
 
+    async def get_toots_async(self) -> list[core.Toot]:
+        """
+        get_toots() for async train() methods, without blocking the event loop.
+        """
+        return await run_in_threadpool(self.get_toots)
+
     def sqlite_connection(self) -> sqlite3.Connection:
         return config.ConfigHandler.open_db()
 
@@ -50,10 +58,16 @@ class BaseAlgorithm(abc.ABC):
     - render: Run the model
     - train: Train the model
 
-    Additionally, you may want to override this method to provide a custom UI for
-    your algorithm:
+    Additionally, you may want to override these methods:
+
+    - render_model_params: provide a custom UI for your algorithm
+    - prerender: filter or transform toots before render() sees them
+    - render_delta: update the page with only the toots that arrived since the last render
 
-    - render_model_params
+    render, train & prerender can also be written as `async def`, e.g. to make LLM calls or
+    fetch statuses concurrently. The server awaits async methods on its event loop and runs
+    regular ones in a worker thread, so neither blocks other requests. Async methods must not
+    do slow blocking work themselves; use `run_in_threadpool` (or `get_toots_async()`) for that.
 
     Note that objects of this class must be serializable, via pickle. However, you
     can control how serialization works by overriding these methods:
@@ -76,6 +90,28 @@ class BaseAlgorithm(abc.ABC):
         """
         raise NotImplementedError()
 
+    def prerender(self, toots: list[core.Toot], context: "plugins.RenderContext") -> list[core.Toot]:
+        """
+        Called with the toots before render(). By default, this collapses near-duplicate
+        toots (the same link or announcement posted by many accounts) into a single toot,
+        unless the user turned that off. The others are available via `toot.duplicates`.
+        """
+        if context.collapse_duplicates:
+            return dedup.collapse(toots)
+        return toots
+
+    def render_delta(self, toots: list[core.Toot], last_seen_id: int,
+                     context: "plugins.RenderContext") -> Renderable | None:
+        """
+        Like render(), but the client already shows everything up to toot `last_seen_id`, so
+        only what changed needs to be sent, typically as htmx out-of-band swaps (the main swap
+        is skipped). Return None to re-render everything, which is the default.
+
+        :param toots: The whole timeline. The toots already shown & the new ones (`id > last_seen_id`)
+            go through prerender() separately, so duplicates are never collapsed across the two.
+        """
+        return None
+
     @classmethod
     @abc.abstractmethod
     def train(cls, context: TrainContext, http_args: dict[str, str]) -> "BaseAlgorithm":
@@ -100,4 +136,44 @@ class BaseAlgorithm(abc.ABC):
     
     @staticmethod
     def deserialize(data: bytes) -> "BaseAlgorithm":
-        return pickle.loads(data)
\ No newline at end of file
+        return pickle.loads(data)
+
+
+async def _call(fn: typing.Callable, *args):
+    """
+    Await `fn` if it's async, otherwise run it in a worker thread.
+    """
+    if inspect.iscoroutinefunction(fn):
+        return await fn(*args)
+    return await run_in_threadpool(fn, *args)
+
+
+async def render(model: BaseAlgorithm, toots: list[core.Toot], context: "plugins.RenderContext") -> Renderable:
+    """
+    Run `model.prerender()` & `model.render()`, whether they're sync or async.
+    """
+    toots = await _call(model.prerender, toots, context)
+    return await _call(model.render, toots, context)
+
+
+async def render_delta(model: BaseAlgorithm, toots: list[core.Toot], last_seen_id: int,
+                       context: "plugins.RenderContext") -> Renderable | None:
+    """
+    Run `model.prerender()` & `model.render_delta()`, whether they're sync or async.
+
+    The toots the page already shows and the new ones are prerendered separately. Collapsing
+    a new toot into one that's on the page (or the other way around) would change toots
+    that the delta doesn't re-render, so the "also posted by" lines would go stale, or
+    collapsed toots would stay on screen. The next full render collapses everything.
+    """
+    shown = [toot for toot in toots if toot.id is None or toot.id <= last_seen_id]
+    new = [toot for toot in toots if toot.id is not None and toot.id > last_seen_id]
+    toots = await _call(model.prerender, shown, context) + await _call(model.prerender, new, context)
+    return await _call(model.render_delta, toots, last_seen_id, context)
+
+
+async def train(algo: typing.Type[BaseAlgorithm], context: TrainContext, http_args: dict[str, str]) -> BaseAlgorithm:
+    """
+    Run `algo.train()`, whether it's sync or async.
+    """
+    return await _call(algo.train, context, http_args)
\ No newline at end of file
@@ -1,4 +1,3 @@
-
 const stickyElm = document.querySelector('.cluster .title')
 
 const observer = new IntersectionObserver( 
@@ -6,4 +5,13 @@ const observer = new IntersectionObserver(
   {threshold: [1]}
 );
 
-observer.observe(stickyElm)
\ No newline at end of file
+if (stickyElm) {
+  observer.observe(stickyElm)
+}
+
+// Sent by the server with every timeline render, so that "Load More" can ask for only the
+// toots that are newer than what's on the page
+document.addEventListener("fossil:rendered", (e) => {
+  document.getElementById("last_seen_id").value = e.detail.last_seen_id
+  document.getElementById("render_key").value = e.detail.render_key
+})
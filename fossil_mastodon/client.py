@@ -0,0 +1,232 @@
+"""
+Shared HTTP client for talking to the Mastodon API.
+
+All Mastodon calls should go through `get_client()` so that they share a pooled, keep-alive
+session and respect the server's rate limits. Mastodon reports its limits on every response via
+the `X-RateLimit-Limit`, `X-RateLimit-Remaining` and `X-RateLimit-Reset` headers; we use those
+to slow down before we run out, rather than slamming into 429s.
+
+Waiting is capped at `max_wait` seconds. When the server asks us to wait longer than that (a
+big `Retry-After`, or a used-up rate limit window), the request fails right away with
+`RateLimited`, rather than holding up a worker thread for minutes.
+"""
+import datetime
+import functools
+import logging
+import random
+import threading
+import time
+
+import pydantic
+import requests
+from requests.adapters import HTTPAdapter
+
+from fossil_mastodon import config, metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Only these are retried. Retrying a POST could boost or favourite twice.
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+REQUEST_SECONDS = metrics.histogram("fossil_mastodon_request_duration_seconds", "Mastodon API request latency")
+REQUESTS = metrics.counter("fossil_mastodon_requests_total", "Mastodon API requests, by endpoint and status")
+RETRIES = metrics.counter("fossil_mastodon_retries_total", "Mastodon API requests that were retried")
+THROTTLE_SECONDS = metrics.counter("fossil_mastodon_throttle_seconds_total", "Time spent waiting on rate limits")
+
+
+class RateLimited(requests.HTTPError):
+    """
+    The server wants us to wait longer than the client's `max_wait`. `retry_after` is how
+    many seconds until it's worth trying again.
+    """
+    def __init__(self, message: str, retry_after: float, response: requests.Response | None = None):
+        super().__init__(message, response=response)
+        self.retry_after = retry_after
+
+
+class RateLimit(pydantic.BaseModel):
+    limit: int | None = None
+    remaining: int | None = None
+    reset_at: datetime.datetime | None = None
+
+    @classmethod
+    def from_headers(cls, headers) -> "RateLimit | None":
+        if "X-RateLimit-Remaining" not in headers:
+            return None
+        try:
+            reset = headers.get("X-RateLimit-Reset")
+            return cls(
+                limit=int(headers.get("X-RateLimit-Limit", 0)) or None,
+                remaining=int(headers["X-RateLimit-Remaining"]),
+                # Mastodon sends e.g. 2017-04-11T07:15:00.000Z. Python 3.10 doesn't grok the Z.
+                reset_at=datetime.datetime.fromisoformat(reset.replace("Z", "+00:00")) if reset else None,
+            )
+        except ValueError:
+            logger.warning(f"Couldn't parse rate limit headers: {dict(headers)}")
+            return None
+
+    def seconds_until_reset(self) -> float:
+        if self.reset_at is None:
+            return 0.0
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return max(0.0, (self.reset_at - now).total_seconds())
+
+
+class MastodonClient:
+    """
+    A thin wrapper around `requests.Session` that adds:
+
+    - Connection pooling & keep-alive (one session per Mastodon server + token)
+    - Adaptive throttling, driven by the `X-RateLimit-*` headers
+    - Retries with exponential backoff & jitter for 429s, 5xx and connection errors, for
+      idempotent methods only
+    - No waits longer than `max_wait`; `RateLimited` is raised instead
+    - Per-endpoint timing metrics (see `metrics.py`)
+    """
+    def __init__(self, base_url: str, access_token: str, max_retries: int = 5, timeout: float = 30.0,
+                 throttle_fraction: float = 0.1, pool_size: int = 10, max_wait: float = 10.0):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_wait = max_wait
+        # When fewer than this fraction of the rate limit budget is left, start spacing out requests
+        self.throttle_fraction = throttle_fraction
+        self.rate_limit: RateLimit | None = None
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {access_token}"})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def url(self, path: str) -> str:
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Make a request, retrying transient failures of idempotent methods. Raises
+        `requests.HTTPError` for any non-retryable error status, or when retries are exhausted,
+        and `RateLimited` when the server wants us to wait longer than `max_wait`.
+        """
+        url = self.url(path)
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = self._endpoint(method, url)
+        max_retries = self.max_retries if method.upper() in IDEMPOTENT_METHODS else 0
+
+        attempt = 0
+        while True:
+            self._throttle()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(endpoint, time.perf_counter() - start, "error")
+                if attempt >= max_retries:
+                    raise
+                attempt += 1
+                RETRIES.inc(endpoint=endpoint)
+                self._sleep(self._backoff(attempt))
+                continue
+
+            self._record(endpoint, time.perf_counter() - start, str(response.status_code))
+            self._update_rate_limit(response)
+
+            if response.status_code == 429:
+                delay = self._retry_after(response)
+                if delay is not None and delay > self.max_wait:
+                    raise RateLimited(f"{method} {url} is rate limited for {delay:.0f}s", delay, response)
+            if response.status_code in RETRY_STATUSES and attempt < max_retries:
+                attempt += 1
+                RETRIES.inc(endpoint=endpoint)
+                delay = self._retry_after(response) if response.status_code == 429 else None
+                logger.warning(f"{method} {url} returned {response.status_code}; retry {attempt}/{max_retries}")
+                self._sleep(delay if delay is not None else self._backoff(attempt))
+                continue
+
+            response.raise_for_status()
+            return response
+
+    @staticmethod
+    def _endpoint(method: str, url: str) -> str:
+        # Collapse numeric ids so that e.g. every /statuses/{id}/reblog lands in the same bucket
+        path = requests.utils.urlparse(url).path
+        return method + " " + "/".join("{id}" if part.isdigit() else part for part in path.split("/"))
+
+    @staticmethod
+    def _record(endpoint: str, seconds: float, status: str):
+        REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, status=status)
+
+    def _update_rate_limit(self, response: requests.Response):
+        rate_limit = RateLimit.from_headers(response.headers)
+        if rate_limit is not None:
+            with self._lock:
+                self.rate_limit = rate_limit
+
+    def _throttle(self):
+        """
+        Spread the remaining request budget evenly over the time left until the rate limit
+        window resets, but only once we're running low. Most of the time this is a no-op. If
+        the budget is used up, fail rather than wait for the window to reset.
+        """
+        with self._lock:
+            rate_limit = self.rate_limit
+        if rate_limit is None or rate_limit.remaining is None:
+            return
+        low_water = max(1, int((rate_limit.limit or 300) * self.throttle_fraction))
+        if rate_limit.remaining > low_water:
+            return
+        until_reset = rate_limit.seconds_until_reset()
+        if until_reset <= 0:
+            return
+        if rate_limit.remaining <= 0 and until_reset > self.max_wait:
+            raise RateLimited(f"Rate limit used up, resets in {until_reset:.0f}s", until_reset)
+        delay = min(until_reset / max(rate_limit.remaining, 1), self.max_wait)
+        logger.info(f"Rate limit low ({rate_limit.remaining} left, resets in {until_reset:.0f}s); sleeping {delay:.2f}s")
+        THROTTLE_SECONDS.inc(delay)
+        self._sleep(delay)
+
+    def _retry_after(self, response: requests.Response) -> float | None:
+        if "Retry-After" in response.headers:
+            try:
+                return float(response.headers["Retry-After"]) + random.uniform(0, 1)
+            except ValueError:
+                pass
+        if self.rate_limit is not None and self.rate_limit.reset_at is not None:
+            return self.rate_limit.seconds_until_reset() + random.uniform(0, 1)
+        return None
+
+    @staticmethod
+    def _backoff(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+        # "Full jitter" exponential backoff
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+    @staticmethod
+    def _sleep(seconds: float):
+        time.sleep(seconds)
+
+
+@functools.lru_cache()
+def _get_client(base_url: str, access_token: str) -> MastodonClient:
+    return MastodonClient(base_url, access_token)
+
+
+def get_client() -> MastodonClient:
+    """
+    Get the shared client for the configured Mastodon server. Clients are cached per
+    server + token, so this is cheap to call on every request.
+    """
+    return _get_client(config.ConfigHandler.MASTO_BASE, config.ConfigHandler.ACCESS_TOKEN)
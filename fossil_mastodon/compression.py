@@ -0,0 +1,72 @@
+"""
+Compact storage for Mastodon status JSON.
+
+Statuses are small (1-4 KB), which is too little for a compressor to learn much from on its
+own. So we prime zlib with a preset dictionary made of the keys and HTML fragments that show
+up in nearly every status. Every blob starts with a one-byte version so that the dictionary
+can evolve without breaking existing rows. NEVER change an existing dictionary, add a new
+version instead.
+"""
+import json
+import zlib
+
+
+_DICTIONARY_V1 = json.dumps({
+    "id": "111111111111111111",
+    "created_at": "2024-01-01T00:00:00.000Z",
+    "in_reply_to_id": None,
+    "in_reply_to_account_id": None,
+    "sensitive": False,
+    "spoiler_text": "",
+    "visibility": "public",
+    "language": "en",
+    "uri": "https://mastodon.social/users/someone/statuses/111111111111111111",
+    "url": "https://mastodon.social/@someone/111111111111111111",
+    "replies_count": 0,
+    "reblogs_count": 0,
+    "favourites_count": 0,
+    "edited_at": None,
+    "favourited": False,
+    "reblogged": False,
+    "muted": False,
+    "bookmarked": False,
+    "pinned": False,
+    "filtered": [],
+    "content": '<p>Text <a href="https://example.com/tags/tag" class="mention hashtag" rel="tag">#<span>tag</span></a> '
+               '<span class="h-card" translate="no"><a href="https://example.com/@user" class="u-url mention">@<span>user</span></a></span> '
+               '<a href="https://example.com/" target="_blank" rel="nofollow noopener noreferrer" translate="no">'
+               '<span class="invisible">https://</span><span class="ellipsis">example.com</span><span class="invisible"></span></a></p><p>',
+    "reblog": None,
+    "application": {"name": "Web", "website": None},
+    "account": {"id": "111111111111111111"},
+    "media_attachments": [{
+        "id": "111111111111111111", "type": "image", "url": "https://files.mastodon.social/media_attachments/files/original/image.png",
+        "preview_url": "https://files.mastodon.social/media_attachments/files/small/image.png", "remote_url": None,
+        "preview_remote_url": None, "text_url": None,
+        "meta": {"original": {"width": 1024, "height": 768, "size": "1024x768", "aspect": 1.3333333333333333},
+                 "small": {"width": 640, "height": 480, "size": "640x480", "aspect": 1.3333333333333333}},
+        "description": None, "blurhash": "",
+    }],
+    "mentions": [{"id": "111111111111111111", "username": "user", "url": "https://mastodon.social/@user", "acct": "user@example.com"}],
+    "tags": [{"name": "tag", "url": "https://mastodon.social/tags/tag"}],
+    "emojis": [],
+    "card": {"url": "https://example.com/", "title": "", "description": "", "language": "en", "type": "link",
+             "author_name": "", "author_url": "", "provider_name": "", "provider_url": "", "html": "",
+             "width": 400, "height": 200, "image": "https://files.mastodon.social/cache/preview_cards/images/original/image.jpg",
+             "image_description": "", "embed_url": "", "blurhash": "", "published_at": None},
+    "poll": None,
+}).encode("utf-8")
+
+_DICTIONARIES = {1: _DICTIONARY_V1}
+_CURRENT_VERSION = 1
+
+
+def compress(text: str) -> bytes:
+    compressor = zlib.compressobj(level=6, zdict=_DICTIONARIES[_CURRENT_VERSION])
+    return bytes([_CURRENT_VERSION]) + compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+
+def decompress(blob: bytes) -> str:
+    version, body = blob[0], blob[1:]
+    decompressor = zlib.decompressobj(zdict=_DICTIONARIES[version])
+    return (decompressor.decompress(body) + decompressor.flush()).decode("utf-8")
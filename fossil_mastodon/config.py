@@ -1,4 +1,9 @@
-import atexit
+import contextlib
+import contextvars
+import datetime
+import functools
+import hashlib
+import importlib.metadata
 import json
 import os
 import pathlib
@@ -6,12 +11,18 @@ import random
 import shutil
 import sqlite3
 import string
+import time
 from collections import defaultdict
+from typing import IO, ClassVar, Iterator
 
-import llm
 import pydantic
 from dotenv import dotenv_values
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 
 def get_config_var(var_name: str, default):
     return dotenv_values().get(var_name, os.environ.get(var_name, default))
@@ -25,6 +36,23 @@ class _ConfigValueNotFound():
 
 ConfigValueNotFound = _ConfigValueNotFound()
 
+
+class Account(pydantic.BaseModel):
+    """
+    A Mastodon account & where its toots are stored. Sessions with their own access token
+    get their own account, with its own database files; everything else uses the default
+    account, configured by MASTO_BASE, ACCESS_TOKEN, DATABASE_PATH & ARCHIVE_PATH.
+    """
+    name: str
+    masto_base: str
+    access_token: str
+    database_path: str
+    archive_path: str
+
+
+# The account the current request (or background job) is working on
+_account: contextvars.ContextVar[Account | None] = contextvars.ContextVar("fossil_account", default=None)
+
 class _ConfigHandler():
     # Default fallbacks for variables defined in either .env or environment
     _config_var_defaults = {
@@ -32,7 +60,21 @@ class _ConfigHandler():
         "OPENAI_KEY": "",
         "OPENAI_API_BASE": "https://api.openai.com/v1",
         "MASTO_BASE": "https://hachyderm.io",
+        "RETENTION_DAYS": "0",
+        "RETENTION_INTERVAL_HOURS": "24",
+        "PROFILE_REQUESTS": "false",
+        "PROFILE_DIR": "profiles",
+        "DB_BUSY_TIMEOUT_SECONDS": "30",
+        "REFRESH_INTERVAL_MINUTES": "0",
+        "TRAINING_PROCESSES": "0",
+        "PROJECTION_DIMS": "128",
+        "PROJECTION_KIND": "pca",
+        "PROJECTION_REFIT_HOURS": "168",
+        "ACCOUNTS_DIR": "accounts",
     }
+
+    # These come from the current account, see use_account()
+    _account_vars = {"MASTO_BASE", "ACCESS_TOKEN", "DATABASE_PATH", "ARCHIVE_PATH"}
     
     _model_lengths = defaultdict(
         lambda: 2048, 
@@ -42,16 +84,24 @@ class _ConfigHandler():
     _model_cache = {}
     
     def __getattr__(self, item: str):
+        if item in self._account_vars and (account := _account.get()) is not None:
+            return getattr(account, item.lower())
         c_val = get_config_var(item, self._config_var_defaults.get(item, ConfigValueNotFound))
         
         if isinstance(c_val, _ConfigValueNotFound):
             raise AttributeError(f"{item} is not defined in either the enviroment or .env file")
         return c_val
 
+    @property
+    def ARCHIVE_PATH(self) -> str:
+        if (account := _account.get()) is not None:
+            return account.archive_path
+        return get_config_var("ARCHIVE_PATH", "") or archive_path_for(self.DATABASE_PATH)
+
     def _get_from_session(self, session_id: str| None, item: str) -> str:
         if not session_id:
             return ""
-        with self.open_db() as conn:
+        with self.open_main_db() as conn:
             c = conn.cursor()
             c.execute('SELECT settings FROM sessions WHERE id = ?', [session_id])
             row = c.fetchone()
@@ -61,7 +111,26 @@ class _ConfigHandler():
                 return ""
 
     def open_db(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.DATABASE_PATH)
+        """
+        The current account's database.
+        """
+        return self._connect(self.DATABASE_PATH)
+
+    def open_main_db(self) -> sqlite3.Connection:
+        """
+        The default account's database, which also holds the sessions of every account.
+        """
+        return self._connect(main_db_path())
+
+    def _connect(self, path: str) -> sqlite3.Connection:
+        from fossil_mastodon import migrations
+        # Other workers may be writing; wait for them rather than failing with "database is locked"
+        conn = sqlite3.connect(path, timeout=float(self.DB_BUSY_TIMEOUT_SECONDS))
+        migrations.ensure_migrated(conn, path)
+        return conn
+
+    def open_archive_db(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.ARCHIVE_PATH, timeout=float(self.DB_BUSY_TIMEOUT_SECONDS))
     
     def EMBEDDING_MODEL(self, session_id: str|None = None) -> Model:
         c_val = self._get_from_session(session_id, "embedding_model")
@@ -87,14 +156,74 @@ class _ConfigHandler():
 ConfigHandler = _ConfigHandler()
 
 
+def archive_path_for(database_path: str) -> str:
+    """
+    The default archive database goes next to the main one, e.g. `fossil.db` -> `fossil-archive.db`.
+    """
+    path = pathlib.Path(database_path)
+    return str(path.with_name(f"{path.stem}-archive{path.suffix or '.db'}"))
+
+
+def main_db_path() -> str:
+    """
+    The default account's database, whichever account is in context.
+    """
+    return get_config_var("DATABASE_PATH", ConfigHandler._config_var_defaults["DATABASE_PATH"])
+
+
+def is_main_db(conn: sqlite3.Connection) -> bool:
+    return pathlib.Path(get_db_path(conn)).resolve() == pathlib.Path(main_db_path()).resolve()
+
+
+def default_account() -> Account:
+    database_path = main_db_path()
+    return Account(
+        name="",
+        masto_base=get_config_var("MASTO_BASE", ConfigHandler._config_var_defaults["MASTO_BASE"]),
+        access_token=get_config_var("ACCESS_TOKEN", ""),
+        database_path=database_path,
+        archive_path=get_config_var("ARCHIVE_PATH", "") or archive_path_for(database_path),
+    )
+
+
+def account_dir(session_id: str) -> pathlib.Path:
+    """
+    Where the databases of a session's own account go: `<ACCOUNTS_DIR>/<session id>/`, next to
+    the main database. Keyed by id, so renaming the session keeps its toots. The directory is
+    created when the session is saved.
+    """
+    return pathlib.Path(main_db_path()).parent / ConfigHandler.ACCOUNTS_DIR / session_id
+
+
+def current_account() -> Account:
+    return _account.get() or default_account()
+
+
+@contextlib.contextmanager
+def use_account(account: Account | None) -> Iterator[None]:
+    """
+    Route config & database access in this context (and anything it starts, like tasks or
+    streamed responses) to `account`. None means the default account.
+    """
+    token = _account.set(account)
+    try:
+        yield
+    finally:
+        _account.reset(token)
+
+
 def headers():
     return {"Authorization": f"Bearer {ConfigHandler.ACCESS_TOKEN}"}
 
 def get_installed_llms() -> set[str]:
-    return {m.model.model_id for m in llm.get_models_with_aliases()}
+    import llm
+    from fossil_mastodon import local_models
+    return {m.model.model_id for m in llm.get_models_with_aliases()} | {local_models.SUMMARIZE_MODEL_ID}
 
 def get_installed_embedding_models() -> set[str]:
-    return {m.model.model_id for m in llm.get_embedding_models_with_aliases()}
+    import llm
+    from fossil_mastodon import local_models
+    return {m.model.model_id for m in llm.get_embedding_models_with_aliases()} | {local_models.EMBEDDING_MODEL_ID}
 
 
 # Static files
@@ -103,53 +232,170 @@ class StaticFiles(pydantic.BaseModel):
     This manages static files so that the user can `pip install fossil-mastodon` and it runs
     fine. 
 
-    This copies all files into a temp directory and then deletes them as the program exits. This 
-    seems to work fine even in the dev workflow, since this module gets re-run every time
-    uvicorn reloads the server.
+    This copies all files into a cache directory named after the package version and the
+    files' sizes & modification times. The directory is reused across restarts (and by every
+    worker process), and a new one only gets created when the files change, e.g. after an
+    upgrade or while editing templates. Plugins' files are copied into a separate directory
+    (see `add_dir`), which is searched first.
+
+    Every process holds a shared lock on the directory it uses, so that pruning old
+    directories never deletes one that a running server is still serving from.
     """
     class Config:
         arbitrary_types_allowed = True
     base_path: pathlib.Path
     assets_path: pathlib.Path
     templates_path: pathlib.Path
+    plugins_path: pathlib.Path
 
-    # HACK: Alright, I admit it, this is crazy. Here's the thing: we need to use shutil.rmtree in
-    # the destructor, but the destructor runs at a very weird time. I observed it running after
-    # the shutil module had been unloaded, so I was getting NullType for the module. Obvs the
-    # simple solution is this — make the function live longer than this object by capturing a reference.
-    rmtree = shutil.rmtree
+    # Cache directories that haven't been used in this long are deleted, unless a process
+    # is still using them
+    max_age: ClassVar[datetime.timedelta] = datetime.timedelta(days=7)
 
     @classmethod
     def from_env(cls) -> "StaticFiles":
-        src_path = pathlib.Path(__file__).parent / "app"
         # I used to use tempfile, but MacOS deletes temp files every 3 days, so I needed to move
         # to a more permanent location.
-        dst_path = pathlib.Path(os.path.expanduser(f"~/.cache/fossil-mastodon/{''.join(random.choices(string.ascii_lowercase, k=10))}"))
-        dst_path.mkdir(parents=True)
-        shutil.copytree(src_path / "static", dst_path / "static")
-        shutil.copytree(src_path / "templates", dst_path / "templates")
-        
-        obj = cls(
+        return cls.create(pathlib.Path(__file__).parent / "app",
+                          pathlib.Path(os.path.expanduser("~/.cache/fossil-mastodon")))
+
+    @classmethod
+    def create(cls, src_path: pathlib.Path, cache_root: pathlib.Path) -> "StaticFiles":
+        cache_root.mkdir(parents=True, exist_ok=True)
+        dst_path = cache_root / _cache_key(src_path)
+        # Before checking whether it exists: a process that's pruning it finishes first
+        _hold(_cache_lock_path(dst_path))
+        if not dst_path.exists():
+            # Copy to a private directory and then rename, so that other processes never see
+            # a half-copied tree. If another process beat us to it, use theirs.
+            tmp_path = cache_root / f".tmp-{''.join(random.choices(string.ascii_lowercase, k=10))}"
+            tmp_path.mkdir(parents=True)
+            shutil.copytree(src_path / "static", tmp_path / "static")
+            shutil.copytree(src_path / "templates", tmp_path / "templates")
+            try:
+                tmp_path.rename(dst_path)
+            except OSError:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            cls._prune_cache(cache_root, keep=dst_path)
+        os.utime(dst_path)
+
+        plugins_path = cache_root / "plugins"
+        for mount_path in ["static", "templates"]:
+            (plugins_path / mount_path).mkdir(parents=True, exist_ok=True)
+
+        return cls(
             base_path=dst_path,
             assets_path=dst_path / "static",
             templates_path=dst_path / "templates",
+            plugins_path=plugins_path,
         )
 
-        atexit.register(obj.cleanup)
+    @property
+    def static_dirs(self) -> list[pathlib.Path]:
+        return [self.plugins_path / "static", self.assets_path]
+
+    @property
+    def template_dirs(self) -> list[pathlib.Path]:
+        return [self.plugins_path / "templates", self.templates_path]
 
-        return obj
+    @classmethod
+    def _prune_cache(cls, cache_root: pathlib.Path, keep: pathlib.Path):
+        if fcntl is None:
+            # Can't tell whether another process is using a directory
+            return
+        cutoff = time.time() - cls.max_age.total_seconds()
+        for path in cache_root.iterdir():
+            if path in (keep, cache_root / "plugins") or not path.is_dir() or path.stat().st_mtime >= cutoff:
+                continue
+            lock_path = _cache_lock_path(path)
+            with open(lock_path, "a") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # A running process is using it
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                lock_path.unlink(missing_ok=True)
 
     def add_dir(self, path: pathlib.Path, mount_path: str):
-        shutil.copytree(path, self.base_path / mount_path, dirs_exist_ok=True)
+        """
+        Copy a plugin's `static` or `templates` directory (`mount_path`) into the plugins'
+        directory, never into the content-keyed one.
+        """
+        # Only copy what changed, and replace files atomically; other processes may be
+        # serving from this directory right now.
+        for src in path.rglob("*"):
+            if not src.is_file():
+                continue
+            dst = self.plugins_path / mount_path / src.relative_to(path)
+            src_stat = src.stat()
+            if dst.exists() and dst.stat().st_size == src_stat.st_size and dst.stat().st_mtime == src_stat.st_mtime:
+                continue
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dst.with_name(f".{dst.name}.{os.getpid()}")
+            shutil.copy2(src, tmp)
+            os.replace(tmp, dst)
 
-    def cleanup(self):
-        self.rmtree(self.assets_path.parent)
 
-    def __del__(self):
-        self.cleanup()
+def _cache_key(path: pathlib.Path) -> str:
+    """
+    Changes whenever the package is upgraded or a file under `path` is edited, without
+    reading the files.
+    """
+    try:
+        version = importlib.metadata.version("fossil-mastodon")
+    except importlib.metadata.PackageNotFoundError:
+        version = "dev"
+    digest = hashlib.sha256(version.encode("utf-8"))
+    for file in sorted(p for p in path.rglob("*") if p.is_file()):
+        stat = file.stat()
+        digest.update(f"{file.relative_to(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _cache_lock_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(f"{path.name}.lock")
+
+
+# Lock files this process holds until it exits
+_held_locks: list[IO] = []
+
+
+def _hold(lock_path: pathlib.Path):
+    """
+    Take a shared lock on `lock_path` for the rest of this process's life.
+    """
+    if fcntl is None:
+        return
+    while True:
+        f = open(lock_path, "a")
+        fcntl.flock(f, fcntl.LOCK_SH)
+        try:
+            # If a pruning process deleted the file while we waited, our lock is on a file
+            # nobody else will open. Lock the new one instead.
+            if os.stat(lock_path).st_ino == os.fstat(f.fileno()).st_ino:
+                _held_locks.append(f)
+                return
+        except FileNotFoundError:
+            pass
+        f.close()
+
+
+@functools.cache
+def get_assets() -> StaticFiles:
+    """
+    The template & static file cache. Set up the first time it's needed rather than on import,
+    so that processes which never serve pages, like training workers, don't pay for it.
+    """
+    return StaticFiles.from_env()
+
 
+def __getattr__(name: str):
+    # Plugins may still use `config.ASSETS`
+    if name == "ASSETS":
+        return get_assets()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-ASSETS = StaticFiles.from_env()
 
 def get_db_path(conn: sqlite3.Connection) -> str:
     return conn.execute("PRAGMA database_list").fetchone()[2]
\ No newline at end of file
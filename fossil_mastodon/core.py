@@ -3,21 +3,19 @@ import functools
 import importlib
 import json
 import logging
+import pathlib
 import random
 import sqlite3
 import string
 import traceback
 import typing
+import urllib.parse
 from typing import Optional, Type
 
-import html2text
-import llm
 import numpy as np
-from pydantic import BaseModel
-import requests
-import tiktoken
+from pydantic import BaseModel, PrivateAttr
 
-from fossil_mastodon import config, migrations
+from fossil_mastodon import client, compression, config, metrics, text, tokens
 
 if typing.TYPE_CHECKING:
     from fossil_mastodon import algorithm
@@ -26,11 +24,63 @@ if typing.TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
+EMBEDDING_TOKENS = metrics.counter("fossil_embedding_tokens_total", "Tokens sent to the embedding model")
+EMBEDDED_TOOTS = metrics.counter("fossil_embedded_toots_total", "Toots sent to the embedding model")
+DOWNLOADED_TOOTS = metrics.counter("fossil_downloaded_toots_total", "Toots downloaded from the home timeline")
+
+
 @functools.lru_cache()
 def _get_json(toot: "Toot") -> dict:
     # meh, this isn't great, but it works
-    import json
-    return json.loads(toot.orig_json)
+    if toot.orig_json is None and toot._orig_blob is not None:
+        # Skip the round trip through get_orig_json(), which re-serializes the whole status
+        data = json.loads(compression.decompress(toot._orig_blob))
+        if toot._account_json is not None:
+            data["account"] = json.loads(toot._account_json)
+        return data
+    return json.loads(toot.get_orig_json())
+
+
+def _split_account(orig_json: str) -> tuple[bytes, dict | None]:
+    """
+    Replace the (large, repetitive) account object in a status with a reference to the
+    accounts table, and compress what's left.
+    """
+    data = json.loads(orig_json)
+    account = data.get("account")
+    if account and "id" in account:
+        data["account"] = {"id": account["id"]}
+    else:
+        account = None
+    return compression.compress(json.dumps(data)), account
+
+
+def _join_account(blob: bytes, account_json: str | None) -> str:
+    if account_json is None:
+        return compression.decompress(blob)
+    data = json.loads(compression.decompress(blob))
+    data["account"] = json.loads(account_json)
+    return json.dumps(data)
+
+
+def _save_account(c: sqlite3.Cursor, account: dict):
+    c.execute('''
+        INSERT INTO accounts (id, acct, json) VALUES (?, ?, ?)
+        ON CONFLICT(id) DO UPDATE
+            SET acct = excluded.acct
+              , json = excluded.json
+              , updated_at = CURRENT_TIMESTAMP
+            WHERE json != excluded.json
+    ''', (account["id"], account.get("acct"), json.dumps(account)))
+
+
+# Columns & joins needed by Toot._from_row()
+_TOOT_COLUMNS = '''
+    toots.id, toots.content, toots.author, toots.url, toots.created_at, toots.embedding,
+    toots.orig_json, toots.cluster, toots.orig_json_z, accounts.json, toots.status_id, toots.in_reply_to_id,
+    toots.view_json, toots.plain_text, toots.safe_html, toots.token_count
+'''
+_TOOT_FROM = "toots LEFT JOIN accounts ON accounts.id = toots.account_id"
 
 
 class MediaAttatchment(BaseModel):
@@ -39,6 +89,53 @@ class MediaAttatchment(BaseModel):
     url: str | None
 
 
+class TootView(BaseModel):
+    """
+    What toot.html shows besides the content, derived from the status JSON once when the
+    toot is downloaded and stored in `toots.view_json`. Rendering a toot reads this small
+    object instead of decompressing & parsing the whole status.
+    """
+    display_name: str | None = None
+    profile_url: str | None = None
+    avatar_url: str | None = None
+    status_id: str | None = None
+    replies_count: int = 0
+    media_attachments: list[MediaAttatchment] = []
+    card_url: str | None = None
+    card_preview_url: str | None = None
+    # The toot's link for each ui.LinkStyle scheme
+    links: dict[str, str] = {}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TootView":
+        account = data.get("account") or {}
+        card = data.get("card") or {}
+        url = data.get("url")
+        links = {}
+        if url:
+            links["ivory"] = f"ivory://acct/openURL?url={urllib.parse.quote(url)}"
+            links["original"] = url
+        if account.get("acct") and data.get("id"):
+            links["desktop"] = f"{config.ConfigHandler.MASTO_BASE}/@{account['acct']}/{data['id']}"
+        return cls(
+            display_name=account.get("display_name"),
+            profile_url=account.get("url"),
+            avatar_url=account.get("avatar"),
+            status_id=data.get("id"),
+            replies_count=data.get("replies_count") or 0,
+            media_attachments=[
+                MediaAttatchment(type=m.get("type"), url=m.get("url"), preview_url=m.get("preview_url"))
+                for m in data.get("media_attachments", [])
+            ],
+            card_url=card.get("url"),
+            card_preview_url=card.get("image"),
+            links=links,
+        )
+
+    def to_json(self) -> str:
+        return self.model_dump_json(exclude_defaults=True)
+
+
 class Toot(BaseModel):
     class Config:
         arbitrary_types_allowed = True
@@ -50,43 +147,119 @@ class Toot(BaseModel):
     embedding: np.ndarray | None = None
     orig_json: str | None = None
     cluster: str | None = None  # Added cluster property
+    status_id: str | None = None  # The ID on the Mastodon server
+    in_reply_to_id: str | None = None
+    # Derived from `content` when the toot is downloaded (see text.py)
+    plain_text: str | None = None
+    safe_html: str | None = None
+    # Of plain_text. Filled in the first time something counts it.
+    token_count: int | None = None
+
+    # When loaded from the DB, the original JSON stays compressed until someone asks for it
+    _orig_blob: bytes | None = PrivateAttr(default=None)
+    _account_json: str | None = PrivateAttr(default=None)
+    _view_json: str | None = PrivateAttr(default=None)
+    _view: TootView | None = PrivateAttr(default=None)
+    # Near-duplicates of this toot that were collapsed into it (see dedup.py)
+    _duplicates: list["Toot"] = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def _from_row(cls, row: tuple) -> "Toot":
+        toot = cls(
+            id=row[0],
+            content=row[1],
+            author=row[2],
+            url=row[3],
+            created_at=row[4],
+            embedding=np.frombuffer(row[5]) if row[5] else None,
+            orig_json=row[6],
+            cluster=row[7],  # Added cluster property
+            status_id=row[10],
+            in_reply_to_id=row[11],
+            # Filled in by save() & the add_toot_text/backfill_toot_text migrations
+            plain_text=row[13],
+            safe_html=row[14],
+            token_count=row[15],
+        )
+        toot._orig_blob = row[8]
+        toot._account_json = row[9]
+        toot._view_json = row[12]
+        return toot
+
+    def get_orig_json(self) -> str | None:
+        if self.orig_json is None and self._orig_blob is not None:
+            return _join_account(self._orig_blob, self._account_json)
+        return self.orig_json
 
     @property
     def orig_dict(self) -> dict:
         return _get_json(self)
 
+    @property
+    def view(self) -> TootView:
+        if self._view is None:
+            if self._view_json is not None:
+                self._view = TootView.model_validate_json(self._view_json)
+            elif self.orig_json is not None or self._orig_blob is not None:
+                # Downloaded before views were stored
+                self._view = TootView.from_dict(self.orig_dict)
+            else:
+                self._view = TootView()
+        return self._view
+
     @property
     def avatar_url(self) -> str | None:
-        return self.orig_dict.get("account", {}).get("avatar")
+        return self.view.avatar_url
     
     @property
     def profile_url(self) -> str | None:    
-        return self.orig_dict.get("account", {}).get("url")
+        return self.view.profile_url
 
     @property
     def display_name(self) -> str | None:
-        return self.orig_dict.get("account", {}).get("display_name")
+        return self.view.display_name
 
     @property
     def toot_id(self) -> str | None:
-        return self.orig_dict.get("id")
+        return self.status_id or self.view.status_id
 
     @property
     def is_reply(self) -> bool:
+        if self.status_id is not None:
+            return self.in_reply_to_id is not None
         return self.orig_dict.get("in_reply_to_id") is not None
 
+    @property
+    def has_thread(self) -> bool:
+        return self.is_reply or bool(self.view.replies_count)
+
     @property
     def media_attachments(self) -> list[MediaAttatchment]:
-        return [MediaAttatchment(type=m.get("type"), url=m.get("url"), preview_url=m.get("preview_url")) 
-                for m in self.orig_dict.get("media_attachments", [])]
+        return self.view.media_attachments
 
     @property
     def card_preview_url(self) -> str | None:
-        return self.orig_dict.get("card", {}).get("image")
+        return self.view.card_preview_url
 
     @property
     def card_url(self) -> str | None:
-        return self.orig_dict.get("card", {}).get("url")
+        return self.view.card_url
+
+    @property
+    def duplicates(self) -> list["Toot"]:
+        return self._duplicates
+
+    @duplicates.setter
+    def duplicates(self, toots: list["Toot"]):
+        self._duplicates = toots
+
+    @property
+    def also_posted_by(self) -> list[str]:
+        authors = []
+        for toot in self._duplicates:
+            if toot.author and toot.author != self.author and toot.author not in authors:
+                authors.append(toot.author)
+        return authors
 
     def __hash__(self):
         return hash(self.url)
@@ -94,13 +267,13 @@ class Toot(BaseModel):
     def __eq__(self, other):
         return self.url == other.url
 
+    @metrics.span("toot.save")
     def save(self, init_conn: sqlite3.Connection | None = None) -> bool:
         try:
             if init_conn is None:
                 conn = config.ConfigHandler.open_db()
             else:
                 conn = init_conn
-            migrations.create_database()
             c = conn.cursor()
 
             # Check if the URL already exists
@@ -119,11 +292,32 @@ class Toot(BaseModel):
                 DELETE FROM toots WHERE url = ?
             ''', (self.url,))
 
+            # Toots that weren't built by from_dict(), e.g. by plugins, still get their text stored
+            if self.plain_text is None:
+                self.plain_text = text.plain_text(self.content)
+            if self.safe_html is None:
+                self.safe_html = text.sanitize_html(self.content)
             embedding = self.embedding.tobytes() if self.embedding is not None else bytes()
+            if self.orig_json:
+                orig_json_z, account = _split_account(self.orig_json)
+            else:
+                # Loaded from the database, so the JSON is already split & compressed. Keep its account link.
+                orig_json_z = self._orig_blob
+                account = json.loads(self._account_json) if self._account_json else None
+            if account is not None:
+                _save_account(c, account)
             c.execute('''
-                INSERT INTO toots (content, author, url, created_at, embedding, orig_json, cluster)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (self.content, self.author, self.url, self.created_at, embedding, self.orig_json, self.cluster))
+                INSERT INTO toots (content, author, url, created_at, embedding, orig_json_z, account_id, cluster,
+                                   status_id, in_reply_to_id, view_json, plain_text, safe_html, token_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (self.content, self.author, self.url, self.created_at, embedding, orig_json_z,
+                  account["id"] if account else None, self.cluster, self.status_id, self.in_reply_to_id,
+                  self._view_json or self.view.to_json(), self.plain_text, self.safe_html, self.token_count))
+            if self.status_id is not None:
+                c.execute('''
+                    INSERT INTO thread_index (status_id, in_reply_to_id) VALUES (?, ?)
+                    ON CONFLICT(status_id) DO NOTHING
+                ''', (self.status_id, self.in_reply_to_id))
 
         except:
             conn.rollback()
@@ -134,64 +328,35 @@ class Toot(BaseModel):
         return True
 
     @classmethod
+    @metrics.span("toot.get_toots_since")
     def get_toots_since(cls, since: datetime.datetime) -> list["Toot"]:
-        migrations.create_database()
         with config.ConfigHandler.open_db() as conn:
             c = conn.cursor()
 
-            c.execute('''
-                SELECT 
-                    id, content, author, url, created_at, embedding, orig_json, cluster
-                FROM toots WHERE created_at >= ?
+            c.execute(f'''
+                SELECT {_TOOT_COLUMNS}
+                FROM {_TOOT_FROM} WHERE toots.created_at >= ?
             ''', (since,))
 
-            rows = c.fetchall()
-            toots = []
-            for row in rows:
-                toot = cls(
-                    id=row[0],
-                    content=row[1],
-                    author=row[2],
-                    url=row[3],
-                    created_at=row[4],
-                    embedding=np.frombuffer(row[5]) if row[5] else None,
-                    orig_json=row[6],
-                    cluster=row[7]  # Added cluster property
-                )
-                toots.append(toot)
-
-            return toots
+            return [cls._from_row(row) for row in c.fetchall()]
 
     @classmethod
     def get_by_id(cls, id: int) -> Optional["Toot"]:
-        migrations.create_database()
         with config.ConfigHandler.open_db() as conn:
             c = conn.cursor()
 
-            c.execute('''
-                SELECT 
-                    id, content, author, url, created_at, embedding, orig_json, cluster
-                FROM toots WHERE id = ?
+            c.execute(f'''
+                SELECT {_TOOT_COLUMNS}
+                FROM {_TOOT_FROM} WHERE toots.id = ?
             ''', (id,))
 
             row = c.fetchone()
             if row:
-                toot = cls(
-                    id=row[0],
-                    content=row[1],
-                    author=row[2],
-                    url=row[3],
-                    created_at=row[4],
-                    embedding=np.frombuffer(row[5]) if row[5] else None,
-                    orig_json=row[6],
-                    cluster=row[7],  # Added cluster property
-                )
-                return toot
+                return cls._from_row(row)
             return None
 
     @staticmethod
     def get_latest_date() -> datetime.datetime | None:
-        migrations.create_database()
         with config.ConfigHandler.open_db() as conn:
             c = conn.cursor()
 
@@ -216,13 +381,19 @@ class Toot(BaseModel):
         if data.get("reblog"):
             return cls.from_dict(data["reblog"])
 
-        return cls(
+        toot = cls(
             content=data.get("content"),
             author=data.get("account", {}).get("acct"),
             url=data.get("url"),
             created_at=datetime.datetime.strptime(data.get("created_at"), "%Y-%m-%dT%H:%M:%S.%fZ"),
             orig_json=json.dumps(data),
+            status_id=data.get("id"),
+            in_reply_to_id=data.get("in_reply_to_id"),
+            plain_text=text.plain_text(data.get("content")),
+            safe_html=text.sanitize_html(data.get("content")),
         )
+        toot._view = TootView.from_dict(data)
+        return toot
 
     def do_star(self):
         print("star", self.url)
@@ -231,9 +402,50 @@ class Toot(BaseModel):
         print("boost", self.url)
 
 
+class Interaction(BaseModel):
+    """
+    Something you did with a toot, e.g. favourited or boosted it. Algorithms can use these
+    as signals of what you're interested in.
+    """
+    class Config:
+        arbitrary_types_allowed = True
+    url: str
+    kind: str  # "favourite" or "boost"
+    author: str | None
+    embedding: np.ndarray | None = None
+    created_at: datetime.datetime | None = None
+
+    @classmethod
+    def record(cls, toot: Toot, kind: str, init_conn: sqlite3.Connection | None = None):
+        conn = init_conn or config.ConfigHandler.open_db()
+        try:
+            conn.execute('''
+                INSERT INTO interactions (url, kind, author, embedding)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(url, kind) DO NOTHING
+            ''', (toot.url, kind, toot.author, toot.embedding.tobytes() if toot.embedding is not None else None))
+            if init_conn is None:
+                conn.commit()
+        finally:
+            if init_conn is None:
+                conn.close()
+
+    @classmethod
+    def get_all(cls) -> list["Interaction"]:
+        with config.ConfigHandler.open_db() as conn:
+            c = conn.cursor()
+            c.execute('''
+                SELECT url, kind, author, embedding, created_at FROM interactions
+            ''')
+            return [
+                cls(url=row[0], kind=row[1], author=row[2],
+                    embedding=np.frombuffer(row[3]) if row[3] else None, created_at=row[4])
+                for row in c.fetchall()
+            ]
+
+
 def get_toots_since(since: datetime.datetime, session_id: str):
     assert isinstance(since, datetime.datetime), type(since)
-    migrations.create_database()
     download_timeline(since, session_id)
     return Toot.get_toots_since(since)
 
@@ -245,21 +457,23 @@ def download_timeline(since: datetime.datetime, session_id: str):
     earliest_date = None
     buffer: list[Toot] = []
     last_id = ""
-    curr_url = f"{config.ConfigHandler.MASTO_BASE}/api/v1/timelines/home?limit=40"
+    masto = client.get_client()
+    curr_url = "/api/v1/timelines/home?limit=40"
     while not earliest_date or earliest_date > last_date:
-        response = requests.get(curr_url, headers=config.headers())
-        response.raise_for_status()
-        json = response.json()
-        if not json:
-            logger.info("No more toots")
-            break
-        if len(json) > 1:
-            last_id = json[-1]["id"]
-        logger.info(f"Got {len(json)} toots; earliest={earliest_date.isoformat() if earliest_date else None}, last_id={last_id}")
-        for toot_dict in json:
-            toot = Toot.from_dict(toot_dict)
-            earliest_date = toot.created_at if not earliest_date else min(earliest_date, datetime.datetime.strptime(toot_dict["created_at"], "%Y-%m-%dT%H:%M:%S.%fZ"))
-            buffer.append(toot)
+        with metrics.span("download_timeline.page"):
+            response = masto.get(curr_url)
+            json = response.json()
+            if not json:
+                logger.info("No more toots")
+                break
+            if len(json) > 1:
+                last_id = json[-1]["id"]
+            logger.info(f"Got {len(json)} toots; earliest={earliest_date.isoformat() if earliest_date else None}, last_id={last_id}")
+            for toot_dict in json:
+                toot = Toot.from_dict(toot_dict)
+                earliest_date = toot.created_at if not earliest_date else min(earliest_date, datetime.datetime.strptime(toot_dict["created_at"], "%Y-%m-%dT%H:%M:%S.%fZ"))
+                buffer.append(toot)
+            DOWNLOADED_TOOTS.inc(len(json))
 
         if "next" in response.links:
             curr_url = response.links["next"]["url"]
@@ -279,40 +493,55 @@ def download_timeline(since: datetime.datetime, session_id: str):
 
         # Example: Call the _create_embeddings function
         _create_embeddings(page_toots, session_id)
-        with config.ConfigHandler.open_db() as conn:
+        with metrics.span("download_timeline.save_page"), config.ConfigHandler.open_db() as conn:
             for toot in page_toots:
                 toot.save(init_conn=conn)
 
-def _prepare_text(text: str) -> str:
-    return html2text.html2text(text)[:1000]
+def _prepare_text(toot: Toot) -> str:
+    return (toot.plain_text if toot.plain_text is not None else text.plain_text(toot.content))[:1000]
+
+def _embed_batch(emb_model, batch: list[str], num_tokens: int) -> list[list[float]]:
+    with metrics.span("embeddings.batch", model=emb_model.model_id):
+        result = list(emb_model.embed_batch(batch))
+    EMBEDDING_TOKENS.inc(num_tokens, model=emb_model.model_id)
+    EMBEDDED_TOOTS.inc(len(batch), model=emb_model.model_id)
+    return result
+
 
 def _create_embeddings(toots: list[Toot], session_id: str):
+    # Slow to import, and only needed once there's something to embed
+    from fossil_mastodon import local_models
+
     # Convert the list of toots to a single string
     toots = [t for t in toots if t.content]
 
+    emb_model = local_models.get_embedding_model(config.ConfigHandler.EMBEDDING_MODEL(session_id).name)
+    if local_models.is_local(emb_model):
+        # Runs in-process with no token limit, so embed everything in one vectorized batch
+        embeddings = _embed_batch(emb_model, [_prepare_text(toot) for toot in toots], 0)
+        for toot, embedding in zip(toots, embeddings):
+            toot.embedding = np.array(embedding)
+        return toots
+
     # Call the llm embedding API to create embeddings
     # bugfix: The overall batch size seems to exceed the model's limit, so we need to split the batch into smaller chunks
-    emb_model = llm.get_embedding_model(config.ConfigHandler.EMBEDDING_MODEL(session_id).name)
     total_size = 0
     batch = []
     embeddings = []
-    measure = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    for toot in toots:
-        text = _prepare_text(toot.content)
-        new_tokens = len(measure.encode(text))
-        if total_size + new_tokens > 8000:
-            embeddings.extend(emb_model.embed_batch(batch))
+    # Counts of the whole text, so they're an upper bound for the truncated one
+    for toot, new_tokens in zip(toots, tokens.count_toots(toots)):
+        if batch and total_size + new_tokens > 8000:
+            embeddings.extend(_embed_batch(emb_model, batch, total_size))
             batch.clear()
             total_size = 0
-        else:
-            batch.append(text)
-            total_size += new_tokens
+        batch.append(_prepare_text(toot))
+        total_size += new_tokens
     if len(batch) > 0:
-        embeddings.extend(emb_model.embed_batch(batch))
+        embeddings.extend(_embed_batch(emb_model, batch, total_size))
         batch.clear()
 
     # Extract the embeddings from the API response
-    print(f"got {len(embeddings)} embeddings")
+    logger.debug(f"got {len(embeddings)} embeddings")
     for i, toot in enumerate(toots):
         toot.embedding = np.array(embeddings[i])
 
@@ -323,6 +552,10 @@ def _create_embeddings(toots: list[Toot], session_id: str):
 class Settings(BaseModel):
     embedding_model: str | None = None
     summarize_model: str | None = None
+    # Set these to use a different Mastodon account than the configured one. The account
+    # gets its own databases.
+    masto_base: str | None = None
+    access_token: str | None = None
 
 
 class Session(BaseModel):
@@ -340,6 +573,21 @@ class Session(BaseModel):
     def get_ui_settings(self) -> dict[str, str]:
         return json.loads(self.ui_settings or "{}")
 
+    def account(self) -> config.Account | None:
+        """
+        This session's own Mastodon account, or None for the default one.
+        """
+        if not self.settings.access_token:
+            return None
+        path = config.account_dir(self.id)
+        return config.Account(
+            name=self.name,
+            masto_base=self.settings.masto_base or config.default_account().masto_base,
+            access_token=self.settings.access_token,
+            database_path=str(path / "fossil.db"),
+            archive_path=str(path / "fossil-archive.db"),
+        )
+
     def get_algorithm_type(self) -> Type["algorithm.BaseAlgorithm"] | None:
         try:
             spec = json.loads(self.algorithm_spec) if self.algorithm_spec else {}
@@ -351,12 +599,21 @@ class Session(BaseModel):
             traceback.print_exc()
             return None
 
+    @classmethod
+    def _from_row(cls, row: tuple) -> "Session":
+        return cls(
+            id=row[0],
+            algorithm_spec=row[1],
+            algorithm=row[2],
+            ui_settings=row[3],
+            settings=Settings(**json.loads(row[4] or "{}")),
+            name=row[5],
+        )
+
+    # Sessions of every account live in the main database
     @classmethod
     def get_by_id(cls, id: str) -> Optional["Session"]:
-        migrations.create_database()
-        migrations.create_session_table()
-        with config.ConfigHandler.open_db() as conn:
-            print(f"Getting session; path={config.get_db_path(conn)}")
+        with config.ConfigHandler.open_main_db() as conn:
             c = conn.cursor()
 
             c.execute('''
@@ -365,24 +622,22 @@ class Session(BaseModel):
 
             row = c.fetchone()
             if row:
-                session = cls(
-                    id=row[0],
-                    algorithm_spec=row[1],
-                    algorithm=row[2],
-                    ui_settings=row[3],
-                    settings=Settings(**json.loads(row[4] or "{}")),
-                    name=row[5],
-                )
-                return session
+                return cls._from_row(row)
             return None
 
+    @classmethod
+    def get_all(cls) -> list["Session"]:
+        with config.ConfigHandler.open_main_db() as conn:
+            rows = conn.execute('''
+                SELECT id, algorithm_spec, algorithm, ui_settings, settings, name FROM sessions WHERE name IS NOT NULL
+            ''').fetchall()
+        return [cls._from_row(row) for row in rows]
+
     @classmethod
     def get_or_create(cls, name: str = "Main") -> "Session":
-        migrations.create_database()
-        migrations.create_session_table()
-        with config.ConfigHandler.open_db() as conn:
+        with config.ConfigHandler.open_main_db() as conn:
             c = conn.cursor()
-            c.execute(""" SELECT id FROM sessions WHERE name IS NOT NULL ORDER BY name DESC LIMIT 1 """)
+            c.execute(""" SELECT id FROM sessions WHERE name = ? LIMIT 1 """, (name,))
             row = c.fetchone()
             if row:
                 # this is dumb. the ai did it. it's also brilliant. slightly innefficient, but whatever. clean.
@@ -390,19 +645,29 @@ class Session(BaseModel):
                 assert obj is not None
                 return obj
             else:
-                rand_str = "".join(random.choices(string.ascii_lowercase) for _ in range(32))
+                rand_str = "".join(random.choices(string.ascii_lowercase, k=32))
                 obj = cls(id=rand_str, settings=Settings(), name=name)
                 obj.save(init_conn=conn)
+                conn.commit()
                 return obj
 
+    @classmethod
+    def for_current_account(cls) -> list["Session"]:
+        """
+        The sessions that use the account currently in context (see `config.use_account`).
+        """
+        path = config.ConfigHandler.DATABASE_PATH
+        return [
+            session for session in cls.get_all()
+            if (session.account() or config.default_account()).database_path == path
+        ]
+
     def save(self, init_conn: sqlite3.Connection | None = None) -> bool:
         try:
             if init_conn is None:
-                conn = config.ConfigHandler.open_db()
+                conn = config.ConfigHandler.open_main_db()
             else:
                 conn = init_conn
-            migrations.create_database()
-            migrations.create_session_table()
             c = conn.cursor()
 
             c.execute('''
@@ -421,4 +686,17 @@ class Session(BaseModel):
         except:
             conn.rollback()
             raise
+        if (account := self.account()) is not None:
+            pathlib.Path(account.database_path).parent.mkdir(parents=True, exist_ok=True)
         return True
+
+
+def get_accounts() -> list[config.Account]:
+    """
+    Every account: the default one & those of sessions with their own access token.
+    """
+    accounts = {config.default_account().database_path: config.default_account()}
+    for session in Session.get_all():
+        if (account := session.account()) is not None:
+            accounts.setdefault(account.database_path, account)
+    return list(accounts.values())
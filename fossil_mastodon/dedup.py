@@ -0,0 +1,149 @@
+"""
+Collapse near-duplicate toots, e.g. the same link or announcement posted by lots of accounts,
+into a single toot with "also posted by" metadata.
+
+Toots are grouped if any of these match:
+
+- The link card URL (ignoring tracking parameters & fragments)
+- The text, after stripping HTML, links, mentions, case & punctuation
+- The embedding, by cosine similarity >= `SIMILARITY_THRESHOLD`
+
+Embedding comparisons are vectorized. For big timelines, toots are first bucketed with
+random-hyperplane LSH so that only toots in the same bucket get compared, instead of every
+pair.
+"""
+import hashlib
+import html
+import re
+import urllib.parse
+
+import numpy as np
+
+from fossil_mastodon import core, metrics
+
+
+SIMILARITY_THRESHOLD = 0.97
+# Below this many characters, identical text is probably a coincidence ("Good morning!")
+MIN_TEXT_LENGTH = 30
+# Below this many toots, compare every pair directly rather than bucketing
+_BRUTE_FORCE_LIMIT = 2048
+_LSH_TABLES = 4
+_LSH_BITS = 8
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_URL_RE = re.compile(r"https?://\S+")
+_MENTION_RE = re.compile(r"@[\w.@-]+")
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def normalize_text(content: str | None) -> str:
+    text = html.unescape(_TAG_RE.sub(" ", content or ""))
+    text = _MENTION_RE.sub(" ", _URL_RE.sub(" ", text))
+    return _NON_WORD_RE.sub(" ", text.lower()).strip()
+
+
+def normalize_url(url: str | None) -> str | None:
+    if not url:
+        return None
+    parts = urllib.parse.urlsplit(url)
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query) if not k.lower().startswith("utm_")]
+    return urllib.parse.urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower(),
+        parts.path.rstrip("/"),
+        urllib.parse.urlencode(query),
+        "",
+    ))
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+
+def _similar_pairs(embeddings: np.ndarray, threshold: float) -> list[tuple[int, int]]:
+    """
+    Index pairs (i < j) of rows of `embeddings` (unit length) with cosine similarity >= threshold.
+    """
+    def within(indices: np.ndarray) -> list[tuple[int, int]]:
+        block = embeddings[indices]
+        i, j = np.nonzero(np.triu(block @ block.T >= threshold, k=1))
+        return list(zip(indices[i].tolist(), indices[j].tolist()))
+
+    if len(embeddings) <= _BRUTE_FORCE_LIMIT:
+        return within(np.arange(len(embeddings)))
+
+    pairs = set()
+    rng = np.random.default_rng(0)
+    powers = 1 << np.arange(_LSH_BITS)
+    for _ in range(_LSH_TABLES):
+        planes = rng.standard_normal((embeddings.shape[1], _LSH_BITS)).astype(np.float32)
+        codes = (embeddings @ planes > 0) @ powers
+        order = np.argsort(codes, kind="stable")
+        boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+        for bucket in np.split(order, boundaries):
+            if len(bucket) > 1:
+                pairs.update(within(np.sort(bucket)))
+    return list(pairs)
+
+
+@metrics.span("dedup.collapse")
+def collapse(toots: list[core.Toot], threshold: float = SIMILARITY_THRESHOLD) -> list[core.Toot]:
+    """
+    Group near-duplicate toots. Returns one toot per group (the earliest one), in the order
+    they were given, with the rest of the group in its `duplicates`.
+    """
+    n = len(toots)
+    groups = _UnionFind(n)
+
+    first_seen: dict[str, int] = {}
+    for i, toot in enumerate(toots):
+        toot.duplicates = []
+        keys = []
+        if (card_url := normalize_url(toot.card_url)) is not None:
+            keys.append("card:" + card_url)
+        if len(text := normalize_text(toot.content)) >= MIN_TEXT_LENGTH:
+            keys.append("text:" + hashlib.sha1(text.encode("utf-8")).hexdigest())
+        for key in keys:
+            if key in first_seen:
+                groups.union(first_seen[key], i)
+            else:
+                first_seen[key] = i
+
+    # Only compare embeddings of the same size, in case the embedding model was changed
+    with_embedding = [i for i, toot in enumerate(toots) if toot.embedding is not None]
+    if len(with_embedding) > 1:
+        shapes: dict[tuple, list[int]] = {}
+        for i in with_embedding:
+            shapes.setdefault(toots[i].embedding.shape, []).append(i)
+        indices = max(shapes.values(), key=len)
+        embeddings = np.empty((len(indices), toots[indices[0]].embedding.shape[0]), dtype=np.float32)
+        for row, i in enumerate(indices):
+            embeddings[row] = toots[i].embedding
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.where(norms == 0, 1.0, norms)
+        for a, b in _similar_pairs(embeddings, threshold):
+            groups.union(indices[a], indices[b])
+
+    members: dict[int, list[int]] = {}
+    for i in range(n):
+        members.setdefault(groups.find(i), []).append(i)
+
+    representatives = []
+    for group in members.values():
+        group.sort(key=lambda i: (toots[i].created_at, i))
+        toot = toots[group[0]]
+        toot.duplicates = [toots[i] for i in group[1:]]
+        representatives.append(group[0])
+    return [toots[i] for i in sorted(representatives)]
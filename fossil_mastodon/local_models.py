@@ -0,0 +1,166 @@
+"""
+Local, CPU-only models that run in-process, so fossil can work fully offline and without
+paying for a remote round-trip on every refresh and training run.
+
+- `fossil-local` (embeddings): hashed term frequencies, squashed down to a dense vector with
+  a fixed sparse random projection. It's vectorized with numpy/scipy, batches of thousands of
+  toots take milliseconds. The projection is derived from a fixed seed, so embeddings stay
+  comparable across restarts. Don't change `_SEED`, `_HASH_FEATURES` or `DIMENSIONS`, it
+  would make every stored embedding incompatible.
+- `fossil-extractive` (summarizing): labels clusters with their most distinctive keywords
+  (class-based TF-IDF, as in BERTopic) instead of asking an LLM.
+
+Both are registered as `llm` plugins (see `[tool.poetry.plugins.llm]` in pyproject.toml), so
+they show up in the settings page next to the remote models. Use `get_embedding_model` and
+`get_model` from this module instead of the `llm` functions of the same name; they work even
+when the entry points haven't been installed (e.g. running from a source checkout).
+"""
+import functools
+import html
+import math
+import re
+from collections import Counter
+from typing import Iterable, Iterator
+
+import llm
+import numpy as np
+
+
+EMBEDDING_MODEL_ID = "fossil-local"
+SUMMARIZE_MODEL_ID = "fossil-extractive"
+
+DIMENSIONS = 512
+_HASH_FEATURES = 2 ** 18
+_NONZEROS_PER_FEATURE = 4
+_SEED = 1729
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_URL_RE = re.compile(r"https?://\S+")
+_WORD_RE = re.compile(r"(?u)\b[^\W\d_][\w'-]+\b")
+
+
+def strip_html(text: str) -> str:
+    """
+    Cheap HTML to text, good enough for bag-of-words models.
+    """
+    text = _TAG_RE.sub(" ", text)
+    return _URL_RE.sub(" ", html.unescape(text))
+
+
+@functools.lru_cache()
+def _projection():
+    """
+    A sparse random projection from the hashed feature space down to DIMENSIONS. Each hashed
+    feature lands on a few random dimensions with a random sign.
+    """
+    from scipy import sparse
+
+    rng = np.random.default_rng(_SEED)
+    rows = np.repeat(np.arange(_HASH_FEATURES), _NONZEROS_PER_FEATURE)
+    cols = rng.integers(0, DIMENSIONS, size=_HASH_FEATURES * _NONZEROS_PER_FEATURE)
+    signs = rng.choice(np.array([-1.0, 1.0], dtype=np.float32), size=_HASH_FEATURES * _NONZEROS_PER_FEATURE)
+    values = signs / np.sqrt(_NONZEROS_PER_FEATURE)
+    return sparse.csr_matrix((values, (rows, cols)), shape=(_HASH_FEATURES, DIMENSIONS), dtype=np.float32)
+
+
+@functools.lru_cache()
+def _vectorizer():
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    return HashingVectorizer(
+        n_features=_HASH_FEATURES,
+        ngram_range=(1, 2),
+        stop_words="english",
+        alternate_sign=False,
+        norm=None,
+        preprocessor=lambda text: strip_html(text).lower(),
+    )
+
+
+class LocalEmbeddingModel(llm.EmbeddingModel):
+    model_id = EMBEDDING_MODEL_ID
+    batch_size = 4096
+
+    def embed_batch(self, items: Iterable[str]) -> Iterator[list[float]]:
+        items = list(items)
+        if not items:
+            return iter([])
+        counts = _vectorizer().transform(items).astype(np.float32)
+        # Sublinear term frequency, so that one repeated word doesn't dominate a toot
+        counts.data = 1.0 + np.log(counts.data)
+        vectors = np.asarray((counts @ _projection()).todense())
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        return iter(vectors.tolist())
+
+
+class ExtractiveModel(llm.Model):
+    """
+    Answers any prompt with the most frequent keywords in it. Mostly here so that the
+    extractive labeler can be selected like any other summarizing model; `label_clusters`
+    does the real work.
+    """
+    model_id = SUMMARIZE_MODEL_ID
+
+    def execute(self, prompt, stream, response, conversation):
+        yield ", ".join(top_keywords(prompt.prompt or "", 3))
+
+
+def _tokenize(text: str) -> list[str]:
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+    return [w for w in _WORD_RE.findall(strip_html(text).lower()) if len(w) > 2 and w not in ENGLISH_STOP_WORDS]
+
+
+def top_keywords(text: str, n: int) -> list[str]:
+    return [word for word, _ in Counter(_tokenize(text)).most_common(n)]
+
+
+def label_clusters(texts_by_cluster: dict[int, list[str]], n_words: int = 3) -> dict[int, str]:
+    """
+    Label each cluster by the words that are frequent in it, but rare in the other clusters
+    (class-based TF-IDF). Returns labels like "espresso, grinder, roast".
+    """
+    counts = {cluster: Counter(w for text in texts for w in _tokenize(text)) for cluster, texts in texts_by_cluster.items()}
+    total_words = sum(sum(c.values()) for c in counts.values())
+    avg_words = total_words / max(len(counts), 1)
+    word_totals: Counter = Counter()
+    for c in counts.values():
+        word_totals.update(c)
+
+    labels: dict[int, str] = {}
+    for cluster, c in counts.items():
+        size = sum(c.values())
+        if size == 0:
+            labels[cluster] = "Misc"
+            continue
+        scores = {word: (n / size) * math.log(1 + avg_words / word_totals[word]) for word, n in c.items()}
+        best = sorted(scores, key=lambda word: (-scores[word], word))[:n_words]
+        labels[cluster] = ", ".join(best)
+    return labels
+
+
+def is_local(model) -> bool:
+    return getattr(model, "model_id", None) in (EMBEDDING_MODEL_ID, SUMMARIZE_MODEL_ID)
+
+
+def get_embedding_model(name: str) -> llm.EmbeddingModel:
+    if name == EMBEDDING_MODEL_ID:
+        return LocalEmbeddingModel()
+    return llm.get_embedding_model(name)
+
+
+def get_model(name: str) -> llm.Model:
+    if name == SUMMARIZE_MODEL_ID:
+        return ExtractiveModel()
+    return llm.get_model(name)
+
+
+@llm.hookimpl
+def register_embedding_models(register):
+    register(LocalEmbeddingModel())
+
+
+@llm.hookimpl
+def register_models(register):
+    register(ExtractiveModel())
@@ -0,0 +1,188 @@
+"""
+Lightweight, in-process instrumentation.
+
+Timings and counters are kept in memory and exposed in the Prometheus text format at
+`GET /metrics`. There's no dependency on a Prometheus client library; this only needs to be
+good enough to find hot spots.
+
+    with metrics.span("download_timeline.page"):
+        ...
+
+    @metrics.span("toot.save")
+    def save(...):
+        ...
+
+    metrics.counter("fossil_embedding_tokens_total", "Tokens sent to the embedding model").inc(n)
+"""
+import contextlib
+import contextvars
+import cProfile
+import threading
+import time
+from collections import defaultdict
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _label_key(labels: dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: dict[str, str] | None = None) -> str:
+    pairs = list(key) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[LabelKey, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def expose(self) -> list[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._counts: dict[LabelKey, list[int]] = {}
+        self._sums: dict[LabelKey, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._sums[key] += value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(_label_key(labels), []))
+
+    def sum(self, **labels) -> float:
+        return self._sums.get(_label_key(labels), 0.0)
+
+    def expose(self) -> list[str]:
+        lines = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': str(bound)})} {cumulative}")
+                cumulative += counts[-1]
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {self._sums[key]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+_registry: dict[str, Counter | Histogram] = {}
+_registry_lock = threading.Lock()
+
+
+def counter(name: str, help: str = "") -> Counter:
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = Counter(name, help)
+        return _registry[name]
+
+
+def histogram(name: str, help: str = "", buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = Histogram(name, help, buckets)
+        return _registry[name]
+
+
+SPANS = histogram("fossil_span_duration_seconds", "Time spent in instrumented sections of code")
+
+
+@contextlib.contextmanager
+def span(name: str, **labels):
+    """
+    Time a block of code. Works as a context manager or a decorator. Exceptions are counted
+    with `error="true"`.
+    """
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        observe_span(name, time.perf_counter() - start, error, **labels)
+
+
+def observe_span(name: str, seconds: float, error: bool = False, **labels):
+    """
+    Record a span that was timed by hand, e.g. one whose work is spread over several steps.
+    """
+    SPANS.observe(seconds, span=name, error=str(error).lower(), **labels)
+
+
+class Profile:
+    """
+    A cProfile profile of one request. The request handler and its streamed response body run
+    on different threads, so each part is added with `running()`, one at a time.
+    """
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def running(self):
+        with self._lock:
+            self.profiler.enable()
+            try:
+                yield
+            finally:
+                self.profiler.disable()
+
+
+# The profile of the current request, if it's being profiled (see server.profile_middleware)
+request_profile: contextvars.ContextVar[Profile | None] = contextvars.ContextVar("request_profile", default=None)
+
+
+def render_prometheus() -> str:
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        if metric.help:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
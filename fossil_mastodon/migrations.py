@@ -1,99 +1,431 @@
 """
-Migration scripts to update the SQLite schema that are run at the last possible moment.
-There's no version numbers, so each script is responsible for "knowing" when it needs
-to run itself.
+Migration scripts to update the SQLite schema.
 
-Typically you should have a @lru_cache on each function to prevent unnecessary invocations,
-but also know that it'll get re-invoked every time the server restarts.
+Every migration is applied exactly once per database. Applied migrations are recorded, by
+name, in the `schema_migrations` table. Pending migrations are applied in the order they
+were registered, at server startup (see `plugins.init_plugins`) and otherwise the first time
+a process opens a database (see `config.ConfigHandler.open_db`). So there's no need to call
+them from the code that uses the tables.
+
+A migration is identified by its module & function name, so don't rename them once they've
+shipped. Migrations receive an open connection; the runner commits after each one:
+
+    @migrations.migration
+    def _create_my_table(conn: sqlite3.Connection):
+        conn.execute("CREATE TABLE IF NOT EXISTS my_table (...)")
+
+Migrations that take no arguments are supported too, for older plugins. They have to open
+their own connection.
 """
-import functools
+import inspect
+import json
+import logging
 import random
 import sqlite3
 import string
+import threading
 
 from fossil_mastodon import config
 
+
+logger = logging.getLogger(__name__)
+
+
+# Database paths that have been migrated by this process
+_migrated_paths: set[str] = set()
+_lock = threading.RLock()
+_local = threading.local()
+
+
 class migration:
     """
     Decorator that tracks all migration functions.
     """
     all: list["migration"] = []
-    __counter = 0
 
     def __init__(self, func: callable):
         self.func = func
-        self.cached = functools.lru_cache()(func)
-        migration.__counter += 1
-        self.id = migration.__counter
+        self.name = f"{func.__module__}.{func.__qualname__}"
+        self.takes_conn = len(inspect.signature(func).parameters) > 0
         migration.all.append(self)
+        # Something registered a new migration (e.g. a plugin loaded). Check again.
+        _migrated_paths.clear()
+
+    def __call__(self):
+        """
+        Kept for older callers: ensures this (and every other) migration has been applied.
+        """
+        config.ConfigHandler.open_db().close()
+
+    def apply(self, conn: sqlite3.Connection):
+        if self.takes_conn:
+            self.func(conn)
+        else:
+            self.func()
+
+
+def ensure_migrated(conn: sqlite3.Connection, path: str):
+    """
+    Apply pending migrations to the database at `path`, unless this process already did.
+    Called by `ConfigHandler.open_db` on every connection, so the fast path must stay cheap.
+    """
+    if path in _migrated_paths or getattr(_local, "running", False):
+        return
+    from fossil_mastodon import workers
+
+    # The thread lock covers this process, the file lock covers other worker processes
+    with _lock, workers.exclusive(path):
+        if path in _migrated_paths:
+            return
+        _local.running = True
+        try:
+            run_pending(conn)
+            _migrated_paths.add(path)
+        finally:
+            _local.running = False
+
+
+def run_pending(conn: sqlite3.Connection) -> list[str]:
+    """
+    Apply every registered migration that hasn't been applied to this database yet. Returns
+    the names of the migrations that were applied.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name TEXT PRIMARY KEY,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    applied = {row[0] for row in conn.execute("SELECT name FROM schema_migrations")}
+
+    newly_applied = []
+    for m in migration.all:
+        if m.name in applied:
+            continue
+        logger.info(f"Applying migration {m.name}")
+        try:
+            m.apply(conn)
+            conn.execute("INSERT INTO schema_migrations (name) VALUES (?)", (m.name,))
+            conn.commit()
+        except:
+            conn.rollback()
+            logger.exception(f"Migration {m.name} failed")
+            raise
+        newly_applied.append(m.name)
+    return newly_applied
+
+
+def run():
+    """
+    Apply pending migrations to the configured database. Call this at startup.
+    """
+    config.ConfigHandler.open_db().close()
+
 
-    def __call__(self, *args, **kwargs):
-        return self.cached(*args, **kwargs)
+@migration
+def create_database(conn: sqlite3.Connection):
+    c = conn.cursor()
+
+    # Create the toots table if it doesn't exist
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS toots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            content TEXT,
+            author TEXT,
+            url TEXT,
+            created_at DATETIME,
+            embedding BLOB,
+            orig_json TEXT,
+            cluster TEXT  -- Added cluster column
+        )
+    ''')
 
 
 @migration
-def create_database():
-    with config.ConfigHandler.open_db() as conn:
-        c = conn.cursor()
+def create_session_table(conn: sqlite3.Connection):
+    c = conn.cursor()
+
+    # Create the toots table if it doesn't exist
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            algorithm_spec TEXT,
+            algorithm BLOB,
+            ui_settings TEXT
+        )
+    ''')
 
-        # Create the toots table if it doesn't exist
+    try:
         c.execute('''
-            CREATE TABLE IF NOT EXISTS toots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                content TEXT,
-                author TEXT,
-                url TEXT,
-                created_at DATETIME,
-                embedding BLOB,
-                orig_json TEXT,
-                cluster TEXT  -- Added cluster column
-            )
+            ALTER TABLE sessions ADD COLUMN settings TEXT
         ''')
+    except sqlite3.OperationalError:
+        pass
 
-        conn.commit()
+    # Add session name
+    try:
+        c.execute('''
+            ALTER TABLE sessions ADD COLUMN name TEXT
+        ''')
+    except sqlite3.OperationalError:
+        pass
+
+    c.execute("DELETE FROM sessions WHERE name IS NULL")
+
+    c2 = conn.cursor()
+    c2.execute("SELECT COUNT(*) FROM sessions")
+    row_count = c2.fetchone()[0]
+    if row_count == 0:
+        rand_str = "".join(random.choice(string.ascii_lowercase) for _ in range(32))
+        c2.execute("""
+        INSERT INTO sessions (id, name, settings)
+            VALUES (?, ?, '{}')
+        """, (rand_str, "Main"))
 
 
 @migration
-def create_session_table():
-    create_database()
-    with config.ConfigHandler.open_db() as conn:
-        c = conn.cursor()
+def create_toots_created_at_index(conn: sqlite3.Connection):
+    c = conn.cursor()
 
-        # Create the toots table if it doesn't exist
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                id TEXT PRIMARY KEY,
-                algorithm_spec TEXT,
-                algorithm BLOB,
-                ui_settings TEXT
-            )
-        ''')
+    # Both timeline queries and retention scan by created_at
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS toots_created_at ON toots (created_at)
+    ''')
+
+
+@migration
+def compress_orig_json(conn: sqlite3.Connection):
+    """
+    Move account objects into their own table and store the rest of the status JSON
+    compressed. Existing rows are converted in batches; afterwards `orig_json` is only
+    used for rows that haven't been converted yet.
+    """
+    from fossil_mastodon import core
 
+    c = conn.cursor()
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS accounts (
+            id TEXT PRIMARY KEY,
+            acct TEXT,
+            json TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    for column in ["orig_json_z BLOB", "account_id TEXT"]:
         try:
-            c.execute('''
-                ALTER TABLE sessions ADD COLUMN settings TEXT
-            ''')
+            c.execute(f"ALTER TABLE toots ADD COLUMN {column}")
         except sqlite3.OperationalError:
             pass
 
-        # Add session name
+    while True:
+        rows = c.execute("SELECT id, orig_json FROM toots WHERE orig_json IS NOT NULL LIMIT 500").fetchall()
+        if not rows:
+            break
+        for id, orig_json in rows:
+            blob, account = core._split_account(orig_json)
+            if account is not None:
+                core._save_account(c, account)
+            c.execute('''
+                UPDATE toots SET orig_json_z = ?, account_id = ?, orig_json = NULL WHERE id = ?
+            ''', (blob, account["id"] if account else None, id))
+        conn.commit()
+
+
+@migration
+def create_interactions_table(conn: sqlite3.Connection):
+    c = conn.cursor()
+
+    # Toots you favourited or boosted. The embedding is copied in so that it survives the
+    # toot being archived by retention.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS interactions (
+            url TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            author TEXT,
+            embedding BLOB,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (url, kind)
+        )
+    ''')
+
+
+@migration
+def index_reply_threads(conn: sqlite3.Connection):
+    """
+    Index reply relationships, so that threads can be assembled with one query instead of
+    parsing every toot's JSON. `thread_index` has a row for every status we know about: toots
+    from the home timeline (json_z is NULL, the JSON is in `toots`) and statuses fetched from
+    `/api/v1/statuses/:id/context` to fill in threads (see threads.py).
+    """
+    from fossil_mastodon import compression
+
+    c = conn.cursor()
+
+    for column in ["status_id TEXT", "in_reply_to_id TEXT"]:
         try:
+            c.execute(f"ALTER TABLE toots ADD COLUMN {column}")
+        except sqlite3.OperationalError:
+            pass
+    c.execute("CREATE INDEX IF NOT EXISTS toots_status_id ON toots (status_id)")
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS thread_index (
+            status_id TEXT PRIMARY KEY,
+            in_reply_to_id TEXT,
+            json_z BLOB,
+            -- For fetched statuses, when they were fetched. For toots, when their context was.
+            fetched_at DATETIME
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS thread_index_in_reply_to_id ON thread_index (in_reply_to_id)")
+
+    last_id = 0
+    while True:
+        rows = c.execute('''
+            SELECT id, orig_json_z, orig_json FROM toots WHERE id > ? ORDER BY id LIMIT 500
+        ''', (last_id,)).fetchall()
+        if not rows:
+            break
+        for id, orig_json_z, orig_json in rows:
+            last_id = id
+            if orig_json_z is not None:
+                data = json.loads(compression.decompress(orig_json_z))
+            elif orig_json is not None:
+                data = json.loads(orig_json)
+            else:
+                continue
+            if "id" not in data:
+                continue
+            c.execute('''
+                UPDATE toots SET status_id = ?, in_reply_to_id = ? WHERE id = ?
+            ''', (data["id"], data.get("in_reply_to_id"), id))
             c.execute('''
-                ALTER TABLE sessions ADD COLUMN name TEXT
-            ''')
+                INSERT INTO thread_index (status_id, in_reply_to_id) VALUES (?, ?)
+                ON CONFLICT(status_id) DO NOTHING
+            ''', (data["id"], data.get("in_reply_to_id")))
+        conn.commit()
+
+
+@migration
+def enable_wal(conn: sqlite3.Connection):
+    # Readers don't block the writer (or each other), so several worker processes can share
+    # the database. The journal mode is stored in the database file, so this sticks.
+    conn.execute("PRAGMA journal_mode = WAL")
+
+
+@migration
+def create_scheduled_jobs_table(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name TEXT PRIMARY KEY,
+            last_run_at DATETIME,
+            seconds REAL,
+            last_error TEXT
+        )
+    ''')
+
+
+@migration
+def add_toot_views(conn: sqlite3.Connection):
+    """
+    Store what toot.html needs (see `core.TootView`) alongside each toot, so rendering doesn't
+    parse the whole status JSON.
+    """
+    from fossil_mastodon import compression, core
+
+    c = conn.cursor()
+    try:
+        c.execute("ALTER TABLE toots ADD COLUMN view_json TEXT")
+    except sqlite3.OperationalError:
+        pass
+
+    last_id = 0
+    while True:
+        rows = c.execute('''
+            SELECT toots.id, toots.orig_json_z, toots.orig_json, accounts.json
+            FROM toots LEFT JOIN accounts ON accounts.id = toots.account_id
+            WHERE toots.id > ? ORDER BY toots.id LIMIT 500
+        ''', (last_id,)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for id, orig_json_z, orig_json, account_json in rows:
+            last_id = id
+            if orig_json_z is not None:
+                data = json.loads(compression.decompress(orig_json_z))
+            elif orig_json is not None:
+                data = json.loads(orig_json)
+            else:
+                continue
+            if account_json is not None:
+                data["account"] = json.loads(account_json)
+            updates.append((core.TootView.from_dict(data).to_json(), id))
+        c.executemany("UPDATE toots SET view_json = ? WHERE id = ?", updates)
+        conn.commit()
+
+
+@migration
+def add_toot_text(conn: sqlite3.Connection):
+    """
+    Store the plain text & sanitized HTML of each toot (see text.py), so that embedding,
+    prompts & rendering don't convert the HTML again every time.
+    """
+    from fossil_mastodon import text
+
+    c = conn.cursor()
+    for column in ["plain_text TEXT", "safe_html TEXT", "token_count INTEGER"]:
+        try:
+            c.execute(f"ALTER TABLE toots ADD COLUMN {column}")
         except sqlite3.OperationalError:
             pass
 
-        c.execute("DELETE FROM sessions WHERE name IS NULL")
+    last_id = 0
+    while True:
+        rows = c.execute('''
+            SELECT id, content FROM toots WHERE id > ? ORDER BY id LIMIT 500
+        ''', (last_id,)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        c.executemany('''
+            UPDATE toots SET plain_text = ?, safe_html = ? WHERE id = ?
+        ''', [(text.plain_text(content), text.sanitize_html(content), id) for id, content in rows])
+        conn.commit()
+
+
+@migration
+def remove_account_db_sessions(conn: sqlite3.Connection):
+    """
+    Sessions are only read from the main database (see open_main_db). Account databases get
+    the table too, so that every database has the same schema, but create_session_table also
+    seeds a "Main" session in them, which nothing ever reads.
+    """
+    if not config.is_main_db(conn):
+        conn.execute("DELETE FROM sessions")
+
 
-        c2 = conn.cursor()
-        c2.execute("SELECT COUNT(*) FROM sessions")
-        row_count = c2.fetchone()[0]
-        if row_count == 0:
-            rand_str = "".join(random.choice(string.ascii_lowercase) for _ in range(32))
-            c2.execute("""
-            INSERT INTO sessions (id, name, settings)
-                VALUES (?, ?, '{}')
-            """, (rand_str, "Main"))
+@migration
+def backfill_toot_text(conn: sqlite3.Connection):
+    """
+    Fill in the text of toots that were saved without it after add_toot_text ran, so that
+    reading a toot never has to convert its HTML.
+    """
+    from fossil_mastodon import text
 
-        conn.commit()
\ No newline at end of file
+    c = conn.cursor()
+    last_id = 0
+    while True:
+        rows = c.execute('''
+            SELECT id, content FROM toots
+            WHERE id > ? AND (plain_text IS NULL OR safe_html IS NULL) ORDER BY id LIMIT 500
+        ''', (last_id,)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        c.executemany('''
+            UPDATE toots SET plain_text = ?, safe_html = ? WHERE id = ?
+        ''', [(text.plain_text(content), text.sanitize_html(content), id) for id, content in rows])
+        conn.commit()
@@ -0,0 +1,171 @@
+"""
+Ranks toots by how likely you are to care about them, instead of grouping them.
+
+The score mixes three signals, computed for all toots at once with numpy:
+
+- Interest: cosine similarity to the closest of your "interest vectors", which are learned
+  from the toots you've favourited or boosted (see `core.Interaction`)
+- Author affinity: how often you've interacted with the author before
+- Recency: exponential decay with a configurable half-life
+
+Toots from the same conversation are shown together, oldest first, where the best of them
+ranked (see `threads.group_by_conversation`).
+"""
+import datetime
+
+import numpy as np
+import pydantic
+from fastapi import Response, responses
+
+from fossil_mastodon import algorithm, core, plugins, projection, threads
+
+
+plugin = plugins.Plugin(
+    name="Ranked",
+    description="Rank toots by similarity to ones you've favourited or boosted, author affinity and recency",
+)
+
+
+INTEREST_WEIGHT = 1.0
+AUTHOR_WEIGHT = 0.3
+RECENCY_WEIGHT = 0.5
+
+
+class RankedRenderer(algorithm.Renderable, pydantic.BaseModel):
+    toots: list[core.Toot]
+    context: plugins.RenderContext
+
+    def render(self, **response_args) -> Response:
+        return self.context.stream_template("toot_list.html", {
+            "toots": self.toots,
+        },
+        **response_args)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+@plugin.algorithm
+class Ranked(algorithm.BaseAlgorithm):
+    def __init__(self, interests: np.ndarray, author_affinity: dict[str, float], half_life_hours: float, max_toots: int,
+                 projection: projection.Projection | None = None):
+        # (n_interests, dims), unit length
+        self.interests = interests
+        self.author_affinity = author_affinity
+        self.half_life_hours = half_life_hours
+        self.max_toots = max_toots
+        # The interests live in the projected space, if there is one
+        self.projection = projection
+
+    def _embedding_matrix(self, toots: list[core.Toot]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        A mask of toots that can be compared with the interests, and their (projected) embeddings.
+        """
+        # Models pickled before projections existed don't have one
+        if (proj := getattr(self, "projection", None)) is not None:
+            return proj.project_toots(toots)
+        dims = self.interests.shape[1]
+        # Toots embedded by a different model than the interests can't be compared
+        mask = np.fromiter((toot.embedding is not None and toot.embedding.shape == (dims,) for toot in toots), dtype=bool, count=len(toots))
+        embeddings = np.empty((int(mask.sum()), dims), dtype=np.float32)
+        for row, toot in enumerate(toot for toot, ok in zip(toots, mask) if ok):
+            embeddings[row] = toot.embedding
+        return mask, embeddings
+
+    def scores(self, toots: list[core.Toot], now: datetime.datetime | None = None) -> np.ndarray:
+        now = now or datetime.datetime.utcnow()
+        n = len(toots)
+        interest = np.zeros(n)
+        if len(self.interests) > 0:
+            mask, embeddings = self._embedding_matrix(toots)
+            if mask.any():
+                # Cosine similarity, without materializing a normalized copy of the embeddings
+                norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings))
+                similarity = (embeddings @ self.interests.T.astype(np.float32)).max(axis=1)
+                interest[mask] = similarity / np.where(norms == 0, 1.0, norms)
+
+        affinity = np.fromiter((self.author_affinity.get(toot.author, 0.0) for toot in toots), dtype=float, count=n)
+        # Timestamps are naive UTC, like everything else in the database
+        created_at = np.array([toot.created_at for toot in toots], dtype="datetime64[s]")
+        age_hours = np.maximum((np.datetime64(now, "s") - created_at) / np.timedelta64(1, "h"), 0)
+        recency = 0.5 ** (age_hours / self.half_life_hours)
+
+        return INTEREST_WEIGHT * interest + AUTHOR_WEIGHT * affinity + RECENCY_WEIGHT * recency
+
+    def render(self, toots: list[core.Toot], context: plugins.RenderContext) -> RankedRenderer:
+        if not toots:
+            return RankedRenderer(toots=[], context=context)
+        scores = self.scores(toots)
+        top = np.argsort(-scores, kind="stable")[:self.max_toots]
+        conversations = threads.group_by_conversation([toots[i] for i in top])
+        return RankedRenderer(toots=[toot for thread in conversations for toot in thread.toots], context=context)
+
+    @classmethod
+    def train(cls, context: algorithm.TrainContext, args: dict[str, str]) -> "Ranked":
+        interactions = core.Interaction.get_all()
+        known = {(i.url, i.kind) for i in interactions}
+
+        # Pick up favourites & boosts made from other apps. Mastodon reports them on the
+        # statuses in the home timeline.
+        for toot in context.get_toots():
+            for kind, flag in [("favourite", "favourited"), ("boost", "reblogged")]:
+                if toot.orig_dict.get(flag) and (toot.url, kind) not in known:
+                    core.Interaction.record(toot, kind)
+                    interactions.append(core.Interaction(url=toot.url, kind=kind, author=toot.author, embedding=toot.embedding))
+
+        proj = projection.current_or_fit(projection.stack_common_shape([toot.embedding for toot in context.get_toots()]))
+        return cls(
+            interests=cls._learn_interests(interactions, int(args.get("num_interests", 8)), proj),
+            author_affinity=cls._author_affinity(interactions),
+            half_life_hours=float(args.get("half_life_hours", 12)),
+            max_toots=int(args.get("max_toots", 200)),
+            projection=proj,
+        )
+
+    @staticmethod
+    def _learn_interests(interactions: list[core.Interaction], num_interests: int,
+                         proj: projection.Projection | None = None) -> np.ndarray:
+        embeddings = [i.embedding for i in interactions if i.embedding is not None]
+        if proj is not None:
+            embeddings = [e for e in embeddings if proj.accepts(e)]
+        if not embeddings:
+            return np.zeros((0, 0))
+        # Only the most common embedding size, in case the embedding model was changed
+        dims = max({e.shape for e in embeddings}, key=lambda shape: sum(e.shape == shape for e in embeddings))
+        vectors = np.vstack([e for e in embeddings if e.shape == dims])
+        vectors = _normalize(proj.transform(vectors) if proj is not None else vectors)
+        if len(vectors) <= num_interests:
+            return vectors
+
+        from sklearn.cluster import KMeans
+        kmeans = KMeans(n_clusters=num_interests, n_init=3, random_state=0).fit(vectors)
+        return _normalize(kmeans.cluster_centers_)
+
+    @staticmethod
+    def _author_affinity(interactions: list[core.Interaction]) -> dict[str, float]:
+        counts: dict[str, int] = {}
+        for i in interactions:
+            if i.author:
+                counts[i.author] = counts.get(i.author, 0) + 1
+        if not counts:
+            return {}
+        most = np.log1p(max(counts.values()))
+        return {author: float(np.log1p(count) / most) for author, count in counts.items()}
+
+    @staticmethod
+    def render_model_params(context: plugins.RenderContext) -> Response:
+        settings = context.session.get_ui_settings()
+        half_life = settings.get("half_life_hours", "12")
+        max_toots = settings.get("max_toots", "200")
+        return responses.HTMLResponse(f"""
+            <div class="slider">
+                <input type="range" name="half_life_hours" id="half_life_hours" min="1" max="72" value="{half_life}" onchange="document.getElementById('half_life_hours_value').innerHTML = this.value">
+                <span>half-life of <span class="slider-value" id="half_life_hours_value">{half_life}</span> hours</span>
+            </div>
+            <div class="slider">
+                <input type="range" name="max_toots" id="max_toots" min="20" max="1000" step="20" value="{max_toots}" onchange="document.getElementById('max_toots_value').innerHTML = this.value">
+                <span>top <span class="slider-value" id="max_toots_value">{max_toots}</span> toots</span>
+            </div>
+        """)
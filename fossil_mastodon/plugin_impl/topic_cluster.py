@@ -1,15 +1,28 @@
+import datetime
 import functools
+import json
+import logging
 import random
+import sqlite3
 import string
-import llm
+import typing
+import urllib.parse
 import numpy as np
 import pydantic
-import tiktoken
-from fastapi import Response, responses
-from sklearn.cluster import KMeans
-from tqdm import trange
+from fastapi import Request, Response, responses
 
-from fossil_mastodon import algorithm, config, core, migrations, plugins, ui
+from fossil_mastodon import algorithm, config, core, dedup, metrics, migrations, plugins, projection, retention, tokens, training, ui
+
+# sklearn, llm & tiktoken are imported inside the functions that use them. This module is
+# loaded at server startup, and those imports alone take seconds.
+if typing.TYPE_CHECKING:
+    from sklearn.cluster import KMeans
+
+
+logger = logging.getLogger(__name__)
+
+
+PROMPT_TOKENS = metrics.counter("fossil_prompt_tokens_total", "Tokens sent to the summarizing model")
 
 
 plugin = plugins.Plugin(
@@ -21,33 +34,81 @@ plugin = plugins.Plugin(
 class ClusterRenderer(algorithm.Renderable, pydantic.BaseModel):
     clusters: list[ui.TootCluster]
     context: plugins.RenderContext
+    auto_k: bool = False
+    # Only the clusters' new_toots, as out-of-band swaps into what's already on the page
+    delta: bool = False
 
     def render(self, **response_args) -> Response:
-        toot_clusters = ui.TootClusters(clusters=self.clusters)
-        return self.context.templates.TemplateResponse("toot_clusters.html", {
+        toot_clusters = ui.TootClusters(clusters=self.clusters, auto_k=self.auto_k)
+        return self.context.stream_template("toot_clusters_delta.html" if self.delta else "toot_clusters.html", {
             "clusters": toot_clusters,
-            **self.context.template_args(),
         },
         **response_args)
 
 
+# Toots per request when a cluster is expanded
+PAGE_SIZE = 25
+
+
 @migrations.migration
-def _create_table():
-    with config.ConfigHandler.open_db() as conn:
-        c = conn.cursor()
+def _create_table(conn: sqlite3.Connection):
+    c = conn.cursor()
+
+    # Create the toots table if it doesn't exist
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS topic_cluster_toots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            toot_id INTEGER NOT NULL,
+            model_version TEXT NOT NULL,
+            cluster_id INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+@migrations.migration
+def _create_cluster_index(conn: sqlite3.Connection):
+    # Cluster pages seek through one cluster of one model version at a time
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS topic_cluster_toots_cluster
+        ON topic_cluster_toots (model_version, cluster_id, toot_id)
+    ''')
 
-        # Create the toots table if it doesn't exist
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS topic_cluster_toots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                toot_id INTEGER NOT NULL,
-                model_version TEXT NOT NULL,
-                cluster_id INTEGER NOT NULL,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
 
-        conn.commit()
+@retention.pruner
+def _prune_cluster_cache(conn: sqlite3.Connection) -> int:
+    """
+    Drop cached cluster assignments for toots that no longer exist, and for model versions
+    that no session is using anymore (i.e. the model was retrained).
+    """
+    c = conn.cursor()
+    c.execute("DELETE FROM topic_cluster_toots WHERE toot_id NOT IN (SELECT id FROM toots)")
+    pruned = c.rowcount
+
+    active_versions = set()
+    for data in _topic_cluster_algorithms():
+        try:
+            model = algorithm.BaseAlgorithm.deserialize(data)
+        except Exception:
+            # If we can't tell which versions are in use, don't delete any of them
+            logger.exception("Couldn't load session algorithm; skipping model_version pruning")
+            return pruned
+        active_versions.add(getattr(model, "model_version", None))
+
+    active_versions.discard(None)
+    placeholders = ", ".join("?" for _ in active_versions)
+    c.execute(f"DELETE FROM topic_cluster_toots WHERE model_version NOT IN ({placeholders})", list(active_versions))
+    return pruned + c.rowcount
+
+
+def _topic_cluster_algorithms() -> list[bytes]:
+    """
+    The pickled models of sessions on the current account that use this algorithm.
+    """
+    return [
+        session.algorithm for session in core.Session.for_current_account()
+        if session.algorithm is not None and json.loads(session.algorithm_spec or "{}").get("module") == __name__
+    ]
 
 
 class TootModel(pydantic.BaseModel):
@@ -65,7 +126,6 @@ class TootModel(pydantic.BaseModel):
 
     @classmethod
     def for_toots(cls, toots: list[core.Toot], model_version: str) -> list["TootModel"]:
-        _create_table()
         with config.ConfigHandler.open_db() as conn:
             c = conn.cursor()
             c.execute('''
@@ -82,8 +142,25 @@ class TootModel(pydantic.BaseModel):
                 for toot in toots
             ]
 
+    @classmethod
+    def save_all(cls, toot_models: list["TootModel"]):
+        """
+        Insert new assignments in one transaction. Existing ones are updated one by one.
+        """
+        new = [m for m in toot_models if m.id is None and m.cluster_id is not None]
+        with config.ConfigHandler.open_db() as conn:
+            # The scheduled job & a render may both get to a toot first
+            conn.executemany('''
+                INSERT INTO topic_cluster_toots (toot_id, model_version, cluster_id)
+                SELECT ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM topic_cluster_toots WHERE model_version = ? AND toot_id = ?)
+            ''', [(m.toot_id, m.model_version, m.cluster_id, m.model_version, m.toot_id) for m in new])
+            conn.commit()
+        for m in toot_models:
+            if m.id is not None:
+                m.save()
+
     def save(self):
-        _create_table()
         if self.cluster_id is None:
             raise ValueError("Cannot save a toot model without a cluster_id")
 
@@ -107,92 +184,313 @@ class TootModel(pydantic.BaseModel):
             conn.commit()
 
 
+# With num_clusters=0, the number of clusters is chosen automatically, from this range
+AUTO_MIN_CLUSTERS = 2
+AUTO_MAX_CLUSTERS = 20
+# ...by fitting each candidate on a random sample of this many toots
+AUTO_SAMPLE_SIZE = 1000
+
+
+def choose_num_clusters(embeddings: np.ndarray, seed: int = 0) -> tuple[int, dict[int, float]]:
+    """
+    Pick the number of clusters with the best silhouette score (how much closer toots are to
+    their own cluster than to the next nearest one). Each candidate is fitted & scored on the
+    same random sample, in the training worker processes (see `training.silhouette_scores`),
+    so this costs about the same on a week of toots as on an hour, and none of it runs in the
+    web process.
+
+    Returns the chosen k and the score of every candidate.
+    """
+    rng = np.random.default_rng(seed)
+    sample = embeddings[rng.choice(len(embeddings), min(len(embeddings), AUTO_SAMPLE_SIZE), replace=False)]
+    sample = sample.astype(np.float32)
+    norms = np.linalg.norm(sample, axis=1, keepdims=True)
+    sample /= np.where(norms == 0, 1.0, norms)
+
+    # At least ~10 toots per cluster, otherwise the scores are mostly noise
+    max_k = max(AUTO_MIN_CLUSTERS, min(AUTO_MAX_CLUSTERS, len(sample) // 10))
+    scores = training.silhouette_scores(sample, list(range(AUTO_MIN_CLUSTERS, max_k + 1)), seed)
+    if not scores:
+        return AUTO_MIN_CLUSTERS, scores
+    return max(scores, key=scores.get), scores
+
+
 @plugin.algorithm
 class TopicCluster(algorithm.BaseAlgorithm):
-    def __init__(self, kmeans: KMeans, labels: dict[int, str], model_version: str | None = None):
+    def __init__(self, kmeans: "KMeans", labels: dict[int, str], model_version: str | None = None,
+                 k_scores: dict[int, float] | None = None, projection: projection.Projection | None = None):
         self.kmeans = kmeans
         self.labels = labels
         self.model_version = model_version
-
-    def render(self, toots: list[core.Toot], context: plugins.RenderContext) -> ClusterRenderer:
-        before = len(toots)
-        toots = [toot for toot in toots if toot.embedding is not None]
+        # Silhouette score per candidate number of clusters, when it was chosen automatically
+        self.k_scores = k_scores
+        # The clusters live in the projected space, if there is one
+        self.projection = projection
+
+    def assign(self, toots: list[core.Toot]) -> list[TootModel]:
+        """
+        Cluster assignments for `toots` (which must all have embeddings). Toots that haven't been
+        seen by this version of the model are predicted & cached.
+        """
         toot_models = TootModel.for_toots(toots, model_version=self.model_version)
-        print("Removed", before - len(toots), "toots with no embedding (probably image-only).", f"{len(toots)} toots remaining.")
-        
-        # Assign clusters to the uncached toots
         unassigned = [toot for toot, toot_model in zip(toots, toot_models) if toot_model.cluster_id is None]
         if len(unassigned) > 0:
             unassigned_models = [toot_model for toot_model in toot_models if toot_model.cluster_id is None]
-            cluster_indices = self.kmeans.predict(np.array([toot.embedding for toot in unassigned]))
+            # sklearn wants the same dtype the model was fitted with (float32 now, float64 in older models)
+            dtype = getattr(self.kmeans, "cluster_centers_", np.empty(0)).dtype
+            # Models pickled before projections existed don't have one
+            if (proj := getattr(self, "projection", None)) is not None:
+                # Toots embedded by a different model can't be placed in these clusters
+                mask, vectors = proj.project_toots(unassigned)
+                unassigned = [toot for toot, ok in zip(unassigned, mask) if ok]
+                unassigned_models = [toot_model for toot_model, ok in zip(unassigned_models, mask) if ok]
+            else:
+                vectors = np.array([toot.embedding for toot in unassigned])
+            cluster_indices = self.kmeans.predict(vectors.astype(dtype)) if len(unassigned) else []
             print(f"Assigning clusters for {len(unassigned)} toots; model_version={self.model_version}")
             for toot, cluster_index, toot_model in zip(unassigned, cluster_indices, unassigned_models):
                 toot.cluster = self.labels[cluster_index]
                 toot_model.cluster_id = int(cluster_index)
-                toot_model.save()
-
-        toot_clusters = ui.TootClusters(
-            clusters=[
-                ui.TootCluster(
-                    id=i_cluster,
-                    name=cluster_label,
-                    toots=[toot for toot, toot_model in zip(toots, toot_models) if toot_model.cluster_id == i_cluster],
-                )
-                for i_cluster, cluster_label in self.labels.items()
-            ]
-        )
-        return ClusterRenderer(clusters=toot_clusters.clusters, context=context)
+            TootModel.save_all(unassigned_models)
+        return toot_models
+
+    def render(self, toots: list[core.Toot], context: plugins.RenderContext) -> ClusterRenderer:
+        return self._render(toots, context)
+
+    def render_delta(self, toots: list[core.Toot], last_seen_id: int, context: plugins.RenderContext) -> ClusterRenderer:
+        return self._render(toots, context, last_seen_id)
+
+    def _render(self, toots: list[core.Toot], context: plugins.RenderContext,
+                last_seen_id: int | None = None) -> ClusterRenderer:
+        before = len(toots)
+        toots = [toot for toot in toots if toot.embedding is not None]
+        print("Removed", before - len(toots), "toots with no embedding (probably image-only).", f"{len(toots)} toots remaining.")
+        toot_models = self.assign(toots)
+
+        # Cluster bodies are loaded page by page when they're expanded, see cluster_page()
+        since = min((toot.created_at for toot in toots), default=None)
+        clusters = []
+        for i_cluster, cluster_label in self.labels.items():
+            cluster_toots = [toot for toot, toot_model in zip(toots, toot_models) if toot_model.cluster_id == i_cluster]
+            clusters.append(ui.TootCluster(
+                id=i_cluster,
+                name=cluster_label,
+                toots=cluster_toots,
+                page_url=_page_url(self.model_version, i_cluster, since, context.collapse_duplicates) if since and self.model_version else None,
+                new_toots=[] if last_seen_id is None else sorted(
+                    (toot for toot in cluster_toots if toot.id is not None and toot.id > last_seen_id),
+                    key=lambda toot: toot.created_at, reverse=True,
+                ),
+            ))
+        # Models pickled before automatic cluster counts existed don't have k_scores
+        return ClusterRenderer(clusters=clusters, context=context, auto_k=bool(getattr(self, "k_scores", None)),
+                               delta=last_seen_id is not None)
 
     @classmethod
     def train(cls, context: algorithm.TrainContext, args: dict[str, str]) -> "TopicCluster":
+        from tqdm import trange
+        from fossil_mastodon import local_models
+
         toots = [toot for toot in context.get_toots() if toot.embedding is not None]
 
         n_clusters = int(args["num_clusters"])
-        if len(toots) < n_clusters:
-            return cls(kmeans=NoopKMeans(n_clusters=1), labels={0: "All toots"})
-
-        embeddings = np.array([toot.embedding for toot in toots])
-        kmeans = KMeans(n_clusters=n_clusters)
-        cluster_labels = kmeans.fit_predict(embeddings)
+        k_scores = None
+        min_toots = AUTO_MIN_CLUSTERS * 10 if n_clusters == 0 else n_clusters
+        if len(toots) < min_toots:
+            return cls(kmeans=_noop_kmeans_class()(n_clusters=1), labels={0: "All toots"})
+
+        proj = projection.current_or_fit(projection.stack_common_shape([toot.embedding for toot in toots]))
+        if proj is not None:
+            mask, embeddings = proj.project_toots(toots)
+            # Embeddings from another model don't fit the projection. Leave those toots out,
+            # so each toot lines up with its row (and cluster label).
+            toots = [toot for toot, ok in zip(toots, mask) if ok]
+            if len(toots) < min_toots:
+                return cls(kmeans=_noop_kmeans_class()(n_clusters=1), labels={0: "All toots"})
+        else:
+            embeddings = np.array([toot.embedding for toot in toots], dtype=np.float32)
+        if n_clusters == 0:
+            with metrics.span("topic_cluster.choose_k"):
+                n_clusters, k_scores = choose_num_clusters(embeddings)
+            logger.info(f"Chose {n_clusters} clusters; silhouette scores: {k_scores}")
+        with metrics.span("topic_cluster.fit"):
+            # Stratified by hour, so a busy evening doesn't crowd out the rest of the day
+            hours = np.array([toot.created_at.timestamp() // 3600 for toot in toots])
+            kmeans, cluster_labels = training.fit_kmeans(embeddings, n_clusters, strata=hours)
+
+        model = local_models.get_model(config.ConfigHandler.SUMMARIZE_MODEL(context.session_id).name)
+        if local_models.is_local(model):
+            # Keyword labels need to see all the clusters at once, to know what's distinctive
+            with metrics.span("topic_cluster.label", model=model.model_id):
+                labels = local_models.label_clusters({
+                    i_clusters: [toot.plain_text for toot, cluster_label in zip(toots, cluster_labels) if cluster_label == i_clusters]
+                    for i_clusters in range(n_clusters)
+                })
+            model_version = "".join(random.choice(string.ascii_lowercase) for _ in range(12))
+            return cls(kmeans=kmeans, labels=labels, model_version=model_version, k_scores=k_scores, projection=proj)
 
         labels: dict[int, str] = {}
-        model = llm.get_model(config.ConfigHandler.SUMMARIZE_MODEL(context.session_id).name)
+        # Only as many toots as fit in the prompt. reduce_size() trims whatever's left over.
+        budget = config.ConfigHandler.SUMMARIZE_MODEL(context.session_id).context_length
+        tokens.count_toots(toots)
         for i_clusters in trange(n_clusters):
             clustered_toots = [toot for toot, cluster_label in zip(toots, cluster_labels) if cluster_label == i_clusters]
-            combined_text = "\n\n".join([toot.content for toot in clustered_toots])
+            texts, used = [], 0
+            for toot in clustered_toots:
+                if used >= budget:
+                    break
+                texts.append(toot.plain_text or "")
+                used += toot.token_count + 1
+            combined_text = "\n\n".join(texts)
 
             # Use the summarizing model to summarize the combined text
             prompt = f"Create a single label that describes all of these related tweets, make it succinct but descriptive. The label should describe all {len(clustered_toots)} of these\n\n{combined_text}"
-            summary = model.prompt(reduce_size(context.session_id, prompt)).text().strip()
+            with metrics.span("topic_cluster.label", model=model.model_id):
+                summary = model.prompt(reduce_size(context.session_id, prompt)).text().strip()
             labels[int(i_clusters)] = summary
 
         model_version = "".join(random.choice(string.ascii_lowercase) for _ in range(12))
-        return cls(kmeans=kmeans, labels=labels, model_version=model_version)
+        return cls(kmeans=kmeans, labels=labels, model_version=model_version, k_scores=k_scores, projection=proj)
 
     @staticmethod
     def render_model_params(context: plugins.RenderContext) -> Response:
         default = context.session.get_ui_settings().get("num_clusters", "15")
+        display = "auto" if default == "0" else default
         return responses.HTMLResponse(f"""
             <div class="slider">
-                <input type="range" name="num_clusters" id="num_clusters" min="0" max="20" value="{default}" onchange="document.getElementById('num_clusters_value').innerHTML = this.value">
-                <span><span class="slider-value" id="num_clusters_value">{default}</span> clusters</span>
+                <input type="range" name="num_clusters" id="num_clusters" min="0" max="20" value="{default}" onchange="document.getElementById('num_clusters_value').innerHTML = this.value == 0 ? 'auto' : this.value">
+                <span><span class="slider-value" id="num_clusters_value">{display}</span> clusters</span>
             </div>
         """)
 
+def _page_url(model_version: str, cluster_id: int, since: datetime.datetime, collapse: bool, cursor: str | None = None) -> str:
+    params = {"model_version": model_version, "since": since.isoformat(), "collapse": str(collapse).lower()}
+    if cursor is not None:
+        params["cursor"] = cursor
+    return f"/plugins/topic_cluster/clusters/{cluster_id}?{urllib.parse.urlencode(params)}"
+
+
+def _parse_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    created_at, id = cursor.rsplit("|", 1)
+    return datetime.datetime.fromisoformat(created_at), int(id)
+
+
+def get_cluster_page(model_version: str, cluster_id: int, since: datetime.datetime,
+                     cursor: str | None = None, limit: int = PAGE_SIZE,
+                     collapse: bool = False) -> tuple[list[core.Toot], str | None]:
+    """
+    One page of a cluster's toots, newest first, read from the cached cluster assignments.
+    The cursor is the `created_at|id` of the last toot on the previous page, so every page
+    is an index seek rather than an OFFSET scan. Returns the toots & the next cursor.
+
+    With `collapse`, duplicates are collapsed across the whole cluster rather than page by
+    page, so the pages add up to the count in the cluster's title. That means reading the
+    whole cluster for every page.
+    """
+    if collapse:
+        toots = dedup.collapse([core.Toot._from_row(row[:-1]) for row in _query_cluster(model_version, cluster_id, since)])
+        if cursor:
+            after = _parse_cursor(cursor)
+            toots = [toot for toot in toots if (toot.created_at, toot.id) < after]
+        page = toots[:limit]
+        next_cursor = f"{page[-1].created_at.isoformat(' ')}|{page[-1].id}" if len(toots) > limit else None
+        return page, next_cursor
+
+    rows = _query_cluster(model_version, cluster_id, since, cursor, limit + 1)
+    next_cursor = f"{rows[limit - 1][-1]}|{rows[limit - 1][0]}" if len(rows) > limit else None
+    return [core.Toot._from_row(row[:-1]) for row in rows[:limit]], next_cursor
+
+
+def _query_cluster(model_version: str, cluster_id: int, since: datetime.datetime,
+                   cursor: str | None = None, limit: int = -1) -> list[tuple]:
+    """
+    Rows of the cluster's toots, newest first, with the raw `created_at` appended for cursors.
+    """
+    where = ""
+    params: list = [model_version, cluster_id, since]
+    if cursor:
+        created_at, id = cursor.rsplit("|", 1)
+        where = "AND (toots.created_at < ? OR (toots.created_at = ? AND toots.id < ?))"
+        params += [created_at, created_at, int(id)]
+    with config.ConfigHandler.open_db() as conn:
+        rows = conn.execute(f'''
+            SELECT {core._TOOT_COLUMNS}, toots.created_at
+            FROM topic_cluster_toots tc
+            JOIN toots ON toots.id = tc.toot_id
+            LEFT JOIN accounts ON accounts.id = toots.account_id
+            WHERE tc.model_version = ? AND tc.cluster_id = ? AND toots.created_at >= ? {where}
+            ORDER BY toots.created_at DESC, toots.id DESC
+            LIMIT ?
+        ''', params + [limit]).fetchall()
+    return rows
+
+
+@plugin.api_operation.get("/plugins/topic_cluster/clusters/{cluster_id}")
+async def cluster_page(cluster_id: int, model_version: str, since: str, request: Request,
+                       collapse: str = "true", cursor: str | None = None):
+    from fossil_mastodon import server
+
+    since_dt = datetime.datetime.fromisoformat(since)
+    toots, next_cursor = get_cluster_page(model_version, cluster_id, since_dt, cursor, collapse=collapse == "true")
+    session: core.Session = request.state.session
+    context = plugins.RenderContext(
+        templates=server.templates,
+        request=request,
+        link_style=ui.LinkStyle(session.get_ui_settings().get("link_style", "Desktop")),
+        session=session,
+        collapse_duplicates=collapse == "true",
+    )
+    return server.templates.TemplateResponse("cluster_page.html", {
+        "toots": toots,
+        "next_url": _page_url(model_version, cluster_id, since_dt, collapse == "true", next_cursor) if next_cursor else None,
+        **context.template_args(),
+    })
+
+
+@plugin.periodic_job(lambda: datetime.timedelta(minutes=float(config.ConfigHandler.REFRESH_INTERVAL_MINUTES)))
+def preassign_clusters():
+    """
+    Assign freshly downloaded toots to clusters with every session's current model, so that
+    rendering only has to read the cached assignments.
+    """
+    models = [algorithm.BaseAlgorithm.deserialize(data) for data in _topic_cluster_algorithms()]
+    toots = [
+        toot for toot in core.Toot.get_toots_since(datetime.datetime.utcnow() - datetime.timedelta(days=1))
+        if toot.embedding is not None
+    ]
+    for model in models:
+        if model.model_version and toots:
+            model.assign(toots)
+
+
 def get_encoding(session_id: str):
-    try:
-        return tiktoken.encoding_for_model(config.ConfigHandler.SUMMARIZE_MODEL(session_id).name)
-    except KeyError:
-        encoding_name = tiktoken.list_encoding_names()[-1]
-        return tiktoken.get_encoding(encoding_name)
+    return tokens.get_encoding(config.ConfigHandler.SUMMARIZE_MODEL(session_id).name)
 
 def reduce_size(session_id: str, text: str, model_limit: int = -1, est_output_size: int = 500) -> str:
     if model_limit < 0:
         model_limit = config.ConfigHandler.SUMMARIZE_MODEL(session_id).context_length
-    tokens = get_encoding(session_id).encode(text)
-    return get_encoding(session_id).decode(tokens[:model_limit - est_output_size])
+    text, num_tokens = tokens.truncate(text, model_limit - est_output_size,
+                                      config.ConfigHandler.SUMMARIZE_MODEL(session_id).name)
+    PROMPT_TOKENS.inc(num_tokens)
+    return text
+
+
+@functools.lru_cache()
+def _noop_kmeans_class() -> type:
+    from sklearn.cluster import KMeans
+
+    class NoopKMeans(KMeans):
+        def predict(self, X, y=None, sample_weight=None):
+            return np.zeros(len(X), dtype=int)
+
+    # Pickled models refer to this class as topic_cluster.NoopKMeans
+    NoopKMeans.__module__ = __name__
+    NoopKMeans.__qualname__ = "NoopKMeans"
+    return NoopKMeans
 
 
-class NoopKMeans(KMeans):
-    def predict(self, X, y=None, sample_weight=None):
-        return np.zeros(len(X), dtype=int)
+def __getattr__(name: str):
+    # Defined lazily so that importing this module doesn't import sklearn
+    if name == "NoopKMeans":
+        return _noop_kmeans_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
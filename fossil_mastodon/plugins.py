@@ -1,19 +1,22 @@
 import abc
 import contextlib
+import contextvars
+import datetime
 import functools
+import importlib.metadata
 import inspect
 import logging
 import pathlib
 import re
 import sys
+import time
 import traceback
-from typing import Callable, Type, TYPE_CHECKING
+from typing import Callable, Iterator, Type, TYPE_CHECKING
 
 from fastapi import FastAPI, Request, responses, templating
-import pkg_resources
 import pydantic
 
-from fossil_mastodon import algorithm, config, ui, core
+from fossil_mastodon import algorithm, config, metrics, migrations, retention, scheduler, ui, core
 
 if TYPE_CHECKING:
     from fossil_mastodon import server
@@ -34,7 +37,8 @@ class TootDisplayPlugin(pydantic.BaseModel):
     fn_name: str
 
     def render_str(self, toot: core.Toot, context: "RenderContext") -> str:
-        obj = self.fn(toot, context)
+        with metrics.span("plugin.toot_display", fn=self.fn_name):
+            obj = self.fn(toot, context)
         content = obj.body.decode("utf-8")
         return content
 
@@ -49,6 +53,7 @@ class RenderContext(pydantic.BaseModel):
     request: Request
     link_style: ui.LinkStyle
     session: core.Session
+    collapse_duplicates: bool = True
 
     def template_args(self) -> dict:
         return {
@@ -57,6 +62,26 @@ class RenderContext(pydantic.BaseModel):
             "ctx": self,
         }
 
+    def stream_template(self, name: str, args: dict, **response_args) -> responses.StreamingResponse:
+        """
+        Like `templates.TemplateResponse`, but the page is sent to the browser while it's still
+        being rendered, so the top of it shows up right away and the whole page is never held
+        in memory.
+        """
+        template = self.templates.get_template(name)
+
+        def on_error(ex: Exception) -> str:
+            # Too late to change the response, so show the error where the page stopped
+            if not isinstance(ex, BadPluginFunction):
+                raise ex
+            return self.templates.get_template("bad_plugin.html").render(request=self.request, ex=ex)
+
+        return responses.StreamingResponse(
+            _buffered(template.generate(**args, **self.template_args()), on_error, template=name),
+            media_type="text/html",
+            **response_args,
+        )
+
     def render_toot_display_plugins(self, toot: core.Toot) -> str:
         return "".join(
             plugin.render_str(toot, self)
@@ -64,6 +89,53 @@ class RenderContext(pydantic.BaseModel):
         )
 
 
+# The first flush goes out as soon as there's anything worth showing, later ones are batched
+_FIRST_CHUNK_SIZE = 1024
+_CHUNK_SIZE = 16 * 1024
+
+
+def _buffered(chunks: Iterator[str], on_error: Callable[[Exception], str], template: str = "") -> Iterator[bytes]:
+    """
+    Jinja yields a string for every template expression, which would be a lot of tiny writes.
+    Group them into bigger chunks. Starlette iterates this on a worker thread, so each step runs
+    in the request's context to keep its context variables.
+
+    The template is only rendered as the body is sent, so this is where the `template.render`
+    span is timed, and where a profiled request (see `metrics.request_profile`) is profiled.
+    Time spent waiting for the browser to take a chunk doesn't count.
+    """
+    context = contextvars.copy_context()
+    profile = context.get(metrics.request_profile)
+    elapsed, error = 0.0, False
+
+    def render_next() -> str | None:
+        nonlocal chunks, elapsed, error
+        start = time.perf_counter()
+        try:
+            with profile.running() if profile else contextlib.nullcontext():
+                try:
+                    return context.run(next, chunks, None)
+                except Exception as ex:
+                    error = True
+                    chunks = iter(())
+                    return on_error(ex)
+        finally:
+            elapsed += time.perf_counter() - start
+
+    buffer, size, limit = [], 0, _FIRST_CHUNK_SIZE
+    try:
+        while (chunk := render_next()) is not None:
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= limit:
+                yield "".join(buffer).encode("utf-8")
+                buffer, size, limit = [], 0, _CHUNK_SIZE
+        if buffer:
+            yield "".join(buffer).encode("utf-8")
+    finally:
+        metrics.observe_span("template.render", elapsed, error, template=template)
+
+
 _app: FastAPI | None = None
 
 class _MenuItem(pydantic.BaseModel):
@@ -155,6 +227,20 @@ class Plugin(pydantic.BaseModel):
         self._lifecycle_hooks.append(fn)
         return fn
 
+    def periodic_job(self, interval: datetime.timedelta | Callable[[], datetime.timedelta]) -> Callable[[callable], callable]:
+        """
+        Decorator for a function to run in the background every `interval`, e.g. to precompute
+        something so that rendering doesn't have to. Jobs run one at a time, in one worker
+        process. See `scheduler.py`.
+
+            @plugin.periodic_job(datetime.timedelta(hours=1))
+            def refresh_my_cache():
+                ...
+        """
+        def decorator(fn: callable) -> callable:
+            return scheduler.periodic_job(interval, name=f"{self.name}.{fn.__name__}")(fn)
+        return decorator
+
     def add_templates_dir(self, path: pathlib.Path):
         """
         Add a directory of templates to the plugin. These will be accessible from FastAPI response
@@ -165,7 +251,7 @@ class Plugin(pydantic.BaseModel):
             def my_route():
                 return plugin.TemplateResponse("my_template.html", {"request": request})
         """
-        config.ASSETS.add_dir(path, "templates")
+        config.get_assets().add_dir(path, "templates")
 
     def add_static_dir(self, path: pathlib.Path):
         """
@@ -173,7 +259,7 @@ class Plugin(pydantic.BaseModel):
         the path `GET /static/example.css`, assuming the example.css exists at `<path>/example.css`
         as a local path.
         """
-        config.ASSETS.add_dir(path, "static")
+        config.get_assets().add_dir(path, "static")
 
     def add_menu_item(self, raw_html: str, url="#"):
         self._menu_items.append(_MenuItem(html=raw_html, url=url))
@@ -189,6 +275,8 @@ def init_plugins(app: FastAPI):
     global _app
     _app = app
     get_plugins()
+    # Plugins register their own migrations, so this has to happen after they're loaded
+    migrations.run()
 
 
 @functools.lru_cache
@@ -197,7 +285,7 @@ def get_plugins() -> list[Plugin]:
         raise RuntimeError("Plugins not initialized")
 
     plugins = []
-    for entry_point in pkg_resources.iter_entry_points("fossil_mastodon.plugins"):
+    for entry_point in importlib.metadata.entry_points(group="fossil_mastodon.plugins"):
         print("Loading plugin", entry_point.name)
         try:
             plugin = entry_point.load()
@@ -227,6 +315,23 @@ def get_algorithms() -> list[Type[algorithm.BaseAlgorithm]]:
     ]
 
 
+# Used until a session picks another algorithm. Other algorithms, like Ranked, are opt-in.
+DEFAULT_ALGORITHM = "Topic Cluster"
+
+
+def get_algorithm(name: str | None = None) -> Type[algorithm.BaseAlgorithm] | None:
+    """
+    The algorithm of the plugin called `name`, falling back to the default one (or whatever
+    is installed, if that isn't). None if no algorithms are installed.
+    """
+    algorithms = get_algorithms()
+    for wanted in [name, DEFAULT_ALGORITHM]:
+        for algo in algorithms:
+            if wanted and algo.plugin.name == wanted:
+                return algo
+    return algorithms[0] if algorithms else None
+
+
 def get_menu_items() -> list[str]:
     return [
         algo
@@ -271,8 +376,12 @@ async def lifespan(app: FastAPI):
         except:
             logger.exception(f"Error running lifecycle hook {hook}")
 
+    retention.register()
+    stop_scheduler = scheduler.start()
+
     yield
 
+    stop_scheduler()
     exc_info = sys.exc_info()
     exc = exc_info[1] if exc_info else None
     exc_type = exc_info[0] if exc_info else None
@@ -0,0 +1,268 @@
+"""
+Optional dimensionality reduction for embeddings.
+
+Embeddings are big (1536 dims for ada-002), and clustering & similarity don't need all of
+them. A `Projection` maps them down to `PROJECTION_DIMS` dims (128 by default), either with
+PCA fitted to recent toots, or with a fixed random projection that needs no fitting.
+
+- The current projection is refitted in the background every `PROJECTION_REFIT_HOURS` and
+  stored in the `projections` table. PCA is only fitted & stored once there are enough
+  toots (`MIN_SAMPLES_PER_DIM` per dim); until then algorithms use the full embeddings.
+- Algorithms keep the projection they were trained with (it's pickled along with them), so
+  refitting never breaks a trained model.
+- Projected vectors are cached per toot & projection version in `toot_projections`.
+- The original embeddings are kept, so models can always be retrained from them.
+
+`PROJECTION_DIMS=0` turns all of this off, and algorithms use the full embeddings.
+"""
+import datetime
+import logging
+import pickle
+import random
+import sqlite3
+import string
+
+import numpy as np
+
+from fossil_mastodon import config, core, metrics, migrations, retention, scheduler
+
+
+logger = logging.getLogger(__name__)
+
+
+# Fit PCA on at most this many toots
+FIT_SAMPLE_SIZE = 20_000
+# ...and at least this many per dim. With fewer, the components are mostly noise.
+MIN_SAMPLES_PER_DIM = 2
+# Fit on toots from this far back
+FIT_WINDOW = datetime.timedelta(days=7)
+# Older projections are deleted, along with their cached vectors
+KEEP_VERSIONS = 3
+
+
+class Projection:
+    """
+    A linear map from `source_dims` to `dims`: `(X - mean) @ components.T`.
+    """
+    def __init__(self, kind: str, components: np.ndarray, mean: np.ndarray, version: str | None = None):
+        self.kind = kind
+        self.components = components.astype(np.float32)
+        self.mean = mean.astype(np.float32)
+        self.version = version or "".join(random.choices(string.ascii_lowercase, k=12))
+
+    @property
+    def dims(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def source_dims(self) -> int:
+        return self.components.shape[1]
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        return (np.asarray(embeddings, dtype=np.float32) - self.mean) @ self.components.T
+
+    def accepts(self, embedding: np.ndarray | None) -> bool:
+        return embedding is not None and embedding.shape == (self.source_dims,)
+
+    @metrics.span("projection.project_toots")
+    def project_toots(self, toots: list[core.Toot]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Project the toots whose embeddings fit this projection. Returns a boolean mask over
+        `toots` and the projected vectors of the masked toots, in order. Vectors are read
+        from the cache when possible; the rest are computed & cached.
+        """
+        mask = np.fromiter((self.accepts(toot.embedding) for toot in toots), dtype=bool, count=len(toots))
+        accepted = [toot for toot, ok in zip(toots, mask) if ok]
+        vectors = np.empty((len(accepted), self.dims), dtype=np.float32)
+
+        cached = self._read_cache([toot.id for toot in accepted if toot.id is not None])
+        missing = [row for row, toot in enumerate(accepted) if toot.id not in cached]
+        for row, toot in enumerate(accepted):
+            if toot.id in cached:
+                vectors[row] = cached[toot.id]
+        if missing:
+            vectors[missing] = self.transform(np.vstack([accepted[row].embedding for row in missing]))
+            self._write_cache([(accepted[row].id, vectors[row]) for row in missing if accepted[row].id is not None])
+        return mask, vectors
+
+    def _read_cache(self, toot_ids: list[int]) -> dict[int, np.ndarray]:
+        if not toot_ids:
+            return {}
+        with config.ConfigHandler.open_db() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS projection_lookup (toot_id INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM projection_lookup")
+            conn.executemany("INSERT OR IGNORE INTO projection_lookup VALUES (?)", [(id,) for id in toot_ids])
+            rows = conn.execute('''
+                SELECT tp.toot_id, tp.vector
+                FROM projection_lookup l JOIN toot_projections tp ON tp.toot_id = l.toot_id
+                WHERE tp.version = ?
+            ''', (self.version,)).fetchall()
+        return {toot_id: np.frombuffer(vector, dtype=np.float32) for toot_id, vector in rows}
+
+    def _write_cache(self, rows: list[tuple[int, np.ndarray]]):
+        with config.ConfigHandler.open_db() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO toot_projections (toot_id, version, vector) VALUES (?, ?, ?)
+            ''', [(toot_id, self.version, vector.tobytes()) for toot_id, vector in rows])
+            conn.commit()
+
+    def save(self):
+        with config.ConfigHandler.open_db() as conn:
+            conn.execute('''
+                INSERT INTO projections (version, kind, dims, source_dims, model) VALUES (?, ?, ?, ?, ?)
+            ''', (self.version, self.kind, self.dims, self.source_dims, pickle.dumps(self)))
+            conn.commit()
+
+
+def fit(embeddings: np.ndarray, dims: int, kind: str = "pca", seed: int = 0) -> Projection:
+    """
+    Fit a projection of `embeddings` down to `dims` dims. Random projections only look at
+    the number of source dims.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    source_dims = embeddings.shape[1]
+    dims = min(dims, source_dims, len(embeddings)) if kind == "pca" else min(dims, source_dims)
+    rng = np.random.default_rng(seed)
+    if kind == "random":
+        components = rng.standard_normal((dims, source_dims)) / np.sqrt(dims)
+        return Projection(kind, components, np.zeros(source_dims))
+    if kind != "pca":
+        raise ValueError(f"Unknown projection kind {kind!r}, expected 'pca' or 'random'")
+
+    from sklearn.decomposition import PCA
+
+    if len(embeddings) > FIT_SAMPLE_SIZE:
+        embeddings = embeddings[rng.choice(len(embeddings), FIT_SAMPLE_SIZE, replace=False)]
+    pca = PCA(n_components=dims, svd_solver="randomized", random_state=seed).fit(embeddings)
+    logger.info(f"PCA to {dims} dims keeps {pca.explained_variance_ratio_.sum():.0%} of the variance")
+    return Projection(kind, pca.components_, pca.mean_)
+
+
+def stack_common_shape(embeddings: list[np.ndarray | None]) -> np.ndarray:
+    """
+    Stack the embeddings of the most common size into a matrix. There's more than one size if
+    the embedding model was changed.
+    """
+    shapes: dict[tuple, int] = {}
+    for e in embeddings:
+        if e is not None:
+            shapes[e.shape] = shapes.get(e.shape, 0) + 1
+    if not shapes:
+        return np.zeros((0, 0), dtype=np.float32)
+    shape = max(shapes, key=shapes.get)
+    return np.vstack([e for e in embeddings if e is not None and e.shape == shape]).astype(np.float32)
+
+
+def enabled() -> bool:
+    return int(config.ConfigHandler.PROJECTION_DIMS) > 0
+
+
+def current(source_dims: int | None = None) -> Projection | None:
+    """
+    The most recently fitted projection (for embeddings of `source_dims` dims, if given), or
+    None if projections are disabled or none has been fitted yet.
+    """
+    if not enabled():
+        return None
+    with config.ConfigHandler.open_db() as conn:
+        row = conn.execute('''
+            SELECT model FROM projections
+            WHERE ? IS NULL OR source_dims = ?
+            ORDER BY created_at DESC, rowid DESC LIMIT 1
+        ''', (source_dims, source_dims)).fetchone()
+    return pickle.loads(row[0]) if row else None
+
+
+def _target_dims(source_dims: int) -> int:
+    return min(int(config.ConfigHandler.PROJECTION_DIMS), source_dims)
+
+
+def _can_fit(embeddings: np.ndarray) -> bool:
+    """
+    Whether there are enough embeddings to fit a projection with all of `PROJECTION_DIMS` dims.
+    Random projections don't look at the embeddings, so any number will do.
+    """
+    if len(embeddings) == 0:
+        return False
+    if config.ConfigHandler.PROJECTION_KIND == "random":
+        return True
+    return len(embeddings) >= MIN_SAMPLES_PER_DIM * _target_dims(embeddings.shape[1])
+
+
+def current_or_fit(embeddings: np.ndarray) -> Projection | None:
+    """
+    The current projection for these embeddings, fitting (and saving) one if there isn't one
+    yet, or if the current one has fewer dims than it should, e.g. `PROJECTION_DIMS` went up.
+    If there aren't enough embeddings to fit a good one, it's whatever's current, or None.
+    """
+    if not enabled() or len(embeddings) == 0:
+        return None
+    projection = current(source_dims=embeddings.shape[1])
+    if (projection is None or projection.dims < _target_dims(embeddings.shape[1])) and _can_fit(embeddings):
+        with metrics.span("projection.fit"):
+            projection = fit(embeddings, int(config.ConfigHandler.PROJECTION_DIMS), config.ConfigHandler.PROJECTION_KIND)
+        projection.save()
+    return projection
+
+
+def _refit_interval() -> datetime.timedelta:
+    if not enabled():
+        return datetime.timedelta(0)
+    return datetime.timedelta(hours=float(config.ConfigHandler.PROJECTION_REFIT_HOURS))
+
+
+@scheduler.periodic_job(_refit_interval, name="refit_projection")
+def _refit():
+    """
+    Refit the projection to recent toots, so that it keeps up with what people talk about.
+    Models keep the projection they were trained with until they're retrained.
+    """
+    toots = core.Toot.get_toots_since(datetime.datetime.utcnow() - FIT_WINDOW)
+    embeddings = stack_common_shape([toot.embedding for toot in toots])
+    if not _can_fit(embeddings):
+        return
+    projection = fit(embeddings, int(config.ConfigHandler.PROJECTION_DIMS), config.ConfigHandler.PROJECTION_KIND)
+    projection.save()
+
+
+@migrations.migration
+def _create_tables(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS projections (
+            version TEXT PRIMARY KEY,
+            kind TEXT,
+            dims INTEGER,
+            source_dims INTEGER,
+            model BLOB,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS toot_projections (
+            toot_id INTEGER,
+            version TEXT,
+            vector BLOB,
+            PRIMARY KEY (toot_id, version)
+        )
+    ''')
+
+
+@retention.pruner
+def _prune_projections(conn: sqlite3.Connection) -> int:
+    """
+    Keep the last few projections, and cached vectors for toots that still exist. Models
+    trained with an older projection still work; their vectors are just recomputed.
+    """
+    c = conn.cursor()
+    c.execute('''
+        DELETE FROM projections WHERE version NOT IN (
+            SELECT version FROM projections ORDER BY created_at DESC, rowid DESC LIMIT ?
+        )
+    ''', (KEEP_VERSIONS,))
+    deleted = c.rowcount
+    c.execute('''
+        DELETE FROM toot_projections
+        WHERE version NOT IN (SELECT version FROM projections)
+           OR toot_id NOT IN (SELECT id FROM toots)
+    ''')
+    return deleted + c.rowcount
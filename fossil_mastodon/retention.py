@@ -0,0 +1,201 @@
+"""
+Retention, archival and compaction for the toots table.
+
+Off by default. With `RETENTION_DAYS` set, toots older than that are moved into a separate
+archive database (`ARCHIVE_PATH`, next to the main one by default), with their original
+JSON gzip-compressed. Embeddings aren't archived, they can always be recomputed from the
+JSON. After archiving, registered pruners clean up anything that referenced the archived
+toots (e.g. cached cluster assignments), and the main database is compacted with an
+incremental VACUUM. The server schedules it at startup, see `register()`.
+
+Plugins that keep per-toot tables should register a pruner:
+
+    @retention.pruner
+    def _prune(conn: sqlite3.Connection) -> int:
+        c = conn.cursor()
+        c.execute("DELETE FROM my_table WHERE toot_id NOT IN (SELECT id FROM toots)")
+        return c.rowcount
+"""
+import datetime
+import gzip
+import logging
+import sqlite3
+import time
+from typing import Callable
+
+import pydantic
+
+from fossil_mastodon import config, core, scheduler
+
+
+logger = logging.getLogger(__name__)
+
+
+PrunerFn = Callable[[sqlite3.Connection], int]
+_pruners: list[PrunerFn] = []
+
+
+def pruner(fn: PrunerFn) -> PrunerFn:
+    """
+    Decorator that registers a function to be called after old toots have been archived. The
+    function receives an open connection to the main database and returns the number of rows
+    it deleted. The caller commits.
+    """
+    _pruners.append(fn)
+    return fn
+
+
+class RetentionStats(pydantic.BaseModel):
+    archived: int = 0
+    pruned: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    seconds: float = 0.0
+
+    @property
+    def reclaimed(self) -> int:
+        return max(0, self.bytes_before - self.bytes_after)
+
+
+last_stats: RetentionStats | None = None
+
+
+def _create_archive_table(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archived_toots (
+            id INTEGER PRIMARY KEY,
+            url TEXT,
+            author TEXT,
+            created_at DATETIME,
+            codec TEXT NOT NULL,
+            orig_json BLOB,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS archived_toots_created_at ON archived_toots (created_at)
+    ''')
+
+
+def _db_size(conn: sqlite3.Connection) -> int:
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def _gzip(text: str | None) -> bytes | None:
+    return gzip.compress(text.encode("utf-8")) if text else None
+
+
+def archive_toots(before: datetime.datetime, batch_size: int = 500) -> int:
+    """
+    Move toots created before `before` into the archive database. Returns the number of toots
+    archived. Each batch is committed to the archive before it's deleted from the main DB, so
+    a crash can, at worst, leave a toot in both places.
+    """
+    total = 0
+    with config.ConfigHandler.open_db() as conn, config.ConfigHandler.open_archive_db() as archive:
+        _create_archive_table(archive)
+        while True:
+            rows = conn.execute(f'''
+                SELECT {core._TOOT_COLUMNS}
+                FROM {core._TOOT_FROM} WHERE toots.created_at < ?
+                ORDER BY toots.id
+                LIMIT ?
+            ''', (before, batch_size)).fetchall()
+            if not rows:
+                break
+            toots = [core.Toot._from_row(row) for row in rows]
+
+            archive.executemany('''
+                INSERT OR REPLACE INTO archived_toots (id, url, author, created_at, codec, orig_json)
+                VALUES (?, ?, ?, ?, 'gzip', ?)
+            ''', [
+                (toot.id, toot.url, toot.author, toot.created_at, _gzip(toot.get_orig_json()))
+                for toot in toots
+            ])
+            archive.commit()
+
+            conn.executemany("DELETE FROM toots WHERE id = ?", [(toot.id,) for toot in toots])
+            conn.commit()
+            total += len(toots)
+    return total
+
+
+@pruner
+def _prune_accounts(conn: sqlite3.Connection) -> int:
+    c = conn.cursor()
+    c.execute("DELETE FROM accounts WHERE id NOT IN (SELECT account_id FROM toots WHERE account_id IS NOT NULL)")
+    return c.rowcount
+
+
+def compact(conn: sqlite3.Connection):
+    """
+    Return free pages to the filesystem. Incremental vacuum only works once the database has
+    been switched to auto_vacuum=INCREMENTAL, which itself requires one full VACUUM.
+    """
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if auto_vacuum != 2:
+        logger.info("Switching database to incremental auto_vacuum (one-time full VACUUM)")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        conn.execute("PRAGMA incremental_vacuum")
+
+
+def run(retention_days: int | None = None) -> RetentionStats:
+    """
+    Archive old toots, run all pruners and compact the database. A non-positive
+    `retention_days` archives nothing.
+    """
+    global last_stats
+    if retention_days is None:
+        retention_days = int(config.ConfigHandler.RETENTION_DAYS)
+    start = time.perf_counter()
+    stats = RetentionStats()
+
+    with config.ConfigHandler.open_db() as conn:
+        stats.bytes_before = _db_size(conn)
+
+    if retention_days > 0:
+        stats.archived = archive_toots(datetime.datetime.utcnow() - datetime.timedelta(days=retention_days))
+
+    # VACUUM can't run inside a transaction, so use autocommit mode
+    conn = config.ConfigHandler.open_db()
+    try:
+        for fn in _pruners:
+            try:
+                stats.pruned += fn(conn)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logger.exception(f"Error running retention pruner {fn.__name__}")
+        conn.isolation_level = None
+        compact(conn)
+        stats.bytes_after = _db_size(conn)
+    finally:
+        conn.close()
+
+    stats.seconds = time.perf_counter() - start
+    logger.info(f"Retention: archived {stats.archived} toots, pruned {stats.pruned} rows, "
+                f"reclaimed {stats.reclaimed / 1024 / 1024:.1f} MiB in {stats.seconds:.1f}s")
+    last_stats = stats
+    return stats
+
+
+def _interval() -> datetime.timedelta:
+    # A non-positive RETENTION_DAYS disables retention altogether
+    if int(config.ConfigHandler.RETENTION_DAYS) <= 0:
+        return datetime.timedelta(0)
+    return datetime.timedelta(hours=float(config.ConfigHandler.RETENTION_INTERVAL_HOURS))
+
+
+def _scheduled_run():
+    run()
+
+
+def register():
+    """
+    Schedule retention with the scheduler. Called when the server starts.
+    """
+    scheduler.periodic_job(_interval, name="retention")(_scheduled_run)
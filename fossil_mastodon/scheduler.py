@@ -0,0 +1,189 @@
+"""
+Background jobs that run on a schedule, so that user requests mostly read results that are
+already computed (downloaded & embedded toots, cluster assignments) instead of computing
+them on the spot.
+
+Jobs are registered with a decorator, either here or from a plugin (`Plugin.periodic_job`):
+
+    @scheduler.periodic_job(datetime.timedelta(minutes=15))
+    def _refresh_something():
+        ...
+
+Jobs run in the leader worker only (see `workers.py`), once for every account (see
+`config.use_account`). Each account has its own thread, which runs that account's due jobs
+one at a time, so a big account's download doesn't hold up the others. When each job last
+ran is recorded in the account's `scheduled_jobs` table, so every worker can tell whether
+the results are fresh.
+"""
+import concurrent.futures
+import datetime
+import logging
+import threading
+import time
+from typing import Callable
+
+import pydantic
+
+from fossil_mastodon import config, core, metrics, workers
+
+
+logger = logging.getLogger(__name__)
+
+
+# How often the scheduler thread checks for due jobs
+_TICK = datetime.timedelta(seconds=30)
+
+
+class Job(pydantic.BaseModel):
+    name: str
+    fn: Callable[..., None]
+    # A function so that it can depend on configuration that changes at runtime
+    interval: Callable[[], datetime.timedelta]
+
+    def last_run(self) -> datetime.datetime | None:
+        with config.ConfigHandler.open_db() as conn:
+            row = conn.execute("SELECT last_run_at FROM scheduled_jobs WHERE name = ?", (self.name,)).fetchone()
+        return datetime.datetime.fromisoformat(row[0]) if row and row[0] else None
+
+    def is_due(self, now: datetime.datetime | None = None) -> bool:
+        interval = self.interval()
+        if interval <= datetime.timedelta(0):
+            return False
+        last_run = self.last_run()
+        return last_run is None or last_run + interval <= (now or datetime.datetime.utcnow())
+
+    def run(self, reraise: bool = False, **kwargs):
+        """
+        Run the job & record when it ran. Errors are logged & recorded, and only raised when
+        `reraise` is set, i.e. when the job is run on behalf of a request that should report it.
+        """
+        started = datetime.datetime.utcnow()
+        start = time.perf_counter()
+        error = None
+        try:
+            with metrics.span("scheduler.job", job=self.name):
+                self.fn(**kwargs)
+        except Exception as ex:
+            logger.exception(f"Error running scheduled job {self.name}")
+            error = ex
+        self._record(started, time.perf_counter() - start, error)
+        if error is not None and reraise:
+            raise error
+
+    def _record(self, started: datetime.datetime, seconds: float, error: Exception | None):
+        with config.ConfigHandler.open_db() as conn:
+            conn.execute('''
+                INSERT INTO scheduled_jobs (name, last_run_at, seconds, last_error) VALUES (?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE
+                    SET last_run_at = excluded.last_run_at
+                      , seconds = excluded.seconds
+                      , last_error = excluded.last_error
+            ''', (self.name, started, seconds, repr(error) if error is not None else None))
+            conn.commit()
+
+
+_jobs: dict[str, Job] = {}
+# Per account: held while one of its jobs runs, so a request that runs one inline doesn't
+# overlap the scheduler
+_run_locks: dict[str, threading.Lock] = {}
+_run_locks_lock = threading.Lock()
+
+
+def _run_lock() -> threading.Lock:
+    with _run_locks_lock:
+        return _run_locks.setdefault(config.ConfigHandler.DATABASE_PATH, threading.Lock())
+
+
+def periodic_job(interval: datetime.timedelta | Callable[[], datetime.timedelta], name: str | None = None):
+    """
+    Decorator that registers a function to be called every `interval`. The interval can also be
+    a function returning one; a non-positive interval disables the job.
+    """
+    def decorator(fn: Callable[..., None]) -> Callable[..., None]:
+        job_name = name or f"{fn.__module__}.{fn.__qualname__}"
+        _jobs[job_name] = Job(
+            name=job_name,
+            fn=fn,
+            interval=interval if callable(interval) else (lambda: interval),
+        )
+        return fn
+    return decorator
+
+
+def get_job(name: str) -> Job:
+    return _jobs[name]
+
+
+def run_job(name: str, reraise: bool = False, **kwargs):
+    """
+    Run a job now, in this thread, for the current account. Waits if one of the account's
+    jobs is already running. `kwargs` are passed on to the job.
+    """
+    with _run_lock():
+        _jobs[name].run(reraise, **kwargs)
+
+
+def run_if_stale(name: str, **kwargs):
+    """
+    Run a job now if it hasn't run within its interval, e.g. because the scheduler is disabled
+    or the server just started. Requests call this so they never serve results older than that.
+    Unlike a scheduled run, errors are raised, so the request can report them.
+    """
+    job = _jobs[name]
+    if job.is_due() or job.interval() <= datetime.timedelta(0):
+        run_job(name, reraise=True, **kwargs)
+
+
+def start() -> Callable[[], None]:
+    """
+    Start the scheduler thread. Returns a function that stops it.
+    """
+    stop = threading.Event()
+    # One thread per account, and at most one pass over the jobs queued per account
+    executors: dict[str, concurrent.futures.ThreadPoolExecutor] = {}
+    pending: dict[str, concurrent.futures.Future] = {}
+
+    def run_due(account: config.Account):
+        with config.use_account(account):
+            for job in list(_jobs.values()):
+                if stop.is_set():
+                    break
+                if job.is_due():
+                    run_job(job.name)
+
+    def loop():
+        while not stop.is_set():
+            try:
+                if workers.is_leader():
+                    for account in core.get_accounts():
+                        key = account.database_path
+                        if key in pending and not pending[key].done():
+                            continue
+                        if key not in executors:
+                            executors[key] = concurrent.futures.ThreadPoolExecutor(
+                                max_workers=1, thread_name_prefix=f"fossil-scheduler-{account.name or 'default'}")
+                        pending[key] = executors[key].submit(run_due, account)
+            except Exception:
+                logger.exception("Error in scheduler")
+            stop.wait(_TICK.total_seconds())
+        for executor in executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    threading.Thread(target=loop, name="fossil-scheduler", daemon=True).start()
+    return stop.set
+
+
+def _refresh_interval() -> datetime.timedelta:
+    return datetime.timedelta(minutes=float(config.ConfigHandler.REFRESH_INTERVAL_MINUTES))
+
+
+@periodic_job(_refresh_interval, name="refresh_timeline")
+def _refresh_timeline(session_id: str | None = None):
+    """
+    Download & embed new toots from the account's home timeline. The session decides which
+    embedding model to use: the one that asked for the refresh, or else any of the account's.
+    """
+    if session_id is None:
+        sessions = core.Session.for_current_account()
+        session_id = (sessions[0] if sessions else core.Session.get_or_create()).id
+    core.download_timeline(datetime.datetime.utcnow() - datetime.timedelta(days=1), session_id)
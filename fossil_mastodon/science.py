@@ -1,10 +1,9 @@
 import llm
 import numpy as np
 import openai
-import tiktoken
 from sklearn.cluster import KMeans
 
-from . import config, core
+from . import config, core, tokens
 
 
 def assign_clusters(session_id: str, toots: list[core.Toot], n_clusters: int = 5):
@@ -32,14 +31,9 @@ def assign_clusters(session_id: str, toots: list[core.Toot], n_clusters: int = 5
                 toot.cluster = summary
 
 def get_encoding(session_id: str):
-    try:
-        return tiktoken.encoding_for_model(config.ConfigHandler.SUMMARIZE_MODEL(session_id).name)
-    except KeyError:
-        encoding_name = tiktoken.list_encoding_names()[-1]
-        return tiktoken.get_encoding(encoding_name)
+    return tokens.get_encoding(config.ConfigHandler.SUMMARIZE_MODEL(session_id).name)
 
 def reduce_size(session_id: str, text: str, model_limit: int = -1, est_output_size: int = 500) -> str:
     if model_limit < 0:
-        config.ConfigHandler.SUMMARIZE_MODEL(session_id).context_length
-    tokens = get_encoding(session_id).encode(text)
-    return get_encoding(session_id).decode(tokens[:model_limit - est_output_size])
+        model_limit = config.ConfigHandler.SUMMARIZE_MODEL(session_id).context_length
+    return tokens.truncate(text, model_limit - est_output_size, config.ConfigHandler.SUMMARIZE_MODEL(session_id).name)[0]
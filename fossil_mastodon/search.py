@@ -0,0 +1,180 @@
+"""
+Full-text search over the stored toots, ranked by both the words and their meaning.
+
+- `toots_fts` is an SQLite FTS5 index over `toots.plain_text` (see text.py). It's an
+  external-content table, so the text isn't stored twice, and triggers keep it in step with
+  every insert, update & delete, including toots moved out by retention. Nothing has to
+  rebuild it.
+- A query ranks the newest `SCAN` matches by BM25. Ranking every match would cost time in
+  proportion to how common the words are; this way a query costs about the same with
+  thousands of toots or hundreds of thousands.
+- The best `CANDIDATES` of those are re-ranked by the cosine similarity of their embeddings
+  to the query's embedding, merging the two rankings with reciprocal rank fusion. The rest
+  follow in BM25 order, then older matches, newest first.
+"""
+import functools
+import logging
+import re
+import sqlite3
+
+import numpy as np
+
+from fossil_mastodon import config, core, metrics, migrations
+
+
+logger = logging.getLogger(__name__)
+
+
+PAGE_SIZE = 20
+# Newest matches that are ranked by relevance
+SCAN = 1000
+# Best BM25 matches that are re-ranked with embeddings
+CANDIDATES = 200
+# Reciprocal rank fusion: a toot scores 1 / (RRF_K + rank) in each ranking. Higher values
+# flatten the difference between the top few ranks.
+RRF_K = 60
+
+_TERM_RE = re.compile(r"\w+")
+
+
+@migrations.migration
+def _create_index(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS toots_fts USING fts5(
+            plain_text,
+            content='toots',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS toots_fts_insert AFTER INSERT ON toots BEGIN
+            INSERT INTO toots_fts (rowid, plain_text) VALUES (new.id, new.plain_text);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS toots_fts_delete AFTER DELETE ON toots BEGIN
+            INSERT INTO toots_fts (toots_fts, rowid, plain_text) VALUES ('delete', old.id, old.plain_text);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS toots_fts_update AFTER UPDATE OF plain_text ON toots BEGIN
+            INSERT INTO toots_fts (toots_fts, rowid, plain_text) VALUES ('delete', old.id, old.plain_text);
+            INSERT INTO toots_fts (rowid, plain_text) VALUES (new.id, new.plain_text);
+        END
+    ''')
+    # Index the toots that are already there
+    conn.execute("INSERT INTO toots_fts (toots_fts) VALUES ('rebuild')")
+
+
+def fts_query(text: str) -> str | None:
+    """
+    Turn what the user typed into an FTS5 query: every word has to match, and the last one
+    may be half typed. Quoting each word means FTS5 operators & punctuation are just text.
+    """
+    terms = _TERM_RE.findall(text)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"' for term in terms) + "*"
+
+
+@functools.lru_cache(maxsize=256)
+def _query_embedding(model_name: str, query: str) -> np.ndarray:
+    # Cached, so that paging through results doesn't call the model again
+    from fossil_mastodon import local_models
+
+    model = local_models.get_embedding_model(model_name)
+    with metrics.span("search.embed_query", model=model.model_id):
+        return np.array(model.embed(query))
+
+
+def _similarity_order(query: str, session_id: str, candidates: list[tuple[int, bytes | None]]) -> list[int]:
+    """
+    Candidate ids by cosine similarity to the query, leaving out toots without an embedding
+    (or from a different model). Empty if the query can't be embedded.
+    """
+    try:
+        query_vector = _query_embedding(config.ConfigHandler.EMBEDDING_MODEL(session_id).name, query)
+    except Exception:
+        logger.exception("Couldn't embed the search query, ranking by words only")
+        return []
+
+    ids, vectors = [], []
+    for id, embedding in candidates:
+        vector = np.frombuffer(embedding) if embedding else None
+        if vector is not None and vector.shape == query_vector.shape:
+            ids.append(id)
+            vectors.append(vector)
+    if not ids:
+        return []
+    vectors = np.array(vectors)
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector)
+    similarity = vectors @ query_vector / np.where(norms == 0, 1.0, norms)
+    return [ids[i] for i in np.argsort(-similarity, kind="stable")]
+
+
+def _fuse(*rankings: list[int]) -> list[int]:
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    # Ties keep the BM25 order
+    return sorted(scores, key=lambda id: -scores[id])
+
+
+def _get_toots(conn: sqlite3.Connection, ids: list[int]) -> list[core.Toot]:
+    if not ids:
+        return []
+    rows = conn.execute(f'''
+        SELECT {core._TOOT_COLUMNS}
+        FROM {core._TOOT_FROM} WHERE toots.id IN ({", ".join("?" * len(ids))})
+    ''', ids).fetchall()
+    by_id = {row[0]: core.Toot._from_row(row) for row in rows}
+    return [by_id[id] for id in ids if id in by_id]
+
+
+def _ranked_ids(conn: sqlite3.Connection, query: str, match: str, session_id: str) -> list[int]:
+    """
+    The newest `SCAN` matches, best first.
+    """
+    scanned = conn.execute('''
+        SELECT rowid, bm25(toots_fts) FROM toots_fts WHERE toots_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+    ''', (match, SCAN)).fetchall()
+    by_bm25 = [id for id, _ in sorted(scanned, key=lambda row: row[1])]
+
+    candidates = by_bm25[:CANDIDATES]
+    embeddings = conn.execute(f'''
+        SELECT id, embedding FROM toots WHERE id IN ({", ".join("?" * len(candidates))})
+    ''', candidates).fetchall() if candidates else []
+    # Keep the BM25 order, for ties
+    position = {id: i for i, id in enumerate(candidates)}
+    embeddings.sort(key=lambda row: position[row[0]])
+    return _fuse(candidates, _similarity_order(query, session_id, embeddings)) + by_bm25[CANDIDATES:]
+
+
+@metrics.span("search.search")
+def search(query: str, session_id: str, offset: int = 0, limit: int = PAGE_SIZE) -> tuple[list[core.Toot], int | None]:
+    """
+    One page of toots matching `query`, best first. Returns the toots & the offset of the
+    next page, or None if this is the last one.
+    """
+    match = fts_query(query)
+    if match is None:
+        return [], None
+
+    with config.ConfigHandler.open_db() as conn:
+        if offset < SCAN:
+            ranked = _ranked_ids(conn, query, match, session_id)
+            ids = ranked[offset:offset + limit]
+            # A full scan means there may be older matches after it
+            more = offset + limit < len(ranked) or len(ranked) == SCAN
+        else:
+            ids = [row[0] for row in conn.execute('''
+                SELECT rowid FROM toots_fts WHERE toots_fts MATCH ? ORDER BY rowid DESC LIMIT ? OFFSET ?
+            ''', (match, limit + 1, offset))]
+            more = len(ids) > limit
+            ids = ids[:limit]
+        toots = _get_toots(conn, ids)
+
+    return toots, offset + len(ids) if more and ids else None
@@ -5,18 +5,25 @@ The streamlit version had issues around state management and was genrally slow
 and inflexible. This gives us a lot more control.
 """
 import datetime
+import hashlib
 import importlib
+import io
 import json
 import logging
+import pathlib
+import pstats
 import random
 import string
+import threading
+import time
+import urllib.parse
 from typing import Annotated, Type
 
-import llm
 import requests
-from fastapi import FastAPI, Form, HTTPException, Request, responses, staticfiles, templating
+from fastapi import FastAPI, Form, HTTPException, Query, Request, responses, staticfiles, templating
+from starlette.concurrency import run_in_threadpool
 
-from fossil_mastodon import algorithm, config, core, migrations, plugins, ui
+from fossil_mastodon import algorithm, client, config, core, metrics, plugins, scheduler, search, threads, ui
 
 
 logger = logging.getLogger(__name__)
@@ -25,9 +32,18 @@ logger = logging.getLogger(__name__)
 app = FastAPI(lifespan=plugins.lifespan)
 
 
-app.mount("/static", staticfiles.StaticFiles(directory=config.ASSETS.assets_path), name="static")
-templates = templating.Jinja2Templates(directory=config.ASSETS.templates_path)
-print("using template directory", config.ASSETS.templates_path)
+class _StaticDirs(staticfiles.StaticFiles):
+    """
+    Serves each path from the first of several directories that has it.
+    """
+    def __init__(self, directories: list[pathlib.Path]):
+        super().__init__(directory=directories[-1])
+        self.all_directories = directories
+
+
+app.mount("/static", _StaticDirs(config.get_assets().static_dirs), name="static")
+templates = templating.Jinja2Templates(directory=config.get_assets().template_dirs)
+print("using template directory", config.get_assets().templates_path)
 templates.env.filters["rel_date"] = ui.time_ago
 
 
@@ -42,13 +58,91 @@ async def session_middleware(request: Request, call_next):
         session = core.Session.get_or_create()
         session.save()
         request.state.session = session
-        response = await call_next(request)
-        response.set_cookie("fossil_session_id", session.id)  
+        # Everything downstream reads & writes this session's account
+        with config.use_account(session.account()):
+            response = await call_next(request)
+        # Unless the request switched sessions, e.g. /session/{name}
+        if not any(c.startswith("fossil_session_id=") for c in response.headers.getlist("set-cookie")):
+            response.set_cookie("fossil_session_id", session.id)
         return response
     else:
         request.state.session = session
+        with config.use_account(session.account()):
+            return await call_next(request)
+
+
+_profile_lock = threading.Lock()
+
+
+@app.middleware("http")
+async def profile_middleware(request: Request, call_next):
+    """
+    When PROFILE_REQUESTS=true, add `?profile=1` to any URL to profile that request with
+    cProfile. The stats are written to PROFILE_DIR and the path is returned in the
+    `X-Fossil-Profile` header. With `?profile=text`, the response is replaced with the
+    top functions by cumulative time.
+
+    Streamed responses are rendered as they're sent, on worker threads, so the profile covers
+    the body too and is only written once it's all been sent.
+
+    Only one request is profiled at a time. Anything else running on the event loop at the
+    same time shows up in the profile too.
+    """
+    mode = request.query_params.get("profile")
+    if not mode or config.ConfigHandler.PROFILE_REQUESTS.lower() != "true" or not _profile_lock.acquire(blocking=False):
         return await call_next(request)
 
+    profile_dir = pathlib.Path(config.ConfigHandler.PROFILE_DIR)
+    name = request.url.path.strip("/").replace("/", "_") or "root"
+    path = profile_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.prof"
+
+    def write_profile():
+        try:
+            profile_dir.mkdir(parents=True, exist_ok=True)
+            profile.profiler.dump_stats(path)
+            logger.info(f"Wrote profile for {request.url.path} to {path}")
+        finally:
+            _profile_lock.release()
+
+    profile = metrics.Profile()
+    token = metrics.request_profile.set(profile)
+    try:
+        with profile.running():
+            response = await call_next(request)
+    except BaseException:
+        _profile_lock.release()
+        raise
+    finally:
+        metrics.request_profile.reset(token)
+
+    if mode == "text":
+        try:
+            async for _ in response.body_iterator:
+                pass
+        finally:
+            write_profile()
+        out = io.StringIO()
+        pstats.Stats(profile.profiler, stream=out).sort_stats("cumulative").print_stats(50)
+        return responses.PlainTextResponse(out.getvalue(), headers={"X-Fossil-Profile": str(path)})
+
+    body = response.body_iterator
+
+    async def profiled_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            write_profile()
+
+    response.body_iterator = profiled_body()
+    response.headers["X-Fossil-Profile"] = str(path)
+    return response
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return responses.PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 
 @app.get("/")
 async def root(request: Request):
@@ -71,12 +165,12 @@ async def root(request: Request):
         })
 
     # Render the UI
-    algo = session.get_algorithm_type() or algo_list[0]
+    algo = session.get_algorithm_type() or plugins.get_algorithm()
     return templates.TemplateResponse("index.html", {
         "request": request,
         "model_params": algo.render_model_params(ctx).body.decode("utf-8"),
         "ui_settings": session.get_ui_settings(),
-        "selected_algorithm": algo,
+        "selected_algorithm": algo.plugin.name,
         "algorithms": [
             {"name": algo.plugin.name, "display_name": algo.plugin.display_name}
             for algo in plugins.get_algorithms()
@@ -89,20 +183,59 @@ async def toots():
     return staticfiles.FileResponse("public/toots.html")
 
 
+# Form fields that describe what the page shows now, rather than settings. See _timeline_state().
+_TIMELINE_STATE_FIELDS = {"last_seen_id", "render_key"}
+
+
+def _render_key(session: core.Session, params: dict[str, str]) -> str:
+    """
+    Identifies everything a timeline render depends on besides the toots. A partial re-render
+    is only possible if this hasn't changed since the client's last render.
+    """
+    digest = hashlib.sha1(session.algorithm or b"")
+    for key in ("time_span", "link_style", "duplicates"):
+        digest.update(f"|{params.get(key, '')}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _render(renderable: algorithm.Renderable, **response_args) -> responses.Response:
+    """
+    Streamed templates are rendered, and timed, while they're sent (see plugins._buffered).
+    Anything else is rendered, and timed, here.
+    """
+    start = time.perf_counter()
+    response = renderable.render(**response_args)
+    if not isinstance(response, responses.StreamingResponse):
+        metrics.observe_span("template.render", time.perf_counter() - start, template=renderable.__class__.__name__)
+    return response
+
+
+def _timeline_state(response: responses.Response, timeline: list[core.Toot], render_key: str) -> responses.Response:
+    """
+    Tell the page (see page.js) the newest toot it now shows & what it was rendered with, so
+    the next "Load More" can ask for only what's new.
+    """
+    last_seen_id = max((toot.id for toot in timeline if toot.id is not None), default=0)
+    response.headers["HX-Trigger"] = json.dumps({"fossil:rendered": {"last_seen_id": last_seen_id, "render_key": render_key}})
+    return response
+
+
 @app.post("/toots/download")
 async def toots_download(request: Request):
     # init
-    migrations.create_database()
     session: core.Session = request.state.session
     algorithm_spec: dict = json.loads(session.algorithm_spec) if session.algorithm_spec else {}
 
     # first page load calls this with display-only=true to load what was loaded last time
-    if request.query_params.get("display-only", "") != "true":
-        # download
-        core.download_timeline(datetime.datetime.utcnow() - datetime.timedelta(days=1), session.id)
+    display_only = request.query_params.get("display-only", "") == "true"
+    if not display_only:
+        # Normally the scheduler has already downloaded everything; this only catches up if it hasn't
+        await run_in_threadpool(scheduler.run_if_stale, "refresh_timeline", session_id=session.id)
 
     # render
     body_params: dict[str, str] = dict((await request.form()))
+    last_seen_id = body_params.pop("last_seen_id", "")
+    client_render_key = body_params.pop("render_key", "")
     session.set_ui_settings(body_params)
     print("algorithm_spec", algorithm_spec)
     if "module" in algorithm_spec and "class_name" in algorithm_spec:
@@ -110,14 +243,28 @@ async def toots_download(request: Request):
         model_class: Type[algorithm.BaseAlgorithm] = getattr(mod, algorithm_spec["class_name"])
         model: algorithm.BaseAlgorithm = model_class.deserialize(session.algorithm)
         timespan = ui.timedelta(body_params["time_span"])
-        timeline = core.Toot.get_toots_since(datetime.datetime.utcnow() - timespan)
-        renderable = model.render(timeline, plugins.RenderContext(
+        timeline = await run_in_threadpool(core.Toot.get_toots_since, datetime.datetime.utcnow() - timespan)
+        ctx = plugins.RenderContext(
             templates=templates,
             request=request,
             link_style=ui.LinkStyle(body_params["link_style"] if "link_style" in body_params else "Desktop"),
             session=session,
-        ))
-        return renderable.render()
+            collapse_duplicates=body_params.get("duplicates", "collapse") == "collapse",
+        )
+        render_key = _render_key(session, body_params)
+
+        # The page already shows this timeline up to last_seen_id; only send what's new
+        if not display_only and last_seen_id.isdigit() and client_render_key == render_key:
+            if not any(toot.id is not None and toot.id > int(last_seen_id) for toot in timeline):
+                return responses.Response(status_code=204)
+            with metrics.span("algorithm.render_delta", algorithm=model_class.__name__):
+                renderable = await algorithm.render_delta(model, timeline, int(last_seen_id), ctx)
+            if renderable is not None:
+                return _timeline_state(_render(renderable, headers={"HX-Reswap": "none"}), timeline, render_key)
+
+        with metrics.span("algorithm.render", algorithm=model_class.__name__):
+            renderable = await algorithm.render(model, timeline, ctx)
+        return _timeline_state(_render(renderable), timeline, render_key)
     else:
         return responses.HTMLResponse("<div>No Toots 😥</div>")
 
@@ -134,15 +281,20 @@ async def toots_train(
         session_id=request.state.session.id
     )
 
-    algo_kwargs = {k: v for k, v in dict((await request.form())).items() 
-                   if k not in {"link_style", "time_span"}}
+    form = dict((await request.form()))
+    algo_kwargs = {k: v for k, v in form.items() 
+                   if k not in {"link_style", "time_span", "duplicates", "algorithm"} | _TIMELINE_STATE_FIELDS}
     print("Algorithm kwargs:", algo_kwargs)
 
-    # train
+    # train whichever algorithm is selected in the form
     session: core.Session = request.state.session
-    algo = session.get_algorithm_type() or plugins.get_algorithms()[0]
+    if "algorithm" in form:
+        algo = plugins.get_algorithm(form["algorithm"])
+    else:
+        algo = session.get_algorithm_type() or plugins.get_algorithm()
     algo.model_version = "".join(random.choices(string.ascii_letters + string.digits, k=12))
-    model = algo.train(context, algo_kwargs)
+    with metrics.span("algorithm.train", algorithm=algo.__name__):
+        model = await algorithm.train(algo, context, algo_kwargs)
     session.algorithm = model.serialize()
     session.algorithm_spec = json.dumps({
         "module": model.__class__.__module__,
@@ -152,23 +304,31 @@ async def toots_train(
     session.save()
 
     # render
-    timeline = core.Toot.get_toots_since(datetime.datetime.utcnow() - ui.timedelta(time_span))
-    renderable = model.render(timeline, plugins.RenderContext(
+    timeline = await run_in_threadpool(core.Toot.get_toots_since, datetime.datetime.utcnow() - ui.timedelta(time_span))
+    ctx = plugins.RenderContext(
         templates=templates,
         request=request,
         link_style=ui.LinkStyle(link_style),
         session=session,
-    ))
+        collapse_duplicates=form.get("duplicates", "collapse") == "collapse",
+    )
+    with metrics.span("algorithm.render", algorithm=model.__class__.__name__):
+        renderable = await algorithm.render(model, timeline, ctx)
     try:
-        return renderable.render()
+        return _timeline_state(_render(renderable), timeline, _render_key(session, form))
     except plugins.BadPluginFunction as ex:
         return templates.TemplateResponse("bad_plugin.html", { "request": request, "ex": ex })
 
 
+@app.get("/algorithm/form")
 @app.get("/algorithm/{name}/form")
-async def algorithm_form(name: str, request: Request):
+async def algorithm_form(request: Request, name: str | None = None, selected: Annotated[str | None, Query(alias="algorithm")] = None):
+    """
+    The settings form of the algorithm called `name`, or the `algorithm` query parameter,
+    as sent by the algorithm picker.
+    """
     session: core.Session = request.state.session
-    algo_type = session.get_algorithm_type() or plugins.get_algorithms()[0]
+    algo_type = plugins.get_algorithm(name or selected)
     ctx = plugins.RenderContext(
         templates=templates,
         request=request,
@@ -180,6 +340,7 @@ async def algorithm_form(name: str, request: Request):
 
 @app.get("/settings")
 async def get_settings(request: Request):
+    import llm
     session: core.Session = request.state.session
     keys = {"openai": "", **llm.load_keys()}
     return templates.TemplateResponse("settings.html", {
@@ -195,12 +356,26 @@ async def get_settings(request: Request):
 @app.post("/settings")
 async def post_settings(settings: core.Settings, request: Request):
     session: core.Session = request.state.session
-    session.settings = settings
+    # Each form on the settings page only posts some of the settings
+    session.settings = session.settings.model_copy(update=settings.model_dump(exclude_unset=True))
     session.save()
     return responses.HTMLResponse("<div>👍</div>")
 
+
+@app.get("/session/{name}")
+async def switch_session(name: str):
+    """
+    Switch to the session called `name`, creating it if needed. A session with its own
+    Mastodon account (set on the settings page) has its own toots, models & databases.
+    """
+    session = core.Session.get_or_create(name)
+    response = responses.RedirectResponse("/", status_code=303)
+    response.set_cookie("fossil_session_id", session.id)
+    return response
+
 @app.post("/keys")
 async def post_keys(request: Request):
+    import llm
     body_params: dict[str, str] = dict((await request.form()))
     key_path = llm.user_dir() / "keys.json"
     key_path.write_text(json.dumps(body_params))
@@ -215,20 +390,64 @@ async def toots_debug(id: int):
         print(json.dumps(toot.orig_dict, indent=2))
     return responses.HTMLResponse("<div>💯</div>")
 
+@app.get("/toots/{id}/thread")
+async def toots_thread(id: int, request: Request):
+    toot = core.Toot.get_by_id(id)
+    if toot is None:
+        raise HTTPException(status_code=404, detail="Toot not found")
+    session: core.Session = request.state.session
+    ctx = plugins.RenderContext(
+        templates=templates,
+        request=request,
+        link_style=ui.LinkStyle(session.get_ui_settings().get("link_style", "Desktop")),
+        session=session,
+    )
+    return templates.TemplateResponse("thread.html", {
+        "thread": await run_in_threadpool(threads.get_thread, toot),
+        "current": toot,
+        **ctx.template_args(),
+    })
+
+@app.get("/search")
+async def search_page(request: Request, q: str = ""):
+    return templates.TemplateResponse("search.html", {
+        "request": request,
+        "q": q,
+    })
+
+@app.get("/search/results")
+async def search_results(request: Request, q: str = "", offset: int = 0):
+    session: core.Session = request.state.session
+    ctx = plugins.RenderContext(
+        templates=templates,
+        request=request,
+        link_style=ui.LinkStyle(session.get_ui_settings().get("link_style", "Desktop")),
+        session=session,
+    )
+    toots, next_offset = await run_in_threadpool(search.search, q, session.id, offset)
+    return templates.TemplateResponse("search_results.html", {
+        "q": q,
+        "toots": toots,
+        "first_page": offset == 0,
+        "next_url": f"/search/results?{urllib.parse.urlencode({'q': q, 'offset': next_offset})}" if next_offset else None,
+        **ctx.template_args(),
+    })
+
 @app.post("/toots/{id}/boost")
 async def toots_boost(id: int):
     toot = core.Toot.get_by_id(id)
     if toot is not None:
-        url = f'{config.ConfigHandler.MASTO_BASE}/api/v1/statuses/{toot.toot_id}/reblog'
         data = {
             'visibility': 'public'
         }
-        response = requests.post(url, json=data, headers=config.headers())
         try:
-            response.raise_for_status()
+            await run_in_threadpool(client.get_client().post, f'/api/v1/statuses/{toot.toot_id}/reblog', json=data)
+            core.Interaction.record(toot, "boost")
             return responses.HTMLResponse("<div>🚀</div>")
-        except:
-            print("ERROR:", response.json())
+        except client.RateLimited as ex:
+            return responses.HTMLResponse(f"<div title=\"Rate limited, try again in {ex.retry_after:.0f}s\">⏳</div>")
+        except requests.HTTPError as ex:
+            print("ERROR:", ex.response.json())
             raise
     raise HTTPException(status_code=404, detail="Toot not found")
 
@@ -236,13 +455,14 @@ async def toots_boost(id: int):
 async def toots_favorite(id: int):
     toot = core.Toot.get_by_id(id)
     if toot is not None:
-        url = f'{config.ConfigHandler.MASTO_BASE}/api/v1/statuses/{toot.toot_id}/favourite'
-        response = requests.post(url, headers=config.headers())
         try:
-            response.raise_for_status()
+            await run_in_threadpool(client.get_client().post, f'/api/v1/statuses/{toot.toot_id}/favourite')
+            core.Interaction.record(toot, "favourite")
             return responses.HTMLResponse("<div>💫</div>")
-        except:
-            print("ERROR:", response.json())
+        except client.RateLimited as ex:
+            return responses.HTMLResponse(f"<div title=\"Rate limited, try again in {ex.retry_after:.0f}s\">⏳</div>")
+        except requests.HTTPError as ex:
+            print("ERROR:", ex.response.json())
             raise
     raise HTTPException(status_code=404, detail="Toot not found")
     
@@ -0,0 +1,137 @@
+"""
+Convert toot HTML into the forms the rest of fossil needs, once, when the toot is downloaded:
+
+- `plain_text()`: what embedding models & LLM prompts see. Paragraphs and line breaks are
+  kept, tags & entities are not.
+- `sanitize_html()`: what toot.html renders. Mastodon servers sanitize what they send, but
+  the HTML of a remote toot comes from whichever server it was posted on, so only an
+  allowlist of tags & attributes is kept.
+
+Both are single passes of the standard library's `html.parser`, much faster than html2text.
+"""
+import html
+import html.parser
+import re
+
+
+# Tags that Mastodon itself allows in statuses
+ALLOWED_TAGS = {
+    "p", "br", "span", "a", "del", "s", "pre", "code", "em", "strong", "b", "i", "u",
+    "ul", "ol", "li", "blockquote", "h1", "h2", "h3", "h4", "h5", "h6",
+}
+ALLOWED_ATTRIBUTES = {
+    "a": {"href", "class", "title"},
+    "span": {"class"},
+    "ol": {"start", "reversed"},
+    "li": {"value"},
+}
+ALLOWED_URL_SCHEMES = ("http://", "https://", "mailto:")
+_VOID_TAGS = {"br"}
+# Dropped along with everything inside them
+_DROPPED_TAGS = {"script", "style", "template", "iframe", "object", "svg", "math"}
+_BLOCK_TAGS = {"p", "pre", "blockquote", "ul", "ol", "li", "h1", "h2", "h3", "h4", "h5", "h6"}
+
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_SPACES_RE = re.compile(r"[ \t]+")
+
+
+class _Sanitizer(html.parser.HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out: list[str] = []
+        self.open_tags: list[str] = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        if tag in _DROPPED_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        kept = []
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name == "href" and not value.strip().lower().startswith(ALLOWED_URL_SCHEMES):
+                continue
+            kept.append(f' {name}="{html.escape(value)}"')
+        if tag == "a":
+            kept.append(' rel="nofollow noopener noreferrer" target="_blank"')
+        self.out.append(f"<{tag}{''.join(kept)}>")
+        if tag not in _VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        if tag in _VOID_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag: str):
+        if tag in _DROPPED_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # Close anything left open inside this tag too, so the markup stays balanced
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.out.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data: str):
+        if not self.dropping:
+            self.out.append(html.escape(data, quote=False))
+
+    def result(self) -> str:
+        self.close()
+        return "".join(self.out) + "".join(f"</{tag}>" for tag in reversed(self.open_tags))
+
+
+class _TextExtractor(html.parser.HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out: list[str] = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag: str, attrs):
+        if tag in _DROPPED_TAGS:
+            self.dropping += 1
+        elif tag == "br":
+            self.out.append("\n")
+        elif tag == "li":
+            self.out.append("\n- ")
+        elif tag in _BLOCK_TAGS:
+            self.out.append("\n\n")
+
+    def handle_endtag(self, tag: str):
+        if tag in _DROPPED_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+        elif tag in _BLOCK_TAGS:
+            self.out.append("\n\n")
+
+    def handle_data(self, data: str):
+        if not self.dropping:
+            self.out.append(data)
+
+    def result(self) -> str:
+        self.close()
+        text = _SPACES_RE.sub(" ", "".join(self.out))
+        text = "\n".join(line.strip() for line in text.split("\n"))
+        return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def sanitize_html(content: str | None) -> str:
+    if not content:
+        return ""
+    parser = _Sanitizer()
+    parser.feed(content)
+    return parser.result()
+
+
+def plain_text(content: str | None) -> str:
+    if not content:
+        return ""
+    parser = _TextExtractor()
+    parser.feed(content)
+    return parser.result()
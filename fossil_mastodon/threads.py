@@ -0,0 +1,211 @@
+"""
+Assemble reply threads & conversations.
+
+Every toot's `status_id` and `in_reply_to_id` are recorded in `thread_index` when it's
+downloaded, so walking a thread up to its root, or down to all its replies, is a single
+recursive query over an indexed table.
+
+Replies often point at statuses that never showed up in the home timeline. Those are fetched
+lazily, with one `/api/v1/statuses/:id/context` call per thread, only when someone opens the
+thread. The fetched statuses are cached in `thread_index` too (with their compressed JSON).
+"""
+import datetime
+import json
+import logging
+import sqlite3
+
+import pydantic
+
+from fossil_mastodon import client, compression, config, core, metrics, retention
+
+
+logger = logging.getLogger(__name__)
+
+
+# Guards against reply cycles & absurdly deep threads
+MAX_DEPTH = 200
+# How long a fetched context is trusted before asking the server for new replies
+CONTEXT_TTL = datetime.timedelta(minutes=15)
+
+
+class Thread(pydantic.BaseModel):
+    """
+    A conversation: the root status and every reply we know about, in reading order (each
+    reply right after the status it replies to).
+    """
+    root_id: str
+    toots: list[core.Toot]
+    depths: dict[str, int] = {}
+    # The root is itself a reply, to a status we don't have
+    incomplete: bool = False
+
+    @property
+    def is_conversation(self) -> bool:
+        return len(self.toots) > 1
+
+    def depth(self, toot: core.Toot) -> int:
+        return self.depths.get(toot.status_id, 0)
+
+
+@metrics.span("threads.group_by_conversation")
+def group_by_conversation(toots: list[core.Toot]) -> list[Thread]:
+    """
+    Group toots into conversations, using only what's already in the database (no API calls).
+    Toots that aren't part of any conversation come back as single-toot threads. Threads are
+    ordered by their first toot's position in `toots`.
+    """
+    with_ids = [toot for toot in toots if toot.status_id is not None]
+    roots: dict[str, str] = {}
+    if with_ids:
+        with config.ConfigHandler.open_db() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS thread_start (status_id TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM thread_start")
+            conn.executemany("INSERT OR IGNORE INTO thread_start VALUES (?)", [(toot.status_id,) for toot in with_ids])
+            rows = conn.execute('''
+                WITH RECURSIVE up(start_id, status_id, in_reply_to_id, depth) AS (
+                    SELECT t.status_id, t.status_id, t.in_reply_to_id, 0
+                    FROM thread_start s JOIN thread_index t ON t.status_id = s.status_id
+                    UNION
+                    SELECT up.start_id, t.status_id, t.in_reply_to_id, up.depth + 1
+                    FROM up JOIN thread_index t ON t.status_id = up.in_reply_to_id
+                    WHERE up.depth < ?
+                )
+                -- SQLite returns status_id from the row with the max depth, i.e. the root
+                SELECT start_id, status_id, MAX(depth) FROM up GROUP BY start_id
+            ''', (MAX_DEPTH,)).fetchall()
+            roots = {start_id: root_id for start_id, root_id, _ in rows}
+
+    threads: dict[str, Thread] = {}
+    for toot in toots:
+        root_id = roots.get(toot.status_id) or toot.status_id or toot.url
+        if root_id not in threads:
+            threads[root_id] = Thread(root_id=root_id, toots=[])
+        threads[root_id].toots.append(toot)
+    for thread in threads.values():
+        thread.toots.sort(key=lambda toot: toot.created_at)
+    return list(threads.values())
+
+
+def _query_thread(conn: sqlite3.Connection, status_id: str) -> list[tuple]:
+    """
+    Every status in the thread containing `status_id`, with its depth below the root.
+    """
+    return conn.execute(f'''
+        WITH RECURSIVE
+        up(status_id, in_reply_to_id, depth) AS (
+            SELECT status_id, in_reply_to_id, 0 FROM thread_index WHERE status_id = ?
+            UNION
+            SELECT t.status_id, t.in_reply_to_id, up.depth + 1
+            FROM up JOIN thread_index t ON t.status_id = up.in_reply_to_id
+            WHERE up.depth < ?
+        ),
+        root AS (
+            SELECT status_id FROM up ORDER BY depth DESC LIMIT 1
+        ),
+        down(status_id, depth) AS (
+            SELECT status_id, 0 FROM root
+            UNION
+            SELECT t.status_id, down.depth + 1
+            FROM down JOIN thread_index t ON t.in_reply_to_id = down.status_id
+            WHERE down.depth < ?
+        )
+        SELECT down.status_id, down.depth, thread_index.in_reply_to_id, thread_index.json_z,
+               thread_index.fetched_at, {core._TOOT_COLUMNS}
+        FROM down
+        JOIN thread_index ON thread_index.status_id = down.status_id
+        LEFT JOIN toots ON toots.status_id = down.status_id
+        LEFT JOIN accounts ON accounts.id = toots.account_id
+        ORDER BY down.depth
+    ''', (status_id, MAX_DEPTH, MAX_DEPTH)).fetchall()
+
+
+def _needs_fetch(rows: list[tuple], status_id: str) -> bool:
+    own_row = next((row for row in rows if row[0] == status_id), None)
+    if own_row is None or own_row[4] is None:
+        return True
+    return datetime.datetime.fromisoformat(own_row[4]) < datetime.datetime.utcnow() - CONTEXT_TTL
+
+
+def _cache_context(conn: sqlite3.Connection, toot: core.Toot, context: dict):
+    now = datetime.datetime.utcnow()
+    conn.execute('''
+        INSERT INTO thread_index (status_id, in_reply_to_id) VALUES (?, ?)
+        ON CONFLICT(status_id) DO NOTHING
+    ''', (toot.status_id, toot.in_reply_to_id))
+    for status in context.get("ancestors", []) + context.get("descendants", []):
+        conn.execute('''
+            INSERT INTO thread_index (status_id, in_reply_to_id, json_z, fetched_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(status_id) DO UPDATE
+                SET in_reply_to_id = excluded.in_reply_to_id
+                  , json_z = excluded.json_z
+                  , fetched_at = excluded.fetched_at
+        ''', (status["id"], status.get("in_reply_to_id"), compression.compress(json.dumps(status)), now))
+    conn.execute("UPDATE thread_index SET fetched_at = ? WHERE status_id = ?", (now, toot.status_id))
+    conn.commit()
+
+
+@metrics.span("threads.get_thread")
+def get_thread(toot: core.Toot, fetch: bool = True) -> Thread:
+    """
+    The whole conversation that `toot` is part of. Missing statuses are fetched from the
+    Mastodon server (at most one API call) unless `fetch=False`.
+    """
+    if toot.status_id is None:
+        return Thread(root_id=toot.url or "", toots=[toot])
+
+    with config.ConfigHandler.open_db() as conn:
+        rows = _query_thread(conn, toot.status_id)
+    # The API call happens without a database connection open
+    if fetch and _needs_fetch(rows, toot.status_id):
+        try:
+            context = client.get_client().get(f"/api/v1/statuses/{toot.status_id}/context").json()
+        except Exception:
+            # Threads are nice to have. Show what we've got.
+            logger.exception(f"Couldn't fetch context for status {toot.status_id}")
+        else:
+            with config.ConfigHandler.open_db() as conn:
+                _cache_context(conn, toot, context)
+                rows = _query_thread(conn, toot.status_id)
+
+    by_id: dict[str, core.Toot] = {}
+    depths: dict[str, int] = {}
+    replies: dict[str | None, list[str]] = {}
+    for status_id, depth, in_reply_to_id, json_z, fetched_at, *toot_row in rows:
+        if toot_row[0] is not None:
+            by_id[status_id] = core.Toot._from_row(tuple(toot_row))
+        elif json_z is not None:
+            by_id[status_id] = core.Toot.from_dict(json.loads(compression.decompress(json_z)))
+        else:
+            continue
+        depths[status_id] = depth
+        replies.setdefault(in_reply_to_id, []).append(status_id)
+
+    if not by_id:
+        return Thread(root_id=toot.status_id, toots=[toot])
+
+    # Depth-first, so that replies come right after what they reply to
+    ordered = []
+    stack = [rows[0][0]]
+    while stack:
+        status_id = stack.pop()
+        if status_id in by_id:
+            ordered.append(by_id[status_id])
+        children = sorted(replies.get(status_id, []), key=lambda id: by_id[id].created_at, reverse=True)
+        stack.extend(children)
+    return Thread(root_id=rows[0][0], toots=ordered, depths=depths, incomplete=rows[0][2] is not None)
+
+
+@retention.pruner
+def _prune_thread_index(conn: sqlite3.Connection) -> int:
+    """
+    Drop index entries for toots that were archived, and fetched statuses older than the
+    retention period.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=int(config.ConfigHandler.RETENTION_DAYS))
+    c = conn.cursor()
+    c.execute('''
+        DELETE FROM thread_index
+        WHERE status_id NOT IN (SELECT status_id FROM toots WHERE status_id IS NOT NULL)
+          AND (json_z IS NULL OR fetched_at < ?)
+    ''', (cutoff,))
+    return c.rowcount
@@ -0,0 +1,74 @@
+"""
+Token counting, shared by the embedding & prompt paths.
+
+- Encoders are loaded once per model, instead of on every call (tiktoken builds a large
+  vocabulary table each time).
+- Many texts are counted at once with `encode_batch`, which encodes on a thread pool
+  (tiktoken releases the GIL).
+- A toot's count is stored with it (`toots.token_count`), so budgeting an embedding batch or
+  a prompt is a lookup after the first time.
+"""
+import functools
+import typing
+
+from fossil_mastodon import config, metrics
+
+if typing.TYPE_CHECKING:
+    from fossil_mastodon import core
+
+
+# toots.token_count is measured with this model's encoding. It's the same encoding as
+# OpenAI's embedding & chat models, and a fair estimate for others.
+COUNT_MODEL = "gpt-3.5-turbo"
+# Below this many texts, a thread pool costs more than it saves
+_BATCH_MIN = 16
+_THREADS = 4
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name: str):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        encoding_name = tiktoken.list_encoding_names()[-1]
+        return tiktoken.get_encoding(encoding_name)
+
+
+@metrics.span("tokens.count")
+def count(texts: list[str], model_name: str = COUNT_MODEL) -> list[int]:
+    if not texts:
+        return []
+    encoding = get_encoding(model_name)
+    if len(texts) < _BATCH_MIN:
+        return [len(encoding.encode(text)) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_batch(texts, num_threads=_THREADS)]
+
+
+def count_toots(toots: list["core.Toot"]) -> list[int]:
+    """
+    Token counts of the toots' plain text. Only toots that haven't been counted before are
+    counted; their counts are saved for next time.
+    """
+    missing = [toot for toot in toots if toot.token_count is None]
+    if missing:
+        for toot, n in zip(missing, count([toot.plain_text or "" for toot in missing])):
+            toot.token_count = n
+        # Toots that aren't saved yet store their count when they are
+        saved = [(toot.token_count, toot.id) for toot in missing if toot.id is not None]
+        if saved:
+            with config.ConfigHandler.open_db() as conn:
+                conn.executemany("UPDATE toots SET token_count = ? WHERE id = ?", saved)
+                conn.commit()
+    return [toot.token_count for toot in toots]
+
+
+def truncate(text: str, max_tokens: int, model_name: str) -> tuple[str, int]:
+    """
+    Cut `text` down to at most `max_tokens` tokens. Returns the text & its token count.
+    """
+    encoding = get_encoding(model_name)
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+    return encoding.decode(tokens[:max_tokens]), max_tokens
@@ -0,0 +1,198 @@
+"""
+Fit KMeans off the web process, in parallel.
+
+sklearn's defaults (several inits in a row, on every toot, in float64) make training on a
+month of toots slow, and it all happens in the process that's serving requests. Instead:
+
+- Fit on a stratified subsample (`TRAIN_SAMPLE_SIZE` toots), so that every hour of the
+  timeline is represented in proportion, rather than the whole matrix.
+- Run each init in its own process, and keep the fit with the lowest inertia. The embeddings
+  are put in shared memory once, instead of being pickled to each process.
+- Use float32 throughout, and assign every toot to a cluster with one vectorized `predict`,
+  in one of the same processes.
+- Score the candidate numbers of clusters (see `topic_cluster.choose_num_clusters`) in the
+  same processes too.
+
+The worker processes are started the first time they're needed and reused after that, so
+only the first training after a restart pays for starting them. They only import numpy,
+sklearn & this module's dependencies, not the web app.
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING, Callable, NamedTuple
+
+import numpy as np
+
+from fossil_mastodon import config, metrics
+
+if TYPE_CHECKING:
+    from sklearn.cluster import KMeans
+
+
+logger = logging.getLogger(__name__)
+
+
+TRAIN_SAMPLE_SIZE = 20_000
+N_INIT = 4
+
+
+def stratified_sample(strata: np.ndarray, size: int, seed: int = 0) -> np.ndarray:
+    """
+    Indices of about `size` rows, taking the same fraction from every stratum (at least one
+    row from each), in their original order.
+    """
+    if len(strata) <= size:
+        return np.arange(len(strata))
+    rng = np.random.default_rng(seed)
+    fraction = size / len(strata)
+    chosen = []
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        take = max(1, round(len(members) * fraction))
+        chosen.append(rng.choice(members, take, replace=False))
+    return np.sort(np.concatenate(chosen))
+
+
+class _Shared(NamedTuple):
+    """
+    A float32 matrix in shared memory, as passed to the worker processes.
+    """
+    name: str
+    shape: tuple[int, ...]
+
+
+class _SharedArray:
+    """
+    Copies a matrix into shared memory for as long as the `with` block lasts.
+    """
+    def __init__(self, array: np.ndarray):
+        self.array = np.ascontiguousarray(array, dtype=np.float32)
+
+    def __enter__(self) -> _Shared:
+        self.shm = shared_memory.SharedMemory(create=True, size=max(self.array.nbytes, 1))
+        np.ndarray(self.array.shape, dtype=np.float32, buffer=self.shm.buf)[:] = self.array
+        return _Shared(self.shm.name, self.array.shape)
+
+    def __exit__(self, *exc_info):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _with_shared(shared: _Shared, fn: Callable[[np.ndarray], object]) -> object:
+    """
+    In a worker: call `fn` with the shared matrix, then detach from it. `fn` mustn't return
+    a view of the matrix.
+    """
+    if sys.version_info >= (3, 13):
+        # The parent owns the segment & unlinks it
+        shm = shared_memory.SharedMemory(name=shared.name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=shared.name)
+    result = fn(np.ndarray(shared.shape, dtype=np.float32, buffer=shm.buf))
+    # Only once nothing refers to the array. If fn raised, its traceback still does, and the
+    # segment is closed along with it.
+    shm.close()
+    return result
+
+
+def _fit_one(shared: _Shared, sample_indices: np.ndarray, n_clusters: int, seed: int) -> "KMeans":
+    from sklearn.cluster import KMeans
+    from threadpoolctl import threadpool_limits
+
+    # One core per process, otherwise the processes fight over BLAS/OpenMP threads
+    with threadpool_limits(1):
+        return _with_shared(shared, lambda embeddings: KMeans(n_clusters=n_clusters, n_init=1, random_state=seed)
+                            .fit(embeddings[sample_indices]))
+
+
+def _predict(shared: _Shared, kmeans: "KMeans") -> np.ndarray:
+    return _with_shared(shared, kmeans.predict)
+
+
+def _silhouette(shared: _Shared, n_clusters: int, seed: int) -> float | None:
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import silhouette_score
+    from threadpoolctl import threadpool_limits
+
+    def score(sample: np.ndarray) -> float | None:
+        labels = KMeans(n_clusters=n_clusters, n_init=2, random_state=seed).fit_predict(sample)
+        if len(set(labels)) < 2:
+            return None
+        return float(silhouette_score(sample, labels))
+
+    with threadpool_limits(1):
+        return _with_shared(shared, score)
+
+
+def _num_processes() -> int:
+    configured = int(config.ConfigHandler.TRAINING_PROCESSES)
+    return configured if configured > 0 else (os.cpu_count() or 1)
+
+
+_pool: concurrent.futures.ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> concurrent.futures.ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Not fork: this is called from a multi-threaded web server
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=_num_processes(), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _map(fn: Callable, *iterables) -> list:
+    """
+    `map` over the worker processes. If one of them died, the next call starts new ones.
+    """
+    global _pool
+    pool = _get_pool()
+    try:
+        return list(pool.map(fn, *iterables))
+    except concurrent.futures.process.BrokenProcessPool:
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise
+
+
+@metrics.span("training.fit_kmeans")
+def fit_kmeans(embeddings: np.ndarray, n_clusters: int, strata: np.ndarray | None = None,
+               seed: int = 0) -> tuple["KMeans", np.ndarray]:
+    """
+    Fit KMeans to `embeddings` & return the model and every row's cluster. `strata` (e.g. the
+    hour each toot was posted) keeps the subsample representative.
+
+    Both the fit & the predict happen in worker processes, even with `TRAINING_PROCESSES=1`,
+    so none of it competes with requests for this process's GIL.
+    """
+    if strata is None:
+        strata = np.zeros(len(embeddings))
+    sample_indices = stratified_sample(strata, TRAIN_SAMPLE_SIZE, seed)
+
+    with _SharedArray(embeddings) as shared:
+        fits = _map(_fit_one, [shared] * N_INIT, [sample_indices] * N_INIT, [n_clusters] * N_INIT,
+                    [seed + i for i in range(N_INIT)])
+        kmeans = min(fits, key=lambda fit: fit.inertia_)
+        logger.info(f"KMeans inertia per init: {[round(fit.inertia_, 1) for fit in fits]}")
+        labels, = _map(_predict, [shared], [kmeans])
+
+    return kmeans, labels
+
+
+@metrics.span("training.silhouette_scores")
+def silhouette_scores(sample: np.ndarray, candidates: list[int], seed: int = 0) -> dict[int, float]:
+    """
+    Fit KMeans to `sample` with each candidate number of clusters, in the worker processes,
+    and score each fit. Candidates that collapse to a single cluster get no score.
+    """
+    with _SharedArray(sample) as shared:
+        scores = _map(_silhouette, [shared] * len(candidates), candidates, [seed] * len(candidates))
+    return {k: score for k, score in zip(candidates, scores) if score is not None}
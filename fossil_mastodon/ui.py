@@ -1,14 +1,13 @@
 import datetime
 import re
-import urllib.parse
 
 import pydantic
-import streamlit as st
 
 from . import config, core
 
 
 def get_time_frame() -> datetime.timedelta:
+    import streamlit as st
     time_frame = st.radio("Show last:", ["6 hours", "day", "week"], horizontal=True)
     
     if time_frame == "6 hours":
@@ -54,33 +53,23 @@ def timedelta(time_span: str) -> datetime.timedelta:
 
 
 class LinkStyle:
+    # The link_style values posted by index.html, and older capitalized names
+    _schemes = {"desktop": "desktop", "ivory": "ivory", "native": "original", "original": "original"}
+
     def __init__(self, scheme: str | None = None):
-        # ivory://acct/openURL?url=
-        # {config.ConfigHandler.MASTO_BASE}/deck/@{toot.author}/{toot.toot_id}
-        if scheme:
-            self.scheme = st.radio("Link scheme:", ["Desktop", "Ivory", "Original"], index=1, horizontal=True)
-        else:
-            self.scheme = scheme
-
-    def toot_url(self, toot: core.Toot) -> str:
-        if self.scheme == "Desktop":
-            return f"{config.ConfigHandler.MASTO_BASE}/@{toot.author}/{toot.toot_id}"
-        elif self.scheme == "Ivory":
-            encoded_url = urllib.parse.quote(toot.url)
-            return f"ivory://acct/openURL?url={encoded_url}"
-        elif self.scheme == "Original":
-            return toot.url
-        raise ValueError("Invalid scheme")
-
-    def profile_url(self, toot: core.Toot) -> str:
-        if self.scheme == "Desktop":
+        self.scheme = self._schemes.get((scheme or "desktop").lower(), "desktop")
+
+    def toot_url(self, toot: core.Toot) -> str | None:
+        # Links are computed when the toot is downloaded, see core.TootView
+        links = toot.view.links
+        return links.get(self.scheme) or links.get("original") or toot.url
+
+    def profile_url(self, toot: core.Toot) -> str | None:
+        if self.scheme == "desktop":
             return f"{config.ConfigHandler.MASTO_BASE}/@{toot.author}"
-        elif self.scheme == "Ivory":
-            # return f"ivory://@{toot.author}/profile"
+        elif self.scheme == "ivory":
             return f"ivory://acct/openURL?url={toot.profile_url}"
-        elif self.scheme == "Original":
-            return toot.profile_url
-        raise ValueError("Invalid scheme")
+        return toot.profile_url
 
 
 
@@ -88,10 +77,17 @@ class TootCluster(pydantic.BaseModel):
     id: int
     name: str
     toots: list[core.Toot]
+    # If set, the toots are fetched from here when the cluster is opened, instead of being
+    # rendered up front
+    page_url: str | None = None
+    # For partial re-renders: the toots that arrived since the client's last render
+    new_toots: list[core.Toot] = []
 
 
 class TootClusters(pydantic.BaseModel):
     clusters: list[TootCluster]
+    # The number of clusters was chosen automatically
+    auto_k: bool = False
 
     @property
     def num_toots(self) -> int:
@@ -109,6 +105,7 @@ class TootClusters(pydantic.BaseModel):
 
 
 def display_toot(toot: core.Toot, link_style: LinkStyle):
+    import streamlit as st
     with st.container(border=True):
         reply = "↩" if toot.is_reply else ""
         st.markdown(f"""
@@ -135,6 +132,7 @@ def display_toot(toot: core.Toot, link_style: LinkStyle):
 
 
 def all_toot_summary(toots: list[core.Toot]):
+    import streamlit as st
     latest_date = max(t.created_at for t in toots)
     earliest_date = min(t.created_at for t in toots)
     now = datetime.datetime.utcnow()
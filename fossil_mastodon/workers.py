@@ -0,0 +1,77 @@
+"""
+Coordination between worker processes, for running with `uvicorn --workers N`.
+
+Every worker serves requests, but some things must only happen in one process at a time:
+
+- Migrations: `exclusive()` serializes them, so two workers starting together don't both
+  try to apply the same one.
+- Background jobs (retention, scheduled downloads): only the leader runs them. The leader is
+  whichever process holds the leader lock; if it dies the OS releases the lock, and the next
+  worker to call `is_leader()` takes over.
+
+Both are advisory file locks next to the database. On platforms without `fcntl` (Windows)
+they're no-ops and every process acts as the leader, which is right for a single worker.
+"""
+import contextlib
+import logging
+import os
+from typing import IO, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from fossil_mastodon import config
+
+
+logger = logging.getLogger(__name__)
+
+
+_leader_file: IO | None = None
+
+
+def _lock_path(db_path: str, name: str) -> str | None:
+    if fcntl is None or db_path == ":memory:":
+        return None
+    return f"{db_path}.{name}.lock"
+
+
+@contextlib.contextmanager
+def exclusive(db_path: str, name: str = "migrate") -> Iterator[None]:
+    """
+    Block until no other process is inside `exclusive(db_path, name)`.
+    """
+    path = _lock_path(db_path, name)
+    if path is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def is_leader() -> bool:
+    """
+    Whether this process should run background jobs. Cheap to call repeatedly; a process
+    that isn't the leader tries to take over each time.
+    """
+    global _leader_file
+    if _leader_file is not None:
+        return True
+    path = _lock_path(config.ConfigHandler.DATABASE_PATH, "leader")
+    if path is None:
+        return True
+    f = open(path, "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    # Held until the process exits
+    _leader_file = f
+    logger.info(f"Process {os.getpid()} is the leader for background jobs")
+    return True
@@ -0,0 +1,58 @@
+"""
+Shared fixtures. Every test gets its own temporary database, so nothing touches your real
+fossil.db, and nothing talks to a real Mastodon server.
+"""
+import datetime
+import os
+import tempfile
+
+import pytest
+
+from fossil_mastodon import config
+
+# Importing the server loads the plugins, which migrates the database, before any fixture
+# runs. Point it somewhere harmless. A developer's .env shouldn't leak into the tests.
+config.dotenv_values = lambda *args, **kwargs: {}
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="fossil-tests-"), "fossil.db")
+
+# Plugins can only be imported once the app exists
+from fossil_mastodon import server  # noqa: E402, F401
+
+
+@pytest.fixture(autouse=True)
+def db_path(tmp_path, monkeypatch):
+    # A developer's .env shouldn't leak into the tests
+    monkeypatch.setattr(config, "dotenv_values", lambda *args, **kwargs: {})
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "fossil.db"))
+    monkeypatch.delenv("ARCHIVE_PATH", raising=False)
+    monkeypatch.delenv("RETENTION_DAYS", raising=False)
+    monkeypatch.setenv("MASTO_BASE", "https://mastodon.test")
+    monkeypatch.setenv("ACCESS_TOKEN", "test-token")
+    return tmp_path / "fossil.db"
+
+
+def make_status(id: int, text: str = "hello world", account_id: int = 1, in_reply_to_id: int | None = None,
+                created_at: datetime.datetime | None = None, **extra) -> dict:
+    """
+    A minimal Mastodon status, as the API returns it.
+    """
+    created_at = created_at or datetime.datetime.utcnow()
+    return {
+        "id": str(id),
+        "created_at": created_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "in_reply_to_id": str(in_reply_to_id) if in_reply_to_id else None,
+        "url": f"https://mastodon.test/@user{account_id}/{id}",
+        "content": f"<p>{text}</p>",
+        "replies_count": 0,
+        "media_attachments": [],
+        "card": None,
+        "reblog": None,
+        "account": {
+            "id": str(account_id),
+            "acct": f"user{account_id}@mastodon.test",
+            "display_name": f"User {account_id}",
+            "url": f"https://mastodon.test/@user{account_id}",
+            "avatar": f"https://mastodon.test/avatars/{account_id}.png",
+        },
+        **extra,
+    }
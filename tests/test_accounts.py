@@ -0,0 +1,70 @@
+import pathlib
+
+from fossil_mastodon import config, core, migrations
+
+
+def other_account(tmp_path) -> config.Account:
+    path = tmp_path / "accounts" / "other"
+    path.mkdir(parents=True)
+    return config.Account(
+        name="other",
+        masto_base="https://other.test",
+        access_token="other-token",
+        database_path=str(path / "fossil.db"),
+        archive_path=str(path / "fossil-archive.db"),
+    )
+
+
+def session_names(conn) -> list[str]:
+    return [row[0] for row in conn.execute("SELECT name FROM sessions")]
+
+
+def test_only_the_main_database_gets_a_session(tmp_path):
+    with config.use_account(other_account(tmp_path)):
+        with config.ConfigHandler.open_db() as conn:
+            assert not config.is_main_db(conn)
+            assert session_names(conn) == []
+        # Sessions are always in the main database
+        with config.ConfigHandler.open_main_db() as conn:
+            assert config.is_main_db(conn)
+            assert session_names(conn) == ["Main"]
+
+
+def test_seeded_account_sessions_are_removed(tmp_path):
+    account = other_account(tmp_path)
+    with config.use_account(account):
+        with config.ConfigHandler.open_db() as conn:
+            conn.execute("INSERT INTO sessions (id, name, settings) VALUES ('x', 'Main', '{}')")
+            migrations.remove_account_db_sessions.apply(conn)
+            assert session_names(conn) == []
+    with config.ConfigHandler.open_main_db() as conn:
+        migrations.remove_account_db_sessions.apply(conn)
+        assert session_names(conn) == ["Main"]
+
+
+def test_account_is_routed_by_context(tmp_path):
+    account = other_account(tmp_path)
+    assert config.current_account().database_path == config.main_db_path()
+    with config.use_account(account):
+        assert config.ConfigHandler.DATABASE_PATH == account.database_path
+        assert config.ConfigHandler.ACCESS_TOKEN == "other-token"
+        assert core.Session.for_current_account() == []
+    assert config.ConfigHandler.ACCESS_TOKEN == "test-token"
+
+
+def test_account_databases_follow_the_session_id():
+    session = core.Session.get_or_create("Work")
+    session.settings.access_token = "work-token"
+    account = session.account()
+    assert pathlib.Path(account.database_path).parent == config.account_dir(session.id)
+    # Looking the account up doesn't touch the disk, saving the session does
+    assert not config.account_dir(session.id).exists()
+    session.save()
+    assert config.account_dir(session.id).is_dir()
+
+    # A similar name is a different account, and renaming keeps the toots
+    other = core.Session.get_or_create("work!")
+    other.settings.access_token = "other-token"
+    assert other.account().database_path != account.database_path
+    session.name = "Day job"
+    assert session.account().database_path == account.database_path
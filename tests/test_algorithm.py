@@ -0,0 +1,92 @@
+import asyncio
+import datetime
+import threading
+
+from conftest import make_status
+from fossil_mastodon import algorithm, core, plugins
+
+
+START = datetime.datetime(2024, 1, 1)
+REPEATED = "The same long announcement, posted over and over by different accounts"
+
+
+class Recorder(algorithm.BaseAlgorithm):
+    """
+    Hands back the toots render() & render_delta() were given, after prerender().
+    """
+    def render(self, toots, context):
+        return toots
+
+    def render_delta(self, toots, last_seen_id, context):
+        return toots
+
+    @classmethod
+    def train(cls, context, http_args):
+        return cls()
+
+
+def make_toot(id: int, minutes: int) -> core.Toot:
+    toot = core.Toot.from_dict(make_status(id, REPEATED, account_id=id, created_at=START + datetime.timedelta(minutes=minutes)))
+    toot.id = id
+    return toot
+
+
+def summary(toots: list[core.Toot]) -> list[tuple[int, list[int]]]:
+    return [(toot.id, [dup.id for dup in toot.duplicates]) for toot in toots]
+
+
+def test_delta_does_not_collapse_across_what_is_shown():
+    context = plugins.RenderContext.model_construct(collapse_duplicates=True)
+    # Toot 1 is on the page. 2 duplicates it, and 3 was posted before it (e.g. a late boost).
+    timeline = [make_toot(1, minutes=10), make_toot(2, minutes=20), make_toot(3, minutes=5)]
+
+    delta = asyncio.run(algorithm.render_delta(Recorder(), timeline, 1, context))
+    assert summary(delta) == [(1, []), (3, [2])]
+
+    # A full render collapses everything
+    full = asyncio.run(algorithm.render(Recorder(), timeline, context))
+    assert summary(full) == [(3, [1, 2])]
+
+
+class AsyncAlgorithm(algorithm.BaseAlgorithm):
+    def __init__(self, toots: list[core.Toot] | None = None):
+        self.toots = toots or []
+
+    async def prerender(self, toots, context):
+        await asyncio.sleep(0)
+        return toots[:1]
+
+    async def render(self, toots, context):
+        return toots
+
+    @classmethod
+    async def train(cls, context, http_args):
+        return cls(await context.get_toots_async())
+
+
+def test_async_algorithms_are_awaited():
+    make_toot(1, minutes=1).save()
+    context = algorithm.TrainContext(end_time=START + datetime.timedelta(days=1), timedelta=datetime.timedelta(days=2), session_id="")
+    model = asyncio.run(algorithm.train(AsyncAlgorithm, context, {}))
+    assert [toot.status_id for toot in model.toots] == ["1"]
+
+    toots = [make_toot(1, minutes=1), make_toot(2, minutes=2)]
+    rendered = asyncio.run(algorithm.render(model, toots, plugins.RenderContext.model_construct()))
+    assert [toot.id for toot in rendered] == [1]
+
+
+def test_sync_algorithms_run_off_the_event_loop():
+    threads = []
+
+    class Sync(Recorder):
+        def render(self, toots, context):
+            threads.append(threading.current_thread())
+            return toots
+
+    async def render():
+        threads.append(threading.current_thread())
+        return await algorithm.render(Sync(), [], plugins.RenderContext.model_construct(collapse_duplicates=False))
+
+    assert asyncio.run(render()) == []
+    loop_thread, render_thread = threads
+    assert render_thread is not loop_thread
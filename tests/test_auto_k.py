@@ -0,0 +1,34 @@
+import numpy as np
+
+from fossil_mastodon.plugin_impl import topic_cluster
+
+
+def directions(k: int, per_cluster: int = 40, dims: int = 16, seed: int = 0) -> np.ndarray:
+    """
+    `k` well separated groups of embeddings, pointing in different directions.
+    """
+    rng = np.random.default_rng(seed)
+    centers = np.eye(k, dims) * 5
+    return np.repeat(centers, per_cluster, axis=0) + rng.standard_normal((k * per_cluster, dims)) * 0.3
+
+
+def test_finds_the_number_of_groups():
+    for k in [3, 5]:
+        chosen, scores = topic_cluster.choose_num_clusters(directions(k))
+        assert chosen == k
+        assert max(scores, key=scores.get) == k
+        assert min(scores) == topic_cluster.AUTO_MIN_CLUSTERS
+
+
+def test_few_toots_limit_the_candidates():
+    # 30 toots: at most 3 clusters of ~10
+    _, scores = topic_cluster.choose_num_clusters(directions(3, per_cluster=10))
+    assert max(scores) == 3
+
+
+def test_samples_big_timelines(monkeypatch):
+    monkeypatch.setattr(topic_cluster, "AUTO_SAMPLE_SIZE", 200)
+    monkeypatch.setattr(topic_cluster, "AUTO_MAX_CLUSTERS", 6)
+    chosen, scores = topic_cluster.choose_num_clusters(directions(4, per_cluster=500))
+    assert chosen == 4
+    assert sorted(scores) == [2, 3, 4, 5, 6]
@@ -0,0 +1,100 @@
+import datetime
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from fossil_mastodon import client
+
+
+class ScriptedAdapter(BaseAdapter):
+    """
+    Answers each request with the next (status, headers) in the script.
+    """
+    def __init__(self, script: list[tuple[int, dict]]):
+        super().__init__()
+        self.script = list(script)
+        self.requests: list[str] = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request.method)
+        status, headers = self.script.pop(0)
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = b"{}"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def masto(monkeypatch):
+    masto = client.MastodonClient("https://mastodon.test", "token", max_wait=10)
+    masto.sleeps = []
+    monkeypatch.setattr(masto, "_sleep", masto.sleeps.append)
+    return masto
+
+
+def mount(masto: client.MastodonClient, script: list[tuple[int, dict]]) -> ScriptedAdapter:
+    adapter = ScriptedAdapter(script)
+    masto.session.mount("https://mastodon.test", adapter)
+    return adapter
+
+
+def test_get_is_retried_on_server_errors(masto):
+    adapter = mount(masto, [(503, {}), (502, {}), (200, {})])
+    assert masto.get("/api/v1/timelines/home").status_code == 200
+    assert adapter.requests == ["GET", "GET", "GET"]
+    assert len(masto.sleeps) == 2
+
+
+def test_post_is_never_retried(masto):
+    adapter = mount(masto, [(503, {}), (200, {})])
+    with pytest.raises(requests.HTTPError):
+        masto.post("/api/v1/statuses/1/reblog")
+    assert adapter.requests == ["POST"]
+
+
+def test_long_retry_after_fails_fast(masto):
+    adapter = mount(masto, [(429, {"Retry-After": "300"}), (200, {})])
+    with pytest.raises(client.RateLimited) as ex:
+        masto.get("/api/v1/timelines/home")
+    assert ex.value.retry_after >= 300
+    assert masto.sleeps == []
+    assert len(adapter.requests) == 1
+
+
+def test_short_retry_after_is_waited_out(masto):
+    mount(masto, [(429, {"Retry-After": "2"}), (200, {})])
+    assert masto.get("/api/v1/timelines/home").status_code == 200
+    assert 2 <= masto.sleeps[0] <= 3
+
+
+def test_used_up_rate_limit_fails_before_sending(masto):
+    reset = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5)
+    adapter = mount(masto, [(200, {
+        "X-RateLimit-Limit": "300",
+        "X-RateLimit-Remaining": "0",
+        "X-RateLimit-Reset": reset.isoformat(),
+    })])
+    masto.get("/api/v1/timelines/home")
+    with pytest.raises(client.RateLimited):
+        masto.get("/api/v1/timelines/home")
+    assert len(adapter.requests) == 1
+    assert masto.sleeps == []
+
+
+def test_throttle_waits_are_capped(masto):
+    reset = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5)
+    mount(masto, [(200, {
+        "X-RateLimit-Limit": "300",
+        "X-RateLimit-Remaining": "2",
+        "X-RateLimit-Reset": reset.isoformat(),
+    }), (200, {})])
+    masto.get("/api/v1/timelines/home")
+    masto.get("/api/v1/timelines/home")
+    assert masto.sleeps == [10]
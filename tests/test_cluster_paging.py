@@ -0,0 +1,68 @@
+import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import make_status
+from fossil_mastodon import core, dedup, server
+from fossil_mastodon.plugin_impl import topic_cluster
+
+
+START = datetime.datetime(2024, 1, 1)
+REPEATED = "The same long announcement, posted over and over by different accounts"
+
+
+@pytest.fixture
+def cluster() -> list[core.Toot]:
+    """
+    60 toots in cluster 0. Every 20th one is the same text, so they're duplicates on
+    different pages. A few toots share a timestamp, to exercise the cursor's tie-break.
+    """
+    for id in range(1, 61):
+        text = REPEATED if id % 20 == 0 else f"toot number {id}"
+        created_at = START + datetime.timedelta(minutes=id // 3)
+        core.Toot.from_dict(make_status(id, text, account_id=id, created_at=created_at)).save()
+    toots = core.Toot.get_toots_since(START)
+    topic_cluster.TootModel.save_all([
+        topic_cluster.TootModel(id=None, toot_id=toot.id, model_version="v1", cluster_id=0) for toot in toots
+    ])
+    return toots
+
+
+def all_pages(collapse: bool) -> list[core.Toot]:
+    toots, cursor, pages = [], None, 0
+    while True:
+        page, cursor = topic_cluster.get_cluster_page("v1", 0, START, cursor, limit=7, collapse=collapse)
+        toots += page
+        pages += 1
+        if cursor is None:
+            return toots
+        assert pages < 20
+
+
+def test_pages_cover_the_cluster_once(cluster):
+    toots = all_pages(collapse=False)
+    assert sorted(toot.id for toot in toots) == sorted(toot.id for toot in cluster)
+    assert [(toot.created_at, toot.id) for toot in toots] == sorted(((t.created_at, t.id) for t in toots), reverse=True)
+
+
+def test_duplicates_are_collapsed_across_pages(cluster):
+    toots = all_pages(collapse=True)
+    assert len(toots) == len(dedup.collapse(cluster)) == 58
+    assert len({toot.id for toot in toots}) == len(toots)
+    repeated = [toot for toot in toots if REPEATED in toot.content]
+    assert [toot.status_id for toot in repeated] == ["20"]
+    assert sorted(toot.status_id for toot in repeated[0].duplicates) == ["40", "60"]
+    assert [(toot.created_at, toot.id) for toot in toots] == sorted(((t.created_at, t.id) for t in toots), reverse=True)
+
+
+def test_other_clusters_and_models_are_left_out(cluster):
+    assert topic_cluster.get_cluster_page("v1", 1, START) == ([], None)
+    assert topic_cluster.get_cluster_page("v2", 0, START) == ([], None)
+
+
+def test_cluster_page_route(cluster):
+    response = TestClient(server.app).get(topic_cluster._page_url("v1", 0, START, collapse=True))
+    assert response.status_code == 200
+    assert response.text.count('class="toot"') == topic_cluster.PAGE_SIZE
+    assert 'class="cluster-more"' in response.text
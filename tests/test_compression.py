@@ -0,0 +1,49 @@
+import json
+import zlib
+
+from fossil_mastodon import compression, config, core
+
+from conftest import make_status
+
+
+def test_round_trip():
+    text = json.dumps(make_status(1, "café \U0001f600 <b>bold</b>"))
+    blob = compression.compress(text)
+    assert compression.decompress(blob) == text
+
+
+def test_preset_dictionary_beats_plain_zlib():
+    text = json.dumps(make_status(1))
+    assert len(compression.compress(text)) < len(zlib.compress(text.encode("utf-8"), 9))
+
+
+def test_accounts_are_stored_once():
+    core.Toot.from_dict(make_status(1, account_id=7)).save()
+    core.Toot.from_dict(make_status(2, account_id=7)).save()
+
+    with config.ConfigHandler.open_db() as conn:
+        assert conn.execute("SELECT id FROM accounts").fetchall() == [("7",)]
+        blob = conn.execute("SELECT orig_json_z FROM toots WHERE status_id = '1'").fetchone()[0]
+    # Only a reference to the account is left in the status
+    assert json.loads(compression.decompress(blob))["account"] == {"id": "7"}
+
+
+def test_loaded_toot_has_its_account():
+    core.Toot.from_dict(make_status(1, account_id=7)).save()
+    toot = core.Toot.get_by_id(1)
+    assert toot.orig_dict["account"]["display_name"] == "User 7"
+    assert json.loads(toot.get_orig_json())["account"]["acct"] == "user7@mastodon.test"
+
+
+def test_saving_a_loaded_toot_keeps_its_account():
+    core.Toot.from_dict(make_status(1, account_id=7)).save()
+    toot = core.Toot.get_by_id(1)
+    with config.ConfigHandler.open_db() as conn:
+        conn.execute("DELETE FROM toots")
+
+    assert toot.save()
+
+    with config.ConfigHandler.open_db() as conn:
+        id, account_id = conn.execute("SELECT id, account_id FROM toots").fetchone()
+    assert account_id == "7"
+    assert core.Toot.get_by_id(id).orig_dict["account"]["display_name"] == "User 7"
@@ -0,0 +1,79 @@
+import datetime
+
+import numpy as np
+
+from conftest import make_status
+from fossil_mastodon import core, dedup
+
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def make_toot(id: int, text: str = "hello world", card_url: str | None = None, embedding=None) -> core.Toot:
+    status = make_status(id, text, account_id=id, created_at=START + datetime.timedelta(minutes=id),
+                         card={"url": card_url} if card_url else None)
+    toot = core.Toot.from_dict(status)
+    toot.embedding = None if embedding is None else np.array(embedding, dtype=np.float64)
+    return toot
+
+
+def test_union_find_merges_transitively():
+    groups = dedup._UnionFind(5)
+    groups.union(3, 4)
+    groups.union(1, 3)
+    assert {groups.find(i) for i in (1, 3, 4)} == {1}
+    assert groups.find(0) == 0
+    assert groups.find(2) == 2
+
+
+def test_groups_are_transitive_across_keys():
+    long_text = "A long announcement that a lot of accounts are posting word for word today"
+    toots = [
+        make_toot(1, "first", card_url="https://example.com/post?utm_source=masto"),
+        make_toot(2, long_text, card_url="https://example.com/post/"),
+        make_toot(3, f"<p>{long_text}!</p> https://other.example"),
+        make_toot(4, "unrelated"),
+    ]
+    collapsed = dedup.collapse(toots)
+    assert [toot.status_id for toot in collapsed] == ["1", "4"]
+    assert [toot.status_id for toot in collapsed[0].duplicates] == ["2", "3"]
+    assert collapsed[1].duplicates == []
+
+
+def test_earliest_toot_represents_the_group():
+    text = "The same fairly long sentence, posted by two different accounts at once"
+    later, earlier = make_toot(5, text), make_toot(2, text)
+    collapsed = dedup.collapse([later, earlier])
+    assert collapsed == [earlier]
+    assert collapsed[0].duplicates == [later]
+
+
+def test_short_identical_text_is_not_a_duplicate():
+    assert len(dedup.collapse([make_toot(1, "Good morning!"), make_toot(2, "Good morning!")])) == 2
+
+
+def test_similar_embeddings_are_grouped():
+    toots = [
+        make_toot(1, "one", embedding=[1.0, 0.0, 0.0]),
+        make_toot(2, "two", embedding=[0.99, 0.01, 0.0]),
+        make_toot(3, "three", embedding=[0.0, 1.0, 0.0]),
+        # A different embedding model; never compared with the others
+        make_toot(4, "four", embedding=[1.0, 0.0]),
+    ]
+    collapsed = dedup.collapse(toots)
+    assert [toot.status_id for toot in collapsed] == ["1", "3", "4"]
+    assert [toot.status_id for toot in collapsed[0].duplicates] == ["2"]
+
+
+def test_lsh_buckets_find_the_same_pairs(monkeypatch):
+    rng = np.random.default_rng(1)
+    embeddings = rng.standard_normal((300, 16)).astype(np.float32)
+    embeddings[150] = embeddings[10] + 0.001
+    embeddings[299] = embeddings[10] * 2
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    brute_force = set(dedup._similar_pairs(embeddings, dedup.SIMILARITY_THRESHOLD))
+    monkeypatch.setattr(dedup, "_BRUTE_FORCE_LIMIT", 0)
+    bucketed = set(dedup._similar_pairs(embeddings, dedup.SIMILARITY_THRESHOLD))
+    assert brute_force == {(10, 150), (10, 299), (150, 299)}
+    assert bucketed == brute_force
@@ -0,0 +1,32 @@
+import numpy as np
+
+from fossil_mastodon import local_models
+
+
+def cosine(a, b) -> float:
+    a, b = np.array(a), np.array(b)
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def test_embeddings_are_deterministic_and_topical():
+    model = local_models.get_embedding_model(local_models.EMBEDDING_MODEL_ID)
+    coffee, coffee_again, birds = model.embed_batch([
+        "<p>Dialing in the espresso grinder, the crema is finally right</p>",
+        "New grinder! Espresso with proper crema this morning",
+        "A heron and two warblers at the feeder today",
+    ])
+
+    assert len(coffee) == local_models.DIMENSIONS
+    assert model.embed("espresso") == model.embed("espresso")
+    assert cosine(coffee, coffee_again) > cosine(coffee, birds)
+
+
+def test_labels_are_distinctive_keywords():
+    labels = local_models.label_clusters({
+        0: ["espresso grinder crema", "espresso beans roast", "the grinder and espresso"],
+        1: ["heron at the feeder", "warbler feeder spring", "heron nest"],
+    }, n_words=2)
+
+    assert "espresso" in labels[0]
+    assert "feeder" in labels[1] or "heron" in labels[1]
+    assert labels[0] != labels[1]
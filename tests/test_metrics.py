@@ -0,0 +1,35 @@
+import pytest
+
+from fossil_mastodon import metrics
+
+
+def test_span_records_successes_and_errors():
+    with metrics.span("test.block", kind="ok"):
+        pass
+
+    @metrics.span("test.block", kind="decorated")
+    def fails():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        fails()
+
+    assert metrics.SPANS.count(span="test.block", error="false", kind="ok") == 1
+    assert metrics.SPANS.count(span="test.block", error="true", kind="decorated") == 1
+
+
+def test_prometheus_text_format():
+    counter = metrics.counter("fossil_test_things_total", "Things")
+    counter.inc(2, kind='a"b')
+    histogram = metrics.histogram("fossil_test_seconds", "Seconds", buckets=(0.1, 1.0))
+    histogram.observe(0.5)
+    histogram.observe(5.0)
+
+    text = metrics.render_prometheus()
+
+    assert "# TYPE fossil_test_things_total counter" in text
+    assert 'fossil_test_things_total{kind="a\\"b"} 2' in text
+    assert 'fossil_test_seconds_bucket{le="0.1"} 0' in text
+    assert 'fossil_test_seconds_bucket{le="1.0"} 1' in text
+    assert 'fossil_test_seconds_bucket{le="+Inf"} 2' in text
+    assert "fossil_test_seconds_count 2" in text
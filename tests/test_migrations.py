@@ -0,0 +1,55 @@
+import sqlite3
+
+import pytest
+
+from fossil_mastodon import config, migrations
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # Migrations registered by a test are forgotten afterwards
+    monkeypatch.setattr(migrations.migration, "all", list(migrations.migration.all))
+
+
+def applied(db_path) -> set[str]:
+    with sqlite3.connect(db_path) as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM schema_migrations")}
+
+
+def test_every_migration_is_recorded(db_path):
+    config.ConfigHandler.open_db().close()
+    assert applied(db_path) == {m.name for m in migrations.migration.all}
+
+
+def test_new_migration_runs_once(db_path):
+    config.ConfigHandler.open_db().close()
+    calls = []
+
+    @migrations.migration
+    def add_widgets(conn: sqlite3.Connection):
+        calls.append(1)
+        conn.execute("CREATE TABLE widgets (id INTEGER)")
+
+    config.ConfigHandler.open_db().close()
+    # Another process starting up against the same database
+    migrations._migrated_paths.clear()
+    config.ConfigHandler.open_db().close()
+
+    assert calls == [1]
+    assert add_widgets.name in applied(db_path)
+
+
+def test_failed_migration_is_rolled_back(db_path):
+    config.ConfigHandler.open_db().close()
+
+    @migrations.migration
+    def broken(conn: sqlite3.Connection):
+        conn.execute("CREATE TABLE half_done (id INTEGER)")
+        conn.execute("INSERT INTO half_done VALUES (1)")
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        config.ConfigHandler.open_db()
+    assert broken.name not in applied(db_path)
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM half_done").fetchone() == (0,)
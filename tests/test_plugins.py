@@ -0,0 +1,48 @@
+import json
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fossil_mastodon import core, plugins, server
+
+
+@pytest.fixture
+def client():
+    return TestClient(server.app)
+
+
+def test_topic_cluster_is_the_default():
+    assert plugins.get_algorithm().plugin.name == "Topic Cluster"
+    assert plugins.get_algorithm("no such algorithm").plugin.name == "Topic Cluster"
+    assert plugins.get_algorithm("Ranked").plugin.name == "Ranked"
+
+
+def test_new_session_selects_topic_cluster(client):
+    response = client.get("/")
+    assert response.status_code == 200
+    assert re.search(r'value="Topic Cluster"\s+selected', response.text)
+    assert 'name="num_clusters"' in response.text
+
+
+def test_form_follows_the_picker(client):
+    ranked = client.get("/algorithm/form", params={"algorithm": "Ranked"})
+    assert 'name="half_life_hours"' in ranked.text
+    topic_cluster = client.get("/algorithm/Topic Cluster/form")
+    assert 'name="num_clusters"' in topic_cluster.text
+
+
+def test_train_uses_the_selected_algorithm(client):
+    client.get("/")
+    response = client.post("/toots/train", data={
+        "algorithm": "Ranked",
+        "link_style": "Desktop",
+        "time_span": "1d",
+        "half_life_hours": "12",
+    })
+    assert response.status_code == 200
+
+    session = core.Session.get_by_id(client.cookies["fossil_session_id"])
+    spec = json.loads(session.algorithm_spec)
+    assert spec["class_name"] == "Ranked"
+    assert "algorithm" not in spec["kwargs"]
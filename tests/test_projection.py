@@ -0,0 +1,123 @@
+import datetime
+
+import numpy as np
+
+from conftest import make_status
+from fossil_mastodon import algorithm, config, core, local_models, projection
+from fossil_mastodon.plugin_impl import topic_cluster
+
+
+def low_rank(n: int = 200, dims: int = 32, rank: int = 4, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal((n, rank)) @ rng.standard_normal((rank, dims))).astype(np.float32)
+
+
+def test_pca_keeps_the_structure():
+    embeddings = low_rank()
+    proj = projection.fit(embeddings, dims=4)
+    assert (proj.source_dims, proj.dims) == (32, 4)
+    projected = proj.transform(embeddings)
+    # Rank 4 data fits in 4 dims: reconstructing it loses (almost) nothing
+    restored = projected @ proj.components + proj.mean
+    assert np.allclose(restored, embeddings, atol=1e-3)
+
+
+def test_random_projection_only_needs_the_shape():
+    proj = projection.fit(np.zeros((1, 32)), dims=8, kind="random")
+    assert (proj.source_dims, proj.dims) == (32, 8)
+    assert proj.accepts(np.zeros(32))
+    assert not proj.accepts(np.zeros(16))
+    assert not proj.accepts(None)
+
+
+def test_current_or_fit_saves_once(monkeypatch):
+    monkeypatch.setenv("PROJECTION_DIMS", "4")
+    first = projection.current_or_fit(low_rank())
+    assert first.dims == 4
+    assert projection.current_or_fit(low_rank(seed=1)).version == first.version
+    # Embeddings from another model get their own projection
+    assert projection.current(source_dims=16) is None
+
+    monkeypatch.setenv("PROJECTION_DIMS", "0")
+    assert projection.current_or_fit(low_rank()) is None
+
+
+def test_small_windows_are_not_saved(monkeypatch):
+    monkeypatch.setenv("PROJECTION_DIMS", "4")
+    # 4 dims need 8 toots
+    assert projection.current_or_fit(low_rank(n=7)) is None
+    assert projection.current() is None
+    assert projection.current_or_fit(low_rank(n=8)).dims == 4
+
+
+def test_refit_when_dims_go_up(monkeypatch):
+    monkeypatch.setenv("PROJECTION_DIMS", "2")
+    small = projection.current_or_fit(low_rank())
+    monkeypatch.setenv("PROJECTION_DIMS", "4")
+    bigger = projection.current_or_fit(low_rank())
+    assert (small.dims, bigger.dims) == (2, 4)
+    assert projection.current().version == bigger.version
+    # Embeddings with fewer dims than PROJECTION_DIMS don't get refitted over and over
+    monkeypatch.setenv("PROJECTION_DIMS", "64")
+    assert projection.current_or_fit(low_rank()).version == projection.current_or_fit(low_rank()).version
+
+
+def test_projected_vectors_are_cached():
+    embeddings = low_rank(n=3)
+    for id, embedding in enumerate(embeddings, start=1):
+        toot = core.Toot.from_dict(make_status(id, f"toot {id}"))
+        toot.embedding = embedding.astype(np.float64)
+        toot.save()
+    toots = core.Toot.get_toots_since(datetime.datetime(2000, 1, 1))
+    # One toot from a different embedding model
+    toots[2].embedding = np.zeros(16)
+    proj = projection.fit(embeddings, dims=2)
+
+    mask, vectors = proj.project_toots(toots)
+    assert mask.tolist() == [True, True, False]
+    assert np.allclose(vectors, proj.transform(embeddings[:2]), atol=1e-5)
+    with config.ConfigHandler.open_db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM toot_projections WHERE version = ?", (proj.version,)).fetchone()[0] == 2
+
+    # Served from the cache, even if the embedding changed since
+    toots[0].embedding = np.zeros(32)
+    _, cached = proj.project_toots(toots)
+    assert np.array_equal(cached, vectors)
+
+
+def test_stack_common_shape():
+    stacked = projection.stack_common_shape([np.ones(4), None, np.ones(2), np.zeros(4)])
+    assert stacked.shape == (2, 4)
+    assert projection.stack_common_shape([None]).shape == (0, 0)
+
+
+def test_toots_without_a_projected_embedding_are_left_out_of_training(monkeypatch):
+    monkeypatch.setenv("PROJECTION_DIMS", "4")
+    monkeypatch.setenv("SUMMARIZE_MODEL", local_models.SUMMARIZE_MODEL_ID)
+    start = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    rng = np.random.default_rng(0)
+    topics = ["cats", "boats", "bread"]
+    id = 0
+    for i in range(60):
+        id += 1
+        toot = core.Toot.from_dict(make_status(id, f"{topics[i % 3]} {i}", created_at=start + datetime.timedelta(seconds=id)))
+        toot.embedding = np.eye(3, 16)[i % 3] * 5 + rng.standard_normal(16) * 0.1
+        toot.save()
+        if i % 10 == 0:
+            # From another embedding model, so the projection doesn't take it
+            id += 1
+            other = core.Toot.from_dict(make_status(id, "other model", created_at=start + datetime.timedelta(seconds=id)))
+            other.embedding = np.ones(8)
+            other.save()
+
+    clustered = {}
+
+    def label_clusters(texts_by_cluster):
+        clustered.update(texts_by_cluster)
+        return {i: "label" for i in texts_by_cluster}
+
+    monkeypatch.setattr(local_models, "label_clusters", label_clusters)
+    context = algorithm.TrainContext(end_time=datetime.datetime.utcnow(), timedelta=datetime.timedelta(days=1), session_id="")
+    topic_cluster.TopicCluster.train(context, {"num_clusters": "3"})
+    # Every cluster is one topic
+    assert sorted(sorted({text.split()[0] for text in texts}) for texts in clustered.values()) == [["boats"], ["bread"], ["cats"]]
@@ -0,0 +1,47 @@
+import datetime
+import gzip
+import json
+import sqlite3
+
+from fossil_mastodon import config, core, retention
+
+from conftest import make_status
+
+
+def save_toots(statuses: list[dict]):
+    with config.ConfigHandler.open_db() as conn:
+        for status in statuses:
+            core.Toot.from_dict(status).save(init_conn=conn)
+
+
+def test_off_by_default():
+    assert retention._interval() == datetime.timedelta(0)
+
+
+def test_archive_goes_next_to_the_database(db_path):
+    assert config.ConfigHandler.ARCHIVE_PATH == str(db_path.with_name("fossil-archive.db"))
+
+
+def test_archives_old_toots_and_compacts(db_path):
+    now = datetime.datetime.utcnow()
+    save_toots([
+        make_status(1, "old news", created_at=now - datetime.timedelta(days=40)),
+        make_status(2, "fresh news", created_at=now - datetime.timedelta(days=1)),
+    ])
+
+    stats = retention.run(retention_days=30)
+
+    assert stats.archived == 1
+    assert [toot.status_id for toot in core.Toot.get_toots_since(now - datetime.timedelta(days=365))] == ["2"]
+    with sqlite3.connect(config.ConfigHandler.ARCHIVE_PATH) as archive:
+        codec, orig_json = archive.execute("SELECT codec, orig_json FROM archived_toots").fetchone()
+    assert codec == "gzip"
+    assert json.loads(gzip.decompress(orig_json))["content"] == "<p>old news</p>"
+    # Compacting switches the database to incremental auto_vacuum
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_zero_days_archives_nothing():
+    save_toots([make_status(1, created_at=datetime.datetime.utcnow() - datetime.timedelta(days=400))])
+    assert retention.run(retention_days=0).archived == 0
@@ -0,0 +1,64 @@
+import datetime
+
+import pytest
+
+from fossil_mastodon import client, config, core, retention, scheduler
+
+
+def test_background_refresh_is_opt_in(monkeypatch):
+    job = scheduler.get_job("refresh_timeline")
+    assert not job.is_due()
+
+    monkeypatch.setenv("REFRESH_INTERVAL_MINUTES", "15")
+    assert job.is_due()
+
+
+def test_jobs_run_again_after_their_interval(monkeypatch):
+    runs = []
+    monkeypatch.setattr(scheduler, "_jobs", {})
+    scheduler.periodic_job(datetime.timedelta(minutes=5), name="test_job")(lambda: runs.append(1))
+    job = scheduler.get_job("test_job")
+
+    scheduler.run_if_stale("test_job")
+    scheduler.run_if_stale("test_job")
+    assert runs == [1]
+    assert not job.is_due()
+    assert job.is_due(datetime.datetime.utcnow() + datetime.timedelta(minutes=6))
+
+
+def test_retention_is_registered_explicitly(monkeypatch):
+    monkeypatch.setattr(scheduler, "_jobs", {})
+    retention.register()
+    job = scheduler.get_job("retention")
+    # Off until RETENTION_DAYS is set
+    assert not job.is_due()
+
+    monkeypatch.setenv("RETENTION_DAYS", "30")
+    assert job.interval() == datetime.timedelta(hours=24)
+    assert job.is_due()
+
+
+def test_requests_see_errors_the_scheduler_only_records(monkeypatch):
+    monkeypatch.setattr(scheduler, "_jobs", {})
+
+    @scheduler.periodic_job(datetime.timedelta(0), name="failing_job")
+    def fails():
+        raise client.RateLimited("Too many requests", retry_after=60)
+
+    # A scheduled run logs it
+    scheduler.run_job("failing_job")
+    # A request that runs it inline gets the error
+    with pytest.raises(client.RateLimited):
+        scheduler.run_if_stale("failing_job")
+    with config.ConfigHandler.open_db() as conn:
+        assert "RateLimited" in conn.execute("SELECT last_error FROM scheduled_jobs WHERE name = 'failing_job'").fetchone()[0]
+
+
+def test_refresh_embeds_with_the_requesting_session(monkeypatch):
+    downloads = []
+    monkeypatch.setattr(core, "download_timeline", lambda since, session_id: downloads.append(session_id))
+    core.Session.get_or_create("first")
+    requesting = core.Session.get_or_create("second")
+
+    scheduler.run_if_stale("refresh_timeline", session_id=requesting.id)
+    assert downloads == [requesting.id]
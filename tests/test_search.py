@@ -0,0 +1,79 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from conftest import make_status
+from fossil_mastodon import config, core, search
+
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def save(id: int, text: str, embedding: list[float] | None = None):
+    toot = core.Toot.from_dict(make_status(id, text, account_id=id, created_at=START + datetime.timedelta(minutes=id)))
+    toot.embedding = None if embedding is None else np.array(embedding, dtype=np.float64)
+    toot.save()
+
+
+@pytest.fixture(autouse=True)
+def query_embedding(monkeypatch):
+    """
+    Queries embed to [1, 0], without loading a model.
+    """
+    search._query_embedding.cache_clear()
+    monkeypatch.setattr(search, "_query_embedding", lambda model_name, query: np.array([1.0, 0.0]))
+
+
+def ids(toots: list[core.Toot]) -> list[str]:
+    return [toot.status_id for toot in toots]
+
+
+def test_fts_query_quotes_every_term():
+    assert search.fts_query('cats AND "dogs" OR -birds*') == '"cats" "AND" "dogs" "OR" "birds"*'
+    assert search.fts_query("  ...  ") is None
+
+
+def test_index_follows_inserts_updates_and_deletes():
+    save(1, "the quick brown fox")
+    save(2, "a lazy dog")
+    assert ids(search.search("fox", "")[0]) == ["1"]
+    # Prefixes of the last word match, for search-as-you-type
+    assert ids(search.search("laz", "")[0]) == ["2"]
+
+    with config.ConfigHandler.open_db() as conn:
+        conn.execute("UPDATE toots SET plain_text = 'a lazy fox' WHERE status_id = '2'")
+        conn.execute("DELETE FROM toots WHERE status_id = '1'")
+        conn.commit()
+    assert ids(search.search("fox", "")[0]) == ["2"]
+    assert search.search("quick", "") == ([], None)
+
+
+def test_embeddings_rerank_the_word_matches():
+    # The same words, so BM25 can't tell them apart; the embeddings can
+    save(1, "python release notes", embedding=[0.0, 1.0])
+    save(2, "python release notes", embedding=[1.0, 0.1])
+    save(3, "python release notes")
+    toots, next_offset = search.search("python", "")
+    assert ids(toots) == ["2", "1", "3"]
+    assert next_offset is None
+
+
+def test_fuse_rewards_agreement():
+    assert search._fuse([1, 2, 3], [2]) == [2, 1, 3]
+    assert search._fuse([1, 2], []) == [1, 2]
+
+
+def test_pages(monkeypatch):
+    monkeypatch.setattr(search, "SCAN", 5)
+    monkeypatch.setattr(search, "CANDIDATES", 3)
+    for id in range(1, 13):
+        save(id, f"matching toot {id}")
+
+    seen, offset = [], 0
+    while offset is not None:
+        toots, offset = search.search("matching", "", offset=offset, limit=4)
+        seen += ids(toots)
+    # The newest SCAN are ranked, older matches follow newest first
+    assert sorted(seen[:5], key=int) == ["8", "9", "10", "11", "12"]
+    assert seen[5:] == ["7", "6", "5", "4", "3", "2", "1"]
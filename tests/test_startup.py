@@ -0,0 +1,70 @@
+import os
+import pathlib
+import pickle
+import subprocess
+import sys
+import time
+
+from fossil_mastodon import config
+from fossil_mastodon.plugin_impl import topic_cluster
+
+
+HEAVY_MODULES = ["sklearn", "llm", "tiktoken", "html2text", "tqdm", "streamlit"]
+
+
+def test_server_import_skips_heavy_modules(db_path):
+    code = (
+        "import sys, json; import fossil_mastodon.server; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=pathlib.Path(__file__).parent.parent, env={**os.environ, "DATABASE_PATH": str(db_path)})
+    assert out.stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_noop_kmeans_pickles_under_its_old_name():
+    kmeans = topic_cluster.NoopKMeans(n_clusters=1)
+    assert type(kmeans).__module__ == topic_cluster.__name__
+    assert type(pickle.loads(pickle.dumps(kmeans))) is topic_cluster.NoopKMeans
+
+
+def make_app_dir(path: pathlib.Path) -> pathlib.Path:
+    for mount_path in ["static", "templates"]:
+        (path / mount_path).mkdir(parents=True)
+    (path / "static" / "page.css").write_text("body {}")
+    (path / "templates" / "page.html").write_text("<p></p>")
+    return path
+
+
+def test_static_cache_key_follows_content(tmp_path):
+    make_app_dir(tmp_path)
+    before = config._cache_key(tmp_path)
+    assert config._cache_key(tmp_path) == before
+    (tmp_path / "static" / "page.css").write_text("body { color: red }")
+    assert config._cache_key(tmp_path) != before
+
+
+def test_plugin_files_stay_out_of_the_keyed_directory(tmp_path):
+    assets = config.StaticFiles.create(make_app_dir(tmp_path / "app"), tmp_path / "cache")
+    plugin_static = tmp_path / "plugin"
+    plugin_static.mkdir()
+    (plugin_static / "plugin.css").write_text("p {}")
+
+    assets.add_dir(plugin_static, "static")
+    assert not (assets.assets_path / "plugin.css").exists()
+    assert [(d / "plugin.css").exists() for d in assets.static_dirs] == [True, False]
+    # The same files, so the same directory
+    assert config.StaticFiles.create(tmp_path / "app", tmp_path / "cache").base_path == assets.base_path
+
+
+def test_prune_keeps_directories_in_use(tmp_path):
+    cache = tmp_path / "cache"
+    in_use = config.StaticFiles.create(make_app_dir(tmp_path / "v1"), cache).base_path
+    abandoned = cache / "abandoned"
+    abandoned.mkdir()
+    week_ago = time.time() - 8 * 24 * 3600
+    for path in [in_use, abandoned]:
+        os.utime(path, (week_ago, week_ago))
+
+    current = config.StaticFiles.create(make_app_dir(tmp_path / "v2"), cache).base_path
+    assert sorted(p.name for p in cache.iterdir() if p.is_dir()) == sorted([in_use.name, current.name, "plugins"])
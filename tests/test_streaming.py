@@ -0,0 +1,89 @@
+import contextvars
+import time
+
+import pytest
+from fastapi import FastAPI, responses
+from fastapi.testclient import TestClient
+
+from fossil_mastodon import config, metrics, plugins, server
+
+
+def test_small_pieces_are_batched():
+    pieces = ["x" * 100] * 200
+    chunks = list(plugins._buffered(iter(pieces), on_error=lambda ex: ""))
+    assert b"".join(chunks) == "".join(pieces).encode("utf-8")
+    # The first chunk goes out early, the rest are bigger
+    assert len(chunks[0]) == 1100
+    assert all(len(chunk) >= plugins._CHUNK_SIZE for chunk in chunks[1:-1])
+
+
+def test_errors_render_in_place():
+    def pieces():
+        yield "before "
+        raise ValueError("broken plugin")
+
+    chunks = plugins._buffered(pieces(), on_error=lambda ex: f"<div>{ex}</div>")
+    assert b"".join(chunks) == b"before <div>broken plugin</div>"
+
+
+def test_unhandled_errors_propagate():
+    def pieces():
+        yield "before "
+        raise ValueError("boom")
+
+    def on_error(ex):
+        raise ex
+
+    with pytest.raises(ValueError):
+        list(plugins._buffered(pieces(), on_error))
+
+
+def test_pieces_render_in_the_request_context():
+    var = contextvars.ContextVar("var", default="unset")
+
+    def pieces():
+        for _ in range(2):
+            yield var.get() + " " * plugins._CHUNK_SIZE
+
+    def start(chunks):
+        var.set("request")
+        return next(chunks)
+
+    chunks = plugins._buffered(pieces(), on_error=lambda ex: "")
+    # Starlette runs each step on a worker thread, in a copy of the request's context
+    first = contextvars.copy_context().run(start, chunks)
+    second = next(chunks)
+    assert first.startswith(b"request")
+    assert second.startswith(b"request")
+
+
+def slow_pieces():
+    for piece in ["<p>slow</p>"] * 3:
+        time.sleep(0.05)
+        yield piece
+
+
+def test_render_span_covers_the_body():
+    chunks = plugins._buffered(slow_pieces(), on_error=lambda ex: "", template="slow.html")
+    # Nothing is rendered until the body is sent
+    assert metrics.SPANS.count(span="template.render", error="false", template="slow.html") == 0
+    assert b"".join(chunks) == b"<p>slow</p>" * 3
+    assert metrics.SPANS.count(span="template.render", error="false", template="slow.html") == 1
+    assert metrics.SPANS.sum(span="template.render", error="false", template="slow.html") >= 0.15
+
+
+def test_profiles_cover_the_body(monkeypatch, tmp_path):
+    monkeypatch.setattr(config.ConfigHandler, "PROFILE_REQUESTS", "true")
+    monkeypatch.setattr(config.ConfigHandler, "PROFILE_DIR", str(tmp_path))
+    app = FastAPI()
+    app.middleware("http")(server.profile_middleware)
+
+    @app.get("/slow")
+    def slow():
+        return responses.StreamingResponse(plugins._buffered(slow_pieces(), on_error=lambda ex: ""))
+
+    client = TestClient(app)
+    assert "slow_pieces" in client.get("/slow", params={"profile": "text"}).text
+    response = client.get("/slow", params={"profile": "1"})
+    assert response.text == "<p>slow</p>" * 3
+    assert (tmp_path / response.headers["X-Fossil-Profile"].rsplit("/", 1)[-1]).exists()
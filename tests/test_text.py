@@ -0,0 +1,51 @@
+import datetime
+
+from fossil_mastodon import config, core, migrations, text
+
+
+def test_sanitize_keeps_mastodon_markup():
+    content = '<p>Hi <span class="h-card"><a href="https://mastodon.test/@a" class="u-url mention">@a</a></span><br/>there</p>'
+    assert text.sanitize_html(content) == (
+        '<p>Hi <span class="h-card"><a href="https://mastodon.test/@a" class="u-url mention" '
+        'rel="nofollow noopener noreferrer" target="_blank">@a</a></span><br>there</p>'
+    )
+
+
+def test_sanitize_drops_anything_dangerous():
+    content = (
+        '<p onclick="steal()">ok<script>alert(1)</script>'
+        '<a href="javascript:alert(1)">link</a><img src=x onerror=alert(1)>'
+        '<style>p { display: none }</style></p>'
+    )
+    assert text.sanitize_html(content) == '<p>ok<a rel="nofollow noopener noreferrer" target="_blank">link</a></p>'
+
+
+def test_sanitize_balances_tags():
+    assert text.sanitize_html("<p><strong>bold") == "<p><strong>bold</strong></p>"
+    assert text.sanitize_html("<p><em>a</p>b") == "<p><em>a</em></p>b"
+
+
+def test_plain_text_keeps_paragraphs():
+    content = "<p>First &amp; foremost</p><p>line one<br>line   two</p>"
+    assert text.plain_text(content) == "First & foremost\n\nline one\nline two"
+
+
+def test_empty_content():
+    assert text.plain_text(None) == ""
+    assert text.sanitize_html(None) == ""
+
+
+def test_text_is_stored_not_recomputed_on_read():
+    toot = core.Toot(content="<p>Hello <b>world</b></p>", author="a", url="https://example.test/1",
+                     created_at=datetime.datetime(2024, 1, 1))
+    toot.save()
+    with config.ConfigHandler.open_db() as conn:
+        conn.execute("INSERT INTO toots (content, url, created_at) VALUES ('<p>old</p>', 'https://example.test/2', '2024-01-01')")
+        conn.commit()
+        migrations.backfill_toot_text.apply(conn)
+        conn.commit()
+        rows = conn.execute("SELECT url, plain_text, safe_html FROM toots ORDER BY url").fetchall()
+    assert rows == [
+        ("https://example.test/1", "Hello world", "<p>Hello <b>world</b></p>"),
+        ("https://example.test/2", "old", "<p>old</p>"),
+    ]
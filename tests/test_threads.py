@@ -0,0 +1,86 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from conftest import make_status
+from fossil_mastodon import client, core, plugins, threads
+from fossil_mastodon.plugin_impl import ranked
+
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def save(id: int, in_reply_to_id: int | None = None) -> core.Toot:
+    core.Toot.from_dict(make_status(id, f"toot {id}", account_id=id, in_reply_to_id=in_reply_to_id,
+                                    created_at=START + datetime.timedelta(minutes=id))).save()
+    return load(id)
+
+
+def load(status_id: int) -> core.Toot:
+    return next(toot for toot in core.Toot.get_toots_since(START) if toot.status_id == str(status_id))
+
+
+class FakeResponse:
+    def __init__(self, data: dict):
+        self.data = data
+
+    def json(self) -> dict:
+        return self.data
+
+
+class FakeClient:
+    def __init__(self, context: dict):
+        self.context = context
+        self.calls = []
+
+    def get(self, path: str) -> FakeResponse:
+        self.calls.append(path)
+        return FakeResponse(self.context)
+
+
+@pytest.fixture
+def conversation() -> list[core.Toot]:
+    # 1 <- 2 <- 3, and 4 on its own
+    return [save(1), save(2, in_reply_to_id=1), save(3, in_reply_to_id=2), save(4)]
+
+
+def test_get_thread_from_the_index(conversation):
+    thread = threads.get_thread(conversation[2], fetch=False)
+    assert [toot.status_id for toot in thread.toots] == ["1", "2", "3"]
+    assert [thread.depth(toot) for toot in thread.toots] == [0, 1, 2]
+    assert not thread.incomplete
+
+
+def test_get_thread_fetches_missing_statuses_once(monkeypatch):
+    reply = save(11, in_reply_to_id=10)
+    fake = FakeClient({
+        "ancestors": [make_status(10, "the parent", created_at=START)],
+        "descendants": [make_status(12, "a reply", in_reply_to_id=11, created_at=START + datetime.timedelta(hours=1))],
+    })
+    monkeypatch.setattr(client, "get_client", lambda: fake)
+
+    thread = threads.get_thread(reply)
+    assert [toot.status_id for toot in thread.toots] == ["10", "11", "12"]
+    # Cached, so the next look doesn't call the API again
+    assert [toot.status_id for toot in threads.get_thread(reply).toots] == ["10", "11", "12"]
+    assert fake.calls == ["/api/v1/statuses/11/context"]
+
+
+def test_group_by_conversation(conversation):
+    one, two, three, four = conversation
+    grouped = threads.group_by_conversation([three, four, one])
+    assert [thread.root_id for thread in grouped] == ["1", "4"]
+    # In reading order, even though 3 came first
+    assert [[toot.status_id for toot in thread.toots] for thread in grouped] == [["1", "3"], ["4"]]
+
+
+def test_ranked_keeps_conversations_together(conversation):
+    one, two, three, four = conversation
+    model = ranked.Ranked(interests=np.zeros((0, 0)), author_affinity={"user3@mastodon.test": 1.0, "user4@mastodon.test": 0.5},
+                          half_life_hours=12, max_toots=10)
+    # Nothing gets rendered to HTML here
+    context = plugins.RenderContext.model_construct()
+    renderer = model.render([one, two, three, four], context)
+    # By score alone it'd be 3, 4, 1, 2. 3 ranks best, so its whole conversation comes first.
+    assert [toot.status_id for toot in renderer.toots] == ["1", "2", "3", "4"]
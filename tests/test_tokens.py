@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+import tiktoken
+
+from conftest import make_status
+from fossil_mastodon import config, core, tokens
+
+
+class WordEncoding:
+    """
+    One token per word, so the tests don't need tiktoken's downloaded vocabularies.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text: str) -> list[str]:
+        self.calls += 1
+        return text.split()
+
+    def encode_batch(self, texts: list[str], num_threads: int = 1) -> list[list[str]]:
+        self.calls += 1
+        return [text.split() for text in texts]
+
+    def decode(self, tokens: list[str]) -> str:
+        return " ".join(tokens)
+
+
+@pytest.fixture
+def encoding(monkeypatch) -> WordEncoding:
+    encoding = WordEncoding()
+    monkeypatch.setattr(tokens, "get_encoding", lambda model_name: encoding)
+    return encoding
+
+
+def test_count_in_batches(encoding):
+    assert tokens.count(["one two", "three"]) == [2, 1]
+    assert encoding.calls == 2
+
+    encoding.calls = 0
+    assert tokens.count(["a b c"] * 50) == [3] * 50
+    assert encoding.calls == 1
+    assert tokens.count([]) == []
+
+
+def test_toot_counts_are_stored(encoding):
+    core.Toot.from_dict(make_status(1, "four words right here")).save()
+    toot, = core.Toot.get_toots_since(datetime.datetime(2000, 1, 1))
+    assert toot.token_count is None
+
+    assert tokens.count_toots([toot]) == [4]
+    with config.ConfigHandler.open_db() as conn:
+        assert conn.execute("SELECT token_count FROM toots").fetchone()[0] == 4
+
+    encoding.calls = 0
+    toot, = core.Toot.get_toots_since(datetime.datetime(2000, 1, 1))
+    assert tokens.count_toots([toot]) == [4]
+    assert encoding.calls == 0
+
+
+def test_truncate(encoding):
+    assert tokens.truncate("one two three", 5, "any") == ("one two three", 3)
+    assert tokens.truncate("one two three", 2, "any") == ("one two", 2)
+
+
+def test_encoders_are_loaded_once(monkeypatch):
+    loads = []
+
+    def encoding_for_model(model_name):
+        loads.append(model_name)
+        return WordEncoding()
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", encoding_for_model)
+    tokens.get_encoding.cache_clear()
+    try:
+        assert tokens.get_encoding("m") is tokens.get_encoding("m")
+    finally:
+        tokens.get_encoding.cache_clear()
+    assert loads == ["m"]
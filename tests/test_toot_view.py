@@ -0,0 +1,53 @@
+import datetime
+
+from conftest import make_status
+from fossil_mastodon import config, core, ui
+
+
+def status() -> dict:
+    return make_status(
+        7, "look at this", replies_count=3,
+        media_attachments=[{"type": "image", "url": "https://mastodon.test/a.png", "preview_url": "https://mastodon.test/a-small.png"}],
+        card={"url": "https://example.com/story", "image": "https://example.com/story.png"},
+    )
+
+
+def load() -> core.Toot:
+    return core.Toot.get_toots_since(datetime.datetime(2000, 1, 1))[0]
+
+
+def test_view_from_status():
+    view = core.TootView.from_dict(status())
+    assert view.display_name == "User 1"
+    assert view.avatar_url == "https://mastodon.test/avatars/1.png"
+    assert view.replies_count == 3
+    assert [m.preview_url for m in view.media_attachments] == ["https://mastodon.test/a-small.png"]
+    assert (view.card_url, view.card_preview_url) == ("https://example.com/story", "https://example.com/story.png")
+    assert view.links == {
+        "ivory": "ivory://acct/openURL?url=https%3A//mastodon.test/%40user1/7",
+        "original": "https://mastodon.test/@user1/7",
+        "desktop": "https://mastodon.test/@user1@mastodon.test/7",
+    }
+
+
+def test_loaded_toots_render_from_the_stored_view(monkeypatch):
+    core.Toot.from_dict(status()).save()
+    toot = load()
+    # Rendering never needs the status JSON
+    def parse_json(toot):
+        raise AssertionError("parsed the status JSON")
+    monkeypatch.setattr(core, "_get_json", parse_json)
+    assert toot.avatar_url == "https://mastodon.test/avatars/1.png"
+    assert toot.has_thread
+    assert ui.LinkStyle("Ivory").toot_url(toot).startswith("ivory://")
+    assert ui.LinkStyle("Desktop").toot_url(toot) == "https://mastodon.test/@user1@mastodon.test/7"
+
+
+def test_toots_saved_before_views_fall_back_to_the_json():
+    core.Toot.from_dict(status()).save()
+    with config.ConfigHandler.open_db() as conn:
+        conn.execute("UPDATE toots SET view_json = NULL")
+        conn.commit()
+    toot = load()
+    assert toot.view.card_url == "https://example.com/story"
+    assert toot.view.replies_count == 3
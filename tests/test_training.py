@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from fossil_mastodon import config, training
+
+
+def blobs(n_per_cluster: int = 40, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    centers = np.eye(3, 8) * 10
+    labels = np.repeat(np.arange(3), n_per_cluster)
+    return centers[labels] + rng.standard_normal((len(labels), 8)), labels
+
+
+def test_stratified_sample_takes_every_stratum():
+    strata = np.array([0] * 90 + [1] * 9 + [2])
+    chosen = training.stratified_sample(strata, 10)
+    assert list(chosen) == sorted(chosen)
+    assert set(strata[chosen]) == {0, 1, 2}
+    assert (strata[chosen] == 0).sum() == 9
+
+
+def test_fit_kmeans_in_worker_processes(monkeypatch):
+    monkeypatch.setenv("TRAINING_PROCESSES", "1")
+    embeddings, truth = blobs()
+
+    kmeans, labels = training.fit_kmeans(embeddings, 3, strata=np.arange(len(embeddings)) % 4)
+    assert kmeans.cluster_centers_.dtype == np.float32
+    # The same clusters, whatever they're numbered
+    assert len({(t, l) for t, l in zip(truth, labels)}) == 3
+
+    # The next training reuses the same worker processes
+    pool = training._pool
+    training.fit_kmeans(embeddings, 3)
+    assert training._pool is pool
+
+
+def worker_state() -> tuple[bool, int]:
+    return "fossil_mastodon.server" in sys.modules, config.get_assets.cache_info().currsize
+
+
+def test_workers_do_not_load_the_web_app(monkeypatch):
+    monkeypatch.setenv("TRAINING_PROCESSES", "1")
+    # Nothing in the workers serves requests, so they shouldn't build the static assets
+    assert training._get_pool().submit(worker_state).result() == (False, 0)
+
+
+def test_shared_memory_is_released():
+    script = (
+        "import numpy as np\n"
+        "from fossil_mastodon import training\n"
+        "training.fit_kmeans(np.random.default_rng(0).standard_normal((100, 8)), 3)\n"
+        "training.silhouette_scores(np.random.default_rng(1).standard_normal((100, 8)), [2, 3])\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=300,
+                            env={**os.environ, "TRAINING_PROCESSES": "2"})
+    assert result.returncode == 0, result.stderr
+    assert "leaked" not in result.stderr
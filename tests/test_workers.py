@@ -0,0 +1,68 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from fossil_mastodon import workers
+
+
+pytestmark = pytest.mark.skipif(workers.fcntl is None, reason="file locks need fcntl")
+
+
+HOLD_LOCK = """
+import fcntl, sys, time
+f = open(sys.argv[1], "a")
+fcntl.flock(f, fcntl.LOCK_EX)
+print("locked", flush=True)
+time.sleep(60)
+"""
+
+
+@pytest.fixture
+def not_leader(monkeypatch):
+    monkeypatch.setattr(workers, "_leader_file", None)
+    yield
+    if workers._leader_file is not None:
+        workers._leader_file.close()
+
+
+def test_first_process_becomes_the_leader(db_path, not_leader):
+    assert workers.is_leader()
+    assert workers.is_leader()
+    assert workers._leader_file.name == f"{db_path}.leader.lock"
+
+
+def test_takes_over_when_the_leader_exits(db_path, not_leader):
+    leader = subprocess.Popen([sys.executable, "-c", HOLD_LOCK, f"{db_path}.leader.lock"],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        assert leader.stdout.readline().strip() == "locked"
+        assert not workers.is_leader()
+        assert not workers.is_leader()
+    finally:
+        leader.kill()
+        leader.wait()
+        leader.stdout.close()
+    # The OS released the dead leader's lock
+    assert workers.is_leader()
+
+
+def test_exclusive_serializes(db_path):
+    events = []
+    entered = threading.Event()
+
+    def first():
+        with workers.exclusive(str(db_path)):
+            entered.set()
+            time.sleep(0.2)
+            events.append("first done")
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    entered.wait()
+    with workers.exclusive(str(db_path)):
+        events.append("second in")
+    thread.join()
+    assert events == ["first done", "second in"]